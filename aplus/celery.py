@@ -1,3 +1,4 @@
+from collections import defaultdict
 import os
 import celery
 import datetime
@@ -5,6 +6,7 @@ from datetime import timedelta
 import logging
 from dateutil.relativedelta import relativedelta
 from time import sleep
+from urllib.parse import urlparse
 
 from django.conf import settings
 
@@ -44,29 +46,54 @@ def enroll():
             sleep(settings.SIS_ENROLL_DELAY)
 
 @app.task
-def retry_submissions():
+def retry_submissions(host=None):
+    """
+    Retries the expired pending submissions. The submissions of the hosts,
+    whose circuit is open, are skipped, and only one submission probes a host
+    in the half-open state. Give `host` to retry the submissions of one host.
+    """
     # pylint: disable-next=import-outside-toplevel
     from exercise.submission_models import PendingSubmission
+    # pylint: disable-next=import-outside-toplevel
+    from lib.circuit_breaker import CircuitBreaker
+    # pylint: disable-next=import-outside-toplevel
+    from lib.throttle import map_per_host
 
-    # Recovery state: only send one grading request to probe the state of grader
-    # We pick the one with most attempts, so that total_retries comes down more quickly
-    # when things are back to normal, and we can return to normal state
-    if not PendingSubmission.objects.is_grader_stable():
-        pending = PendingSubmission.objects.order_by('-num_retries').first()
-        # pylint: disable-next=logging-fstring-interpolation
-        logging.info(f"Recovery state: retrying expired submission {pending.submission}")
-        pending.submission.exercise.grade(pending.submission)
-        return
-
-    # Stable state: retry all expired submissions
     expiry_time = datetime.datetime.now(datetime.timezone.utc) - relativedelta(
         seconds=settings.SUBMISSION_EXPIRY_TIMEOUT
     )
-    expired = PendingSubmission.objects.filter(submission_time__lt=expiry_time)
-
+    # The one with most attempts goes first, so that it is the one to probe
+    # a recovering grader.
+    expired = PendingSubmission.objects.filter(
+        submission_time__lt=expiry_time,
+    ).order_by('-num_retries')
+    per_host = defaultdict(list)
     for pending in expired:
-        if pending.submission.exercise.can_regrade:
-            # pylint: disable-next=logging-fstring-interpolation
-            logger.info(f"Retrying expired submission {pending.submission}")
-            pending.submission.exercise.grade(pending.submission)
-            sleep(0.5)  # Delay 500 ms to avoid choking grader
+        exercise = pending.submission.exercise
+        if exercise.can_regrade:
+            per_host[urlparse(exercise.service_url).netloc].append(pending)
+    if host is not None:
+        per_host = {host: per_host.get(host, [])}
+
+    def retry(pending):
+        # The grader may have failed again meanwhile. Do not choke it further.
+        if CircuitBreaker.for_url(pending.submission.exercise.service_url).state() == CircuitBreaker.OPEN:
+            return
+        # pylint: disable-next=logging-fstring-interpolation
+        logger.info(f"Retrying expired submission {pending.submission}")
+        pending.submission.exercise.grade(pending.submission)
+
+    retries = []
+    for grading_host, pendings in per_host.items():
+        state = CircuitBreaker(grading_host).state()
+        if state == CircuitBreaker.OPEN:
+            logger.info("Circuit of %s is open, not retrying %d expired submissions", grading_host, len(pendings))
+            continue
+        if state == CircuitBreaker.HALF_OPEN:
+            # Send only one grading request to probe the state of the grader.
+            # A success retries the rest, see Submission.set_ready.
+            pendings = pendings[:1]
+        retries.extend((grading_host, pending) for pending in pendings)
+    # The grading requests are sent concurrently within GRADER_REQUEST_LIMITS.
+    for _result in map_per_host(retry, retries):
+        pass
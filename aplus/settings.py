@@ -126,8 +126,23 @@ EXCEL_CSV_DEFAULT_DELIMITER = ';'
 ##########################################################################
 
 # Exercise loading settings
+# Timeout in seconds for reading a response from an exercise service
 EXERCISE_HTTP_TIMEOUT = 15
+# Timeout in seconds for connecting to an exercise service (None: EXERCISE_HTTP_TIMEOUT)
+EXERCISE_HTTP_CONNECT_TIMEOUT = None
+# The maximum delays in seconds before the retries of a failed request. The
+# delays grow exponentially from EXERCISE_HTTP_RETRY_DELAY with random jitter.
 EXERCISE_HTTP_RETRIES = (5,5,5)
+EXERCISE_HTTP_RETRY_DELAY = 1
+# The connections to the exercise services are kept alive and reused. Each
+# process keeps at most EXERCISE_HTTP_POOL_SIZE idle connections to each of
+# at most EXERCISE_HTTP_POOL_HOSTS hosts.
+EXERCISE_HTTP_POOL_SIZE = 10
+EXERCISE_HTTP_POOL_HOSTS = 20
+# Number of seconds after the expiry time of an exercise page, during which
+# the expired page is shown while it is reloaded in the background. The page
+# is also shown, if the exercise service fails. 0 reloads it in the request.
+EXERCISE_CACHE_MAX_STALE = 24 * 60 * 60
 EXERCISE_ERROR_SUBJECT = """A+ exercise error in {course}: {exercise}"""
 EXERCISE_ERROR_DESCRIPTION = (
     '\nAs a course teacher or technical contact you were automatically emailed by A+ about the error incident. '
@@ -279,14 +294,47 @@ SUBMISSION_EXPIRY_TIMEOUT = 30 * 60
 # Network location is sufficient, e.g. "localhost:8080" or "grader.cs.aalto.fi"
 SUBMISSION_RETRY_SERVICES = []
 
-# Number of unresponded retries beyond which we move to recovery state.
-# In recovery state there likely is more persistent problem with the grader
-# or network that needs fixing.
-# In recovery state A+ periodically probes the state of the grader, sending only one
-# grading request out every SUBMISSION_EXPIRY_TIMEOUT seconds.
-# We do not want to congest the potentially broken system unnecessarily with several
-# requests in this case.
-GRADER_STABLE_THRESHOLD = 5
+# Circuit breakers of the exercise service hosts. The requests to each host
+# and their failures (connection errors, timeouts and 5xx responses) are
+# counted in the shared cache over the last GRADER_CIRCUIT_WINDOW seconds.
+# When there are at least GRADER_CIRCUIT_MIN_REQUESTS requests and the share
+# of the failures reaches GRADER_CIRCUIT_ERROR_RATE, the circuit of the host
+# opens: the requests to the host fail immediately, its expired submissions
+# are not retried and the course pages show an alert about its exercises.
+# After GRADER_CIRCUIT_OPEN_TIME seconds, doubled on each consecutive opening
+# up to GRADER_CIRCUIT_MAX_OPEN_TIME, a single request probes the host. The
+# circuit closes, if the probe succeeds, and the pending submissions of the
+# host are retried.
+GRADER_CIRCUIT_WINDOW = 60
+GRADER_CIRCUIT_MIN_REQUESTS = 5
+GRADER_CIRCUIT_ERROR_RATE = 0.5
+GRADER_CIRCUIT_OPEN_TIME = 30
+GRADER_CIRCUIT_MAX_OPEN_TIME = 30 * 60
+
+# Limits of the grading requests, which the mass regrading and the retries of
+# the expired submissions send to an exercise service host: the number of
+# concurrent requests and the maximum rate of requests per second (None for
+# no limit). The keys are network locations, e.g. "grader.cs.aalto.fi", and
+# the limits of 'default' apply to the other hosts.
+GRADER_REQUEST_LIMITS = {
+    'default': {'concurrency': 1, 'rate': 2},
+}
+
+# Send the new submissions to the graders in a celery task instead of during
+# the web request that creates them. The student waits for the feedback on the
+# submission page, which polls the submission status. Only the services in
+# SUBMISSION_RETRY_SERVICES are used so, since their submissions are retried,
+# if the task is lost. The celery workers must be able to read the submitted
+# files in MEDIA_ROOT.
+ASYNC_GRADING = False
+
+# Warm up the caches of a course with a celery task, when its content
+# changes. The task runs this many seconds after the first change, so that
+# a burst of changes is handled by one task. None disables the warm-up.
+CACHE_WARM_UP_DELAY = None
+# The cached points are regenerated for the users who have submitted in
+# the course during this many days.
+CACHE_WARM_UP_ACTIVE_DAYS = 7
 
 ## Celery
 CELERY_ACCEPT_CONTENT = ['json']
@@ -296,6 +344,7 @@ CELERY_BROKER_URL = 'redis://redis:6379'
 CELERY_RESULT_BACKEND = 'redis://redis:6379'
 
 MIDDLEWARE = [
+    'lib.middleware.RequestRegistryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -372,6 +421,10 @@ CACHES = {
         'OPTIONS': {'MAX_SIZE': 1000000}, # simulate memcached value limit
     }
 }
+# Size in bytes of the in-process memory cache, which is kept in front of the
+# shared cache above for the cached course content, points, menus etc.
+# Each process keeps its own copy. 0 disables the in-process cache.
+CACHED_LOCAL_MEMORY_SIZE = 0
 # The default SESSION_ENGINE is 'django.contrib.sessions.backends.db' (database)
 # Cache-based sessions require the Memcached cache backend.
 #SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
@@ -454,6 +507,14 @@ REMOTE_PAGE_HOSTS_MAP = None
 # Set this value to zero in order to remove the limit.
 MAX_UNOFFICIAL_SUBMISSIONS = 200
 
+# Read the points of the resultsdata and aggregatedata APIs from the exercise
+# results (exercise.models.ExerciseResult) instead of aggregating them from
+# the submissions. While this is enabled, the results are kept up to date
+# when the submissions change, which adds a few queries and row locks to every
+# saved submission. After enabling this, compute the results of the existing
+# submissions with the management command update_exercise_results.
+USE_EXERCISE_RESULTS = False
+
 # Testing
 # https://docs.djangoproject.com/en/1.7/topics/testing/advanced/
 TEST_RUNNER = "xmlrunner.extra.djangotestrunner.XMLTestRunner"
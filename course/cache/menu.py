@@ -7,6 +7,7 @@ from ..renders import render_group_info
 
 class CachedTopMenu(CachedAbstract):
     KEY_PREFIX = 'topmenu'
+    COMPRESS = True
 
     def __init__(self, user):
         self.user = user
@@ -29,6 +29,7 @@ from requests.exceptions import HTTPError
 from apps.models import BaseTab, BasePlugin
 from authorization.models import JWTAccessible
 from authorization.object_permissions import register_jwt_accessible_class
+from lib.cache import registry as request_registry
 from lib.fields import PercentField, DefaultOneToOneField, DefaultForeignKey
 from lib.helpers import (
     Enum,
@@ -292,10 +293,16 @@ def pseudonymize(sender, instance, created, **kwargs): # pylint: disable=unused-
         instance.anon_name = codename
         instance.save(update_fields=['anon_name'])
 
+def clear_request_registry(sender, instance, **kwargs): # pylint: disable=unused-argument
+    # The roles of the user may have changed.
+    request_registry.clear()
+
 
 post_save.connect(create_enrollment_code, sender=Enrollment)
 post_save.connect(create_anon_id, sender=Enrollment)
 post_save.connect(pseudonymize, sender=Enrollment)
+post_save.connect(clear_request_registry, sender=Enrollment)
+post_delete.connect(clear_request_registry, sender=Enrollment)
 
 
 class UserTag(UrlMixin, ColorTag):
@@ -812,12 +819,20 @@ class CourseInstance(UrlMixin, models.Model):
         if self.image:
             resize_image(self.image.path, (800,600))
 
+    def _has_active_role(self, user, role):
+        enrollment = self.get_enrollment_for(user)
+        return (
+            enrollment is not None
+            and enrollment.role == role
+            and enrollment.status == Enrollment.ENROLLMENT_STATUS.ACTIVE
+        )
+
     def is_assistant(self, user):
         return (
             user and
             user.is_authenticated and
             isinstance(user, User) and
-            self.assistants.filter(id=user.userprofile.id).exists()
+            self._has_active_role(user, Enrollment.ENROLLMENT_ROLE.ASSISTANT)
         )
 
     def is_teacher(self, user):
@@ -826,7 +841,7 @@ class CourseInstance(UrlMixin, models.Model):
             user.is_authenticated and (
                 user.is_superuser or (
                     isinstance(user, User) and
-                    self.teachers.filter(id=user.userprofile.id).exists()
+                    self._has_active_role(user, Enrollment.ENROLLMENT_ROLE.TEACHER)
                 ) or (
                     isinstance(user, GraderUser) and
                     (Permission.WRITE, self.course) in user.permissions.courses
@@ -842,7 +857,7 @@ class CourseInstance(UrlMixin, models.Model):
             user and
             user.is_authenticated and
             isinstance(user, User) and
-            self.students.filter(id=user.userprofile.id).exists()
+            self._has_active_role(user, Enrollment.ENROLLMENT_ROLE.STUDENT)
         )
 
     def is_banned(self, user):
@@ -972,6 +987,7 @@ class CourseInstance(UrlMixin, models.Model):
             for e in qs:
                 invalidate_content(Enrollment, e)
             delcount = qs.update(status=Enrollment.ENROLLMENT_STATUS.REMOVED)
+            request_registry.clear()
         else:
             logger.warning("%s: Received an empty participants list from SIS.", self)
             return 0, 0
@@ -1026,10 +1042,13 @@ class CourseInstance(UrlMixin, models.Model):
         UserTagging.objects.create(tag=tag, user=user.userprofile, course_instance=self)
 
     def get_enrollment_for(self, user):
-        try:
-            return Enrollment.objects.get(course_instance=self, user_profile=user.userprofile)
-        except Enrollment.DoesNotExist:
-            return None
+        def get_enrollment():
+            try:
+                return Enrollment.objects.get(course_instance=self, user_profile=user.userprofile)
+            except Enrollment.DoesNotExist:
+                return None
+        # The enrollment is shared by all role checks of a request.
+        return request_registry.memoize(('enrollment', self.id, user.id), get_enrollment)
 
     def get_user_tags(self, user):
         return self.taggings.filter(user=user.uesrprofile).select_related('tag')
@@ -6,7 +6,7 @@ from django.utils.safestring import mark_safe
 from django.utils.text import format_lazy
 from django.utils.translation import get_language, gettext_lazy as _
 from lib.helpers import remove_query_param_from_url, settings_text, update_url_params
-from exercise.submission_models import PendingSubmission
+from exercise.exercise_models import BaseExercise
 
 
 register = template.Library()
@@ -45,7 +45,7 @@ def brand_institution_name():
 
 @register.simple_tag
 def course_alert(instance):
-    exercises = PendingSubmission.objects.get_exercise_names_if_grader_is_unstable(instance)
+    exercises = BaseExercise.objects.get_names_with_unavailable_service(instance)
     if exercises:
         message = format_lazy(
             _('GRADER_PROBLEMS_ALERT -- {exercises}'),
@@ -1,5 +1,4 @@
 from typing import Any, Dict, List, Union
-from copy import deepcopy
 
 from django import template
 from django.db import models
@@ -100,8 +99,7 @@ def deadline_extended_exercise_open(entry, now):
 
 @register.filter
 def deadline_extended_exercises_open(entry, now):
-    entries = deepcopy(entry['flatted'])
-    return any(_deadline_extended_exercise_open(entry, now) for entry in entries)
+    return any(_deadline_extended_exercise_open(child, now) for child in entry['flatted'])
 
 
 @register.filter
@@ -11,6 +11,7 @@ from course.models import Course, CourseInstance, CourseHook, CourseModule, \
     LearningObjectCategory, StudentGroup
 from exercise.models import BaseExercise, Submission
 from exercise.exercise_models import LearningObject
+from lib.cache.registry import request_scope
 
 
 class CourseTest(TestCase):
@@ -208,6 +209,21 @@ class CourseTest(TestCase):
         self.assertFalse(self.current_course_instance.is_course_staff(self.user))
         self.assertEqual(0, len(self.current_course_instance.get_course_staff_profiles()))
 
+    def test_course_roles_in_request(self):
+        instance = self.current_course_instance
+        instance.add_assistant(self.user.userprofile)
+        with request_scope():
+            # The enrollment is fetched once for all role checks
+            with self.assertNumQueries(1):
+                self.assertTrue(instance.is_assistant(self.user))
+                self.assertFalse(instance.is_teacher(self.user))
+                self.assertFalse(instance.is_student(self.user))
+                self.assertIsNotNone(instance.get_enrollment_for(self.user))
+            # Changes to the enrollment are seen during the same request
+            instance.add_teacher(self.user.userprofile)
+            self.assertFalse(instance.is_assistant(self.user))
+            self.assertTrue(instance.is_teacher(self.user))
+
     def test_course_instance_submitters(self):
         students = self.current_course_instance.get_submitted_profiles()
         self.assertEqual(1, len(students))
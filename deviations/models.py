@@ -1,5 +1,6 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Any, Dict, Generic, Iterable, Optional, TypeVar, Union
+from typing import TYPE_CHECKING, Any, Dict, Generic, Iterable, List, Optional, Set, Tuple, TypeVar, Union
 
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -68,6 +69,58 @@ class SubmissionRuleDeviationManager(models.Manager[TModel], Generic[TModel]):
             previous_exercise_id = deviation.exercise.id
             yield deviation
 
+    def get_max_deviations_for_submitters(
+        self,
+        submitters: Iterable[UserProfile],
+        exercises: Iterable[Union[BaseExercise, int]],
+    ) -> Dict[int, List[TModel]]:
+        """
+        Like `get_max_deviations`, but for many submitters at once. Returns a
+        dict, which maps the submitter ids to the maximum deviations of that
+        submitter (one deviation per exercise).
+        """
+        submitter_ids = {submitter.id for submitter in submitters}
+        deviations = list(
+            self.filter(exercise__in=exercises)
+            .select_related('exercise')
+            .order_by('exercise', self.max_order_by)
+        )
+        if not deviations:
+            return {}
+
+        # Find the submitters, who have submitted the deviation's exercise
+        # together with the owner of the deviation.
+        owners = {(deviation.exercise_id, deviation.submitter_id) for deviation in deviations}
+        groups: Dict[int, Tuple[int, Set[int]]] = {}
+        for submission_id, exercise_id, profile_id in (
+            Submission.submitters.through.objects
+            .filter(
+                submission__exercise__in={exercise_id for exercise_id, _ in owners},
+                submission__submitters__in={owner_id for _, owner_id in owners},
+            )
+            .values_list('submission_id', 'submission__exercise_id', 'userprofile_id')
+            .distinct()
+        ):
+            groups.setdefault(submission_id, (exercise_id, set()))[1].add(profile_id)
+        group_members: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+        for exercise_id, profile_ids in groups.values():
+            for profile_id in profile_ids:
+                if (exercise_id, profile_id) in owners:
+                    group_members[(exercise_id, profile_id)].update(profile_ids)
+
+        max_deviations: Dict[int, List[TModel]] = defaultdict(list)
+        seen = set()
+        for deviation in deviations:
+            receivers = group_members.get((deviation.exercise_id, deviation.submitter_id), set())
+            receivers = (receivers | {deviation.submitter_id}) & submitter_ids
+            for submitter_id in receivers:
+                # The deviations are ordered so that the maximum deviation
+                # of each exercise comes first.
+                if (submitter_id, deviation.exercise_id) not in seen:
+                    seen.add((submitter_id, deviation.exercise_id))
+                    max_deviations[submitter_id].append(deviation)
+        return max_deviations
+
     def get_max_deviation(self, submitter: UserProfile, exercise: Union[BaseExercise, int]) -> Optional[TModel]:
         """
         Returns the maximum deviation for the given submitter in the given
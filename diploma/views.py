@@ -42,7 +42,7 @@ class DiplomaListView(DiplomaMixin, BaseTemplateView):
     def get_common_objects(self) -> None:
         super().get_common_objects()
 
-        students = self.instance.students.all()
+        students = self.instance.students.select_related('user')
         group = self.request.GET.get("group")
         if group == "internal":
             students = [s for s in students if not s.is_external]
@@ -51,9 +51,15 @@ class DiplomaListView(DiplomaMixin, BaseTemplateView):
 
         point_limits = self.design.point_limits
         pad_points = self.design.pad_points
+        student_points = CachedPoints.build_many(
+            self.instance,
+            [profile.user for profile in students],
+            self.content,
+            self.is_course_staff,
+        )
         student_grades = []
         for profile in students:
-            points = CachedPoints(self.instance, profile.user, self.content, self.is_course_staff)
+            points = student_points[profile.user.id]
             student_grades.append((
                 profile,
                 calculate_grade(points.total(), point_limits, pad_points),
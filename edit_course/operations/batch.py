@@ -1,3 +1,4 @@
+from collections import defaultdict
 import json
 from django.utils import timezone
 from django.utils.text import format_lazy
@@ -5,6 +6,7 @@ from django.utils.translation import gettext_lazy as _
 
 from exercise.models import BaseExercise, Submission
 from lib.helpers import extract_form_errors
+from notification.models import Notification
 from ..submission_forms import BatchSubmissionCreateAndReviewForm
 
 
@@ -69,6 +71,7 @@ def create_submissions(instance, admin_profile, json_text):
             )
 
     if not errors:
+        notified = defaultdict(list)
         for form in validated_forms:
             sub = Submission.objects.create(exercise=form.exercise)
             sub.submitters.set(form.cleaned_students)
@@ -80,5 +83,9 @@ def create_submissions(instance, admin_profile, json_text):
             sub.grader = form.cleaned_data.get("grader") or admin_profile
             sub.set_ready()
             sub.save()
+            if form.cleaned_data.get("notify"):
+                notified[sub.grader].append(sub)
+        for grader, submissions in notified.items():
+            Notification.send_many(submissions, grader)
 
     return errors
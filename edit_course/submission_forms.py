@@ -8,6 +8,7 @@ class BatchSubmissionCreateAndReviewForm(SubmissionCreateAndReviewForm):
 
     grader = forms.ModelChoiceField(queryset=UserProfile.objects.none(),
         required=False)
+    notify = forms.BooleanField(required=False)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
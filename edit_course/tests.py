@@ -4,6 +4,7 @@ from django.test import override_settings
 from course.models import CourseInstance
 from exercise.models import BaseExercise
 from lib.testdata import CourseTestCase
+from notification.models import Notification
 
 
 class CourseCloneTest(CourseTestCase):
@@ -145,7 +146,8 @@ class BatchAssessTest(CourseTestCase):
               'grader': self.teacher.userprofile.id,
               'exercise_id': 1,
               'submission_time': '2014-09-24 11:50',
-              'points': 99
+              'points': 99,
+              'notify': True,
             }
           ]
         })
@@ -161,3 +163,6 @@ class BatchAssessTest(CourseTestCase):
         sub = subs.first()
         self.assertEqual(sub.feedback, 'Generic exercise feedback')
         self.assertEqual(sub.grade, 99)
+        notification = Notification.objects.get(submission=sub)
+        self.assertEqual(notification.recipient, self.student.userprofile)
+        self.assertEqual(notification.sender, self.teacher.userprofile)
@@ -19,6 +19,7 @@ from exercise.models import (
     ExerciseTask,
     LearningObjectDisplay,
     PendingSubmission,
+    ExerciseResult,
 )
 from exercise.exercisecollection_models import ExerciseCollection
 from lib.admin_helpers import make_column_link, RecentCourseInstanceListFilter
@@ -526,6 +527,29 @@ class PendingSubmissionAdmin(admin.ModelAdmin):
         return Submission.STATUS[pending_submission.submission.status]
 
 
+class ExerciseResultAdmin(admin.ModelAdmin):
+    search_fields = (
+        'exercise__name',
+        'exercise__course_module__course_instance__instance_name',
+        'profile__student_id',
+        'profile__user__username',
+        'profile__user__email',
+    )
+    list_display = (
+        'exercise',
+        'profile',
+        'points',
+        'submission_count',
+        'last_submission_time',
+    )
+    raw_id_fields = (
+        'exercise',
+        'profile',
+    )
+    # The results are computed from the submissions.
+    readonly_fields = ExerciseResult.COMPUTED_FIELDS
+
+
 admin.site.register(CourseChapter, CourseChapterAdmin)
 admin.site.register(BaseExercise, BaseExerciseAdmin)
 admin.site.register(StaticExercise, StaticExerciseAdmin)
@@ -540,3 +564,4 @@ admin.site.register(RevealRule, RevealRuleAdmin)
 admin.site.register(ExerciseTask, ExerciseTaskAdmin)
 admin.site.register(LearningObjectDisplay, LearningObjectDisplayAdmin)
 admin.site.register(PendingSubmission, PendingSubmissionAdmin)
+admin.site.register(ExerciseResult, ExerciseResultAdmin)
@@ -1,6 +1,8 @@
 from django.conf import settings
 from collections import OrderedDict
 
+from .user_tags import tags_by_profile
+
 # Generate students' results from this course instance
 # Only exercises in which student has submitted answers will be returned
 # to save bandwidth. Exercise points are returned in the form:
@@ -33,9 +35,7 @@ def aggregate_points(profiles, taggings, exercises, aggregate): # pylint: disabl
         user_row[ex] = values
         agg[row['submitters__user_id']] = user_row
 
-    # Prefetch all tag_id - user_id pairs at once from DB to avoid multiple queries
-    # TODO: Ideally this should probably be done in api.csv.views
-    all_tags = list(taggings.all().values('user_id','tag_id'))
+    tags = tags_by_profile(taggings)
 
     sheet = []
 
@@ -45,13 +45,7 @@ def aggregate_points(profiles, taggings, exercises, aggregate): # pylint: disabl
         user_tags = [
             settings.EXTERNAL_USER_LABEL.lower() if profile.is_external else settings.INTERNAL_USER_LABEL.lower()
         ]
-        # Instead of filtering the Django resultset (which causes a new DB query),
-        # we find the users' tags manually from the prefetched array of dicts
-        other_tags = list(item for item in all_tags if item["user_id"] == profile.id)
-        #other_tags = all_tags.all().filter(user_id=profile.id)
-        for tag in other_tags:
-            user_tags.append(str(tag['tag_id']))
-        #user_tags.extend(tags.get(uid, []))
+        user_tags.extend(tags.get(profile.id, []))
         row = OrderedDict([
             ('UserID', uid),
             ('Email', profile.user.email),
@@ -1,5 +1,7 @@
 from collections import OrderedDict
 
+from .user_tags import tags_by_profile
+
 
 def aggregate_sheet(profiles, taggings, exercises, aggregate, number): # pylint: disable=too-many-locals
     DEFAULT_FIELDS = [
@@ -60,19 +62,14 @@ def aggregate_sheet(profiles, taggings, exercises, aggregate, number): # pylint:
         user_row[num] = values
         agg[uid] = user_row
 
-    tags = {}
-    for t in taggings:
-        if t.user_id in tags:
-            tags[t.user_id].append(str(t.tag_id))
-        else:
-            tags[t.user_id] = [str(t.tag_id)]
+    tags = tags_by_profile(taggings)
 
     sheet = []
     for profile in profiles:
         uid = profile.user.id
         user_row = agg.get(uid, {})
         user_tags = ['mooc' if profile.is_external else 'aalto']
-        user_tags.extend(tags.get(uid, []))
+        user_tags.extend(tags.get(profile.id, []))
         row = OrderedDict([
             ('UserID', uid),
             ('StudentID', profile.student_id),
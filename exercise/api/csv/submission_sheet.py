@@ -1,5 +1,5 @@
 from collections import OrderedDict
-from typing import Any, Dict, Iterable, List, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
 
 from rest_framework.request import Request
 from rest_framework.reverse import reverse
@@ -42,20 +42,89 @@ def filter_best_submissions(
     return filtered
 
 
-def submissions_sheet( # noqa: MC0001
-        request: Request,
+DEFAULT_FIELDS = [
+    'ExerciseID', 'Category', 'Exercise', 'SubmissionID', 'Time',
+    'UserID', 'StudentID', 'Email', 'Status',
+    'Grade', 'Penalty', 'Graded', 'GraderEmail', 'Notified', 'NSeen',
+]
+
+
+def iter_best_submissions(
         submissions: Iterable[Submission],
         revealed_ids: Set[int],
-        ) -> Tuple[List[Dict[str, Any]], List[str]]:
-    DEFAULT_FIELDS = [
-        'ExerciseID', 'Category', 'Exercise', 'SubmissionID', 'Time',
-        'UserID', 'StudentID', 'Email', 'Status',
-        'Grade', 'Penalty', 'Graded', 'GraderEmail', 'Notified', 'NSeen',
-    ]
-    sheet = []
+        ) -> Iterator[Submission]:
+    """
+    Yields the same submissions as `filter_best_submissions` from
+    submissions ordered by the exercise. Only the submissions of one
+    exercise are kept in memory at a time.
+    """
+    best = {}
+    forced = {}
+    eid = None
+
+    for s in submissions:
+        if s.exercise_id != eid:
+            for sub, _g in best.values():
+                yield sub
+            eid = s.exercise_id
+            best = {}
+            forced = {}
+
+        if s.status == 'ready':
+            submitters = list(s.submitters.all())
+            uid = min(p.id for p in submitters) if submitters else 0
+            grade = s.grade if eid in revealed_ids else 0
+            if s.force_exercise_points:
+                best[uid] = (s,grade)
+                forced[uid] = True
+            if not forced.get(uid):
+                old = best.get(uid)
+                if not old or grade >= old[1] or s.exercise.grading_mode == BaseExercise.GRADING_MODE.LAST:
+                    best[uid] = (s,grade)
+
+    for sub, _g in best.values():
+        yield sub
+
+
+def add_form_spec_fields(exercise: BaseExercise, fields: List[str], files: List[str]) -> None:
+    """Appends the keys of the form fields of the exercise to fields and files."""
+    if exercise.exercise_info:
+        for e in exercise.exercise_info.get('form_spec', []):
+            t = e['type']
+            k = e['key']
+            if t == 'file':
+                if k not in files:
+                    files.append(k)
+            elif t != 'static':
+                if k not in fields:
+                    fields.append(k)
+
+
+def submissions_sheet_header(exercises: Iterable[BaseExercise]) -> List[str]:
+    """
+    Returns the columns of the submission sheet of the exercises based on
+    their form specifications, so that the rows can be written as they
+    are read. Submitted values of fields, which are not in the form
+    specifications, are not included.
+    """
     fields = []
     files = []
+    for exercise in exercises:
+        add_form_spec_fields(exercise, fields, files)
+    return DEFAULT_FIELDS + fields + files
 
+
+def iter_submissions_rows( # noqa: MC0001
+        request: Request,
+        submissions: Iterable[Submission],
+        revealed_ids: Set[int],
+        fields: List[str],
+        files: List[str],
+        ) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the rows of the submission sheet. The keys of the submitted
+    fields and files, which are seen, are appended to fields and files.
+    """
     def url(submission, obj):
         return reverse(
             'api:submission-files-detail',
@@ -67,19 +136,10 @@ def submissions_sheet( # noqa: MC0001
         )
 
     exercise = None
-    for s in submissions: # pylint: disable=too-many-nested-blocks
+    for s in submissions:
         if s.exercise != exercise:
             exercise = s.exercise
-            if exercise.exercise_info:
-                for e in exercise.exercise_info.get('form_spec', []):
-                    t = e['type']
-                    k = e['key']
-                    if t == 'file':
-                        if k not in files:
-                            files.append(k)
-                    elif t != 'static':
-                        if k not in fields:
-                            fields.append(k)
+            add_form_spec_fields(exercise, fields, files)
 
         grader = s.grader.user.email if s.grader else None
 
@@ -127,6 +187,15 @@ def submissions_sheet( # noqa: MC0001
             r['UserID'] = profile.user.id
             r['StudentID'] = profile.student_id
             r['Email'] = profile.user.email
-            sheet.append(r)
+            yield r
+
 
+def submissions_sheet(
+        request: Request,
+        submissions: Iterable[Submission],
+        revealed_ids: Set[int],
+        ) -> Tuple[List[Dict[str, Any]], List[str]]:
+    fields = []
+    files = []
+    sheet = list(iter_submissions_rows(request, submissions, revealed_ids, fields, files))
     return sheet, DEFAULT_FIELDS + fields + files
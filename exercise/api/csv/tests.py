@@ -1,13 +1,20 @@
+import csv
 from datetime import timedelta
+from io import StringIO
 
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from django.utils import timezone
+from rest_framework.test import APIClient
 
-from course.models import Course, CourseInstance, CourseModule
+from course.models import Course, CourseInstance, CourseModule, UserTag, UserTagging
 from exercise.models import BaseExercise, CourseChapter, LearningObjectCategory
-from exercise.submission_models import Submission
+from exercise.submission_models import ExerciseResult, Submission
+from lib.testdata import CourseTestCase
 
+from .aggregate_points import aggregate_points
+from .aggregate_sheet import aggregate_sheet
 from .views import CourseResultsDataViewSet
 
 class CourseResultsDataViewSetTest(TestCase):
@@ -198,4 +205,103 @@ class CourseResultsDataViewSetTest(TestCase):
         create_submission(self.student_profile2, exercise=self.c1_mandatory_learning_object1, grade=2)
 
         self.assertEqual(query(True), all_submissions())
-        self.assertEqual(query(False), confirmed_submissions())
\ No newline at end of file
+        self.assertEqual(query(False), confirmed_submissions())
+
+
+class ExerciseResultsTest(CourseTestCase):
+
+    @override_settings(USE_EXERCISE_RESULTS=True)
+    def test_exercise_results(self):
+        # The results of the submissions saved before enabling the setting.
+        call_command('update_exercise_results', stdout=StringIO())
+        self.exercise.grading_mode = BaseExercise.GRADING_MODE.LAST
+        self.exercise.save()
+        self.submission2.set_points(0, 2)
+        self.submission2.set_ready()
+        self.submission2.save()
+        self.submission3.set_points(2, 2)
+        self.submission3.status = Submission.STATUS.UNOFFICIAL
+        self.submission3.save()
+
+        result = ExerciseResult.objects.get(exercise=self.exercise, profile=self.student.userprofile)
+        self.assertEqual(result.grading_mode, BaseExercise.GRADING_MODE.LAST)
+        self.assertEqual(result.best_submission_id, self.submission2.id)
+        self.assertEqual((result.points, result.submission_count), (0, 2))
+        result = ExerciseResult.objects.get(exercise=self.exercise2, profile=self.user.userprofile)
+        self.assertEqual(
+            (result.points, result.submission_count, result.unofficial_points, result.unofficial_count),
+            (0, 0, self.submission3.grade, 1),
+        )
+        self.assertTrue(result.unofficial)
+
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        for endpoint in ('resultsdata', 'aggregatedata'):
+            url = '/api/v2/courses/{:d}/{}/'.format(self.instance.id, endpoint)
+            for params in ({'format': 'csv'}, {'format': 'csv', 'show_unofficial': 'true'}):
+                with self.settings(USE_EXERCISE_RESULTS=False):
+                    response = client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                from_results = client.get(url, params)
+                self.assertEqual(from_results.content, response.content)
+
+        self.submission3.submitters.remove(self.user.userprofile)
+        self.assertFalse(ExerciseResult.objects.filter(profile=self.user.userprofile).exists())
+        self.submission.delete()
+        result = ExerciseResult.objects.get(exercise=self.exercise, profile=self.student.userprofile)
+        self.assertEqual(result.submission_count, 1)
+
+
+class AggregatePointsTest(CourseTestCase):
+
+    def test_tags(self):
+        tag1 = UserTag.objects.create(course_instance=self.instance, name="tag1")
+        tag2 = UserTag.objects.create(course_instance=self.instance, name="tag2")
+        UserTagging.objects.set(self.student.userprofile, tag1)
+        UserTagging.objects.set(self.student.userprofile, tag2)
+        UserTagging.objects.set(self.user.userprofile, tag2)
+        profiles = [self.student.userprofile, self.user.userprofile, self.teacher.userprofile]
+        expected = [
+            {str(tag1.id), str(tag2.id)},
+            {str(tag2.id)},
+            set(),
+        ]
+        points, _ = aggregate_points(profiles, self.instance.taggings.all(), [], [])
+        sheet, _ = aggregate_sheet(profiles, self.instance.taggings.all(), [], [], "")
+        for rows in (points, sheet):
+            self.assertEqual([set(row['Tags'].split('|')[1:]) for row in rows], expected)
+
+
+class CourseSubmissionDataViewSetTest(CourseTestCase):
+
+    def test_stream(self):
+        self.exercise.exercise_info = {'form_spec': [
+            {'type': 'text', 'key': 'field_0'},
+            {'type': 'static', 'key': 'info'},
+            {'type': 'file', 'key': 'file1'},
+        ]}
+        self.exercise.save()
+        Submission.objects.update(submission_data=None)
+        self.submission.submission_data = [['field_0', 'first, "quoted"\nanswer']]
+        self.submission.save()
+        self.submission2.submission_data = [['field_0', 'second']]
+        self.submission2.set_points(2, 2)
+        self.submission2.set_ready()
+        self.submission2.save()
+
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        url = '/api/v2/courses/{:d}/submissiondata/'.format(self.instance.id)
+        for params in ({'format': 'csv'}, {'format': 'csv', 'best': 'no'}, {'format': 'excel.csv'}):
+            response = client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            streamed = client.get(url, dict(params, stream='yes'))
+            self.assertEqual(streamed.status_code, 200)
+            self.assertTrue(streamed.streaming)
+            self.assertEqual(streamed['Content-Disposition'], response['Content-Disposition'])
+            content = b''.join(streamed.streaming_content)
+            delimiter = ';' if params['format'] == 'excel.csv' else ','
+            rows = list(csv.DictReader(StringIO(response.content.decode('utf-8-sig')), delimiter=delimiter))
+            streamed_rows = list(csv.DictReader(StringIO(content.decode('utf-8-sig')), delimiter=delimiter))
+            self.assertTrue(rows)
+            self.assertEqual(streamed_rows, rows)
@@ -0,0 +1,18 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from django.db.models.query import QuerySet
+
+from course.models import UserTagging
+
+
+def tags_by_profile(taggings: QuerySet[UserTagging]) -> Dict[int, List[str]]:
+    """
+    Returns the ids of the tags of each user profile id, read with one
+    query. The sheets look up the tags of each profile from the index
+    instead of searching all taggings.
+    """
+    tags = defaultdict(list)
+    for user_id, tag_id in taggings.values_list('user_id', 'tag_id'):
+        tags[user_id].append(str(tag_id))
+    return tags
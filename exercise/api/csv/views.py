@@ -1,5 +1,6 @@
 from typing import Any, Dict, Iterable, List, Optional, Set, Union
 
+from django.conf import settings
 from django.db.models import (
     Exists,
     ExpressionWrapper,
@@ -10,6 +11,7 @@ from django.db.models import (
 )
 from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
+from django.http import HttpResponseBase
 from rest_framework import viewsets
 from rest_framework.request import Request
 from rest_framework.response import Response
@@ -17,18 +19,24 @@ from rest_framework.settings import api_settings
 from rest_framework_csv.renderers import CSVRenderer
 from rest_framework_extensions.mixins import NestedViewSetMixin
 
-from lib.api.renderers import CSVExcelRenderer
+from lib.api.renderers import CSVExcelRenderer, streaming_csv_response
 from lib.api.mixins import MeUserMixin
 from lib.api.constants import REGEX_INT_ME
 from course.api.mixins import CourseResourceMixin
 from course.permissions import IsCourseAdminOrUserObjIsSelf
 from exercise.exercise_models import BaseExercise
-from exercise.submission_models import SubmissionQuerySet
+from exercise.submission_models import ExerciseResultQuerySet, SubmissionQuerySet
 from userprofile.models import UserProfile
 
 from ...cache.points import CachedPoints
-from ...models import Submission
-from .submission_sheet import filter_best_submissions, submissions_sheet
+from ...models import ExerciseResult, Submission
+from .submission_sheet import (
+    filter_best_submissions,
+    iter_best_submissions,
+    iter_submissions_rows,
+    submissions_sheet,
+    submissions_sheet_header,
+)
 from .aggregate_sheet import aggregate_sheet
 from .aggregate_points import aggregate_points
 
@@ -62,6 +70,9 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
     - `exercise_id`: id of the exercise
     - `best`: "yes" or "no"; "no" includes all different submissions from same submitters
     - `field`: return submission data only for the given field, e.g., "field_0"
+    - `stream`: "yes" writes the CSV while the submissions are read from the
+        database. The columns of the submitted fields are taken from the form
+        specifications of the exercises.
     """
     permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES + [
         IsCourseAdminOrUserObjIsSelf,
@@ -77,6 +88,8 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
     lookup_url_kwarg = 'user_id'
     lookup_value_regex = REGEX_INT_ME
     parent_lookup_map = {'course_id': 'enrollment.course_instance.id'}
+    # Number of submissions read from the database at a time when streaming
+    stream_chunk_size = 500
 
     def get_queryset(self):
         if self.action == 'list':
@@ -98,7 +111,7 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
             request: Request,
             version: Optional[Union[int, str]] = None, # pylint: disable=unused-argument
             course_id: Optional[Union[int, str]] = None, # pylint: disable=unused-argument
-            ) -> Response:
+            ) -> HttpResponseBase:
         profiles = self.filter_queryset(self.get_queryset())
         search_args = self.get_search_args(request)
         # Here, CachedPoints is only used to find the exercises whose feedback
@@ -120,7 +133,7 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
             version: Optional[Union[int, str]] = None, # pylint: disable=unused-argument
             course_id: Optional[Union[int, str]] = None, # pylint: disable=unused-argument
             user_id: Optional[Union[int, str]] = None, # pylint: disable=unused-argument
-            ) -> Response:
+            ) -> HttpResponseBase:
         profile = self.get_object()
         search_args = self.get_search_args(request)
         points = CachedPoints(self.instance, profile.user, self.content, self.is_course_staff)
@@ -137,7 +150,10 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
             queryset: QuerySet[Submission],
             revealed_ids: Set[int],
             best: bool = False
-            ) -> Response:
+            ) -> HttpResponseBase:
+        if not request.GET.get('field') and is_stream_requested(request):
+            return self.stream_submissions(request, queryset, revealed_ids, best)
+
         submissions = list(queryset.order_by('exercise_id', 'id'))
         if best:
             submissions = filter_best_submissions(submissions, revealed_ids)
@@ -160,6 +176,31 @@ class CourseSubmissionDataViewSet(NestedViewSetMixin,
             response['Content-Disposition'] = 'attachment; filename="submissions.csv"'
         return response
 
+    def stream_submissions(
+            self,
+            request: Request,
+            queryset: QuerySet[Submission],
+            revealed_ids: Set[int],
+            best: bool = False
+            ) -> HttpResponseBase:
+        header = submissions_sheet_header(
+            BaseExercise.objects
+            .filter(id__in=queryset.values('exercise_id'))
+            .without_subclasses()
+            .order_by('id')
+        )
+        submissions = (
+            queryset
+            .order_by('exercise_id', 'id')
+            .select_related('grader__user')
+            .prefetch_related('submitters__user')
+            .iterator(chunk_size=self.stream_chunk_size)
+        )
+        if best:
+            submissions = iter_best_submissions(submissions, revealed_ids)
+        rows = iter_submissions_rows(request, submissions, revealed_ids, [], [])
+        return streaming_csv_response(request, rows, header, 'submissions.csv')
+
     def get_renderer_context(self):
         context = super().get_renderer_context()
         context['header'] = getattr(self, 'renderer_fields', None)
@@ -193,6 +234,7 @@ class CourseAggregateDataViewSet(NestedViewSetMixin,
     - `category_id`: id of the exercise category
     - `module_id`: id of the course module
     - `exercise_id`: id of the exercise
+    - `stream`: "yes" writes the CSV while it is generated
     """
     # submission_count, total_points, max_points, (time_usage) / exercise / chapter / module
     permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES + [
@@ -224,29 +266,37 @@ class CourseAggregateDataViewSet(NestedViewSetMixin,
         }
     # pylint: disable-next=arguments-differ unused-argument
     def list(self, request, version=None, course_id=None):
-        profiles = self.filter_queryset(self.get_queryset())
+        profiles = self.filter_queryset(self.get_queryset()).select_related('user')
         return self.serialize_profiles(request, profiles)
     # pylint: disable-next=arguments-differ unused-argument
     def retrieve(self, request, version=None, course_id=None, user_id=None):
         return self.serialize_profiles(request, [self.get_object()])
 
-    def serialize_profiles(self, request: Request, profiles: QuerySet[UserProfile]) -> Response:
+    def serialize_profiles(self, request: Request, profiles: QuerySet[UserProfile]) -> HttpResponseBase:
         search_args = self.get_search_args(request)
         entry, exercises = self.content.search_entries(**search_args)
         ids = [e['id'] for e in exercises if e['type'] == 'exercise']
         points = CachedPoints(self.instance, request.user, self.content, self.is_course_staff)
         revealed_ids = get_revealed_exercise_ids(search_args, points)
-        aggr = (
-            Submission.objects
-            .filter(exercise__in=ids, submitters__in=profiles)
-            .exclude(status__in=(
-                Submission.STATUS.UNOFFICIAL, Submission.STATUS.ERROR, Submission.STATUS.REJECTED,
-            ))
-            .values('submitters__user_id', 'exercise_id')
-            .annotate(count=Count('id'))
-            .annotate_submitter_points('total', revealed_ids)
-            .order_by()
-        )
+        if settings.USE_EXERCISE_RESULTS:
+            aggr = (
+                ExerciseResult.objects
+                .filter(exercise__in=ids, profile__in=profiles)
+                .values_submitter_points(revealed_ids)
+                .order_by()
+            )
+        else:
+            aggr = (
+                Submission.objects
+                .filter(exercise__in=ids, submitters__in=profiles)
+                .exclude(status__in=(
+                    Submission.STATUS.UNOFFICIAL, Submission.STATUS.ERROR, Submission.STATUS.REJECTED,
+                ))
+                .values('submitters__user_id', 'exercise_id')
+                .annotate(count=Count('id'))
+                .annotate_submitter_points('total', revealed_ids)
+                .order_by()
+            )
         data,fields = aggregate_sheet(
             profiles,
             self.instance.taggings.all(),
@@ -254,6 +304,8 @@ class CourseAggregateDataViewSet(NestedViewSetMixin,
             aggr,
             entry['number'] if entry else "",
         )
+        if is_stream_requested(request):
+            return streaming_csv_response(request, data, fields, 'aggregate.csv')
         self.renderer_fields = fields
         response = Response(data)
         if isinstance(getattr(request, 'accepted_renderer'), CSVRenderer):
@@ -290,6 +342,7 @@ class CourseResultsDataViewSet(NestedViewSetMixin,
     - `module_id`: id of the course module
     - `exercise_id`: id of the exercise
     - `show_unofficial`: if "true", unofficial submissions are included in the results
+    - `stream`: "yes" writes the CSV while it is generated
     """
     # submission_count, total_points, max_points, (time_usage) / exercise / chapter / module
     permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES + [
@@ -323,7 +376,7 @@ class CourseResultsDataViewSet(NestedViewSetMixin,
        }
     # pylint: disable-next=arguments-differ unused-argument
     def list(self, request, version=None, course_id=None):
-        profiles = self.filter_queryset(self.get_queryset())
+        profiles = self.filter_queryset(self.get_queryset()).select_related('user')
         return self.serialize_profiles(request, profiles)
     # pylint: disable-next=arguments-differ unused-argument
     def retrieve(self, request, version=None, course_id=None, user_id=None):
@@ -338,7 +391,20 @@ class CourseResultsDataViewSet(NestedViewSetMixin,
             revealed_ids: Iterable[int],
             show_unofficial: bool,
             show_unconfirmed: bool,
-            ) -> SubmissionQuerySet:
+            ) -> Union[SubmissionQuerySet, ExerciseResultQuerySet]:
+        if settings.USE_EXERCISE_RESULTS and (
+            show_unconfirmed
+            or not self.instance.categories.filter(confirm_the_level=True).exists()
+        ):
+            # The exercise results can be used, unless the unconfirmed
+            # submissions must be excluded.
+            return (
+                ExerciseResult.objects
+                .filter(exercise__in=ids, profile__in=profiles)
+                .values_submitter_points(revealed_ids, show_unofficial)
+                .order_by()
+            )
+
         query = (
             Submission.objects
             .filter(exercise__in=ids, submitters__in=profiles)
@@ -407,7 +473,7 @@ class CourseResultsDataViewSet(NestedViewSetMixin,
 
         return query.order_by()
 
-    def serialize_profiles(self, request: Request, profiles: QuerySet[UserProfile]) -> Response:
+    def serialize_profiles(self, request: Request, profiles: QuerySet[UserProfile]) -> HttpResponseBase:
         search_args = self.get_search_args(request)
         _, exercises = self.content.search_entries(**search_args)
         ids = [e['id'] for e in exercises if e['type'] == 'exercise']
@@ -425,6 +491,8 @@ class CourseResultsDataViewSet(NestedViewSetMixin,
             exercises,
             aggr,
         )
+        if is_stream_requested(request):
+            return streaming_csv_response(request, data, fields, 'aggregate.csv')
         self.renderer_fields = fields
         response = Response(data)
         if isinstance(getattr(request, 'accepted_renderer'), CSVRenderer):
@@ -446,7 +514,8 @@ class CourseBestResultsDataViewSet(CourseResultsDataViewSet):
     This is similar to the `resultsdata` endpoint,
     but this endpoint ignores the exercise grading mode.
     The results are returned as if all exercises used the BEST mode
-    and the LAST mode is ignored.
+    and the LAST mode is ignored. When the exercise results are enabled with
+    the setting `USE_EXERCISE_RESULTS`, this is equal to `resultsdata`.
     """
     point_annotator = "annotate_best_submitter_points"
 
@@ -460,6 +529,17 @@ def int_or_none(value):
     return None
 
 
+def is_stream_requested(request: Request) -> bool:
+    """
+    Returns True, if the response should be streamed as CSV. See
+    `lib.api.renderers.streaming_csv_response`.
+    """
+    return (
+        request.GET.get('stream') == 'yes'
+        and isinstance(getattr(request, 'accepted_renderer', None), CSVRenderer)
+    )
+
+
 def get_revealed_exercise_ids(search_args: Dict[str, Any], points: CachedPoints) -> Set[int]:
     """
     Helper function that returns the IDs of the exercises whose feedback has
@@ -1,5 +1,9 @@
+from collections import defaultdict
 from typing import Any, Dict, List, Optional, Type, Union
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models.base import Model
 from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
@@ -13,6 +17,8 @@ from .hierarchy import ContentMixin
 class CachedContent(ContentMixin, CachedAbstract):
     """ Course content hierarchy for template presentations """
     KEY_PREFIX = 'content'
+    SCHEMA_VERSION = 2
+    COMPRESS = True
 
     def __init__(self, course_instance: CourseInstance) -> None:
         self.instance = course_instance
@@ -33,19 +39,24 @@ class CachedContent(ContentMixin, CachedAbstract):
             'max_group_size': 1,
         }
 
-        def recursion(
+        def recursion( # pylint: disable=too-many-arguments
                 module: Dict[str, Any],
-                objects: List[LearningObject],
+                children: Dict[Optional[int], List[LearningObject]],
                 parents: List[LearningObject],
                 indexes: List[int],
-                container: List[Dict[str, Any]]
+                container: List[Dict[str, Any]],
+                number: str,
+                path: str,
                 ) -> None:
             """ Recursively travels exercises hierarchy """
             select = parents[-1].id if parents else None
-            children = [o for o in objects if o.parent_id == select]
             j = 0
-            for o in children:
+            for o in children.get(select, []):
+                # The ancestors, number and path are passed down the tree
+                # instead of walking the parents again for each object.
                 o._parents = parents + [o]
+                o_number = number + '.' + str(o.order)
+                o_path = path + '/' + o.url if path else o.url
                 category = o.category
                 entry = {
                     'type': 'exercise',
@@ -60,7 +71,7 @@ class CachedContent(ContentMixin, CachedAbstract):
                     'status': o.status,
                     'name': str(o),
                     'hierarchical_name': o.hierarchical_name(),
-                    'number': module['number'] + '.' + o.number(),
+                    'number': o_number,
                     'link': o.get_display_url(),
                     'submittable': False,
                     'submissions_link': o.get_submission_list_url(),
@@ -72,7 +83,7 @@ class CachedContent(ContentMixin, CachedAbstract):
                     'late_time': module['late_time'],
                     'late_percent': module['late_percent'],
                     'is_empty': o.is_empty(),
-                    'get_path': o.get_path(),
+                    'get_path': o_path,
                     'points_to_pass': 0,
                     'difficulty': '',
                     'max_submissions': 0,
@@ -83,7 +94,7 @@ class CachedContent(ContentMixin, CachedAbstract):
                 container.append(entry)
                 idx = indexes + [j]
                 exercise_index[o.id] = idx
-                paths[module['id']][o.get_path()] = o.id
+                paths[module['id']][o_path] = o.id
                 if category.id not in categories:
                     categories[category.id] = {
                         'type': 'category',
@@ -95,7 +106,7 @@ class CachedContent(ContentMixin, CachedAbstract):
                         'max_points': 0,
                         'max_points_by_difficulty': {},
                     }
-                recursion(module, objects, o._parents, idx, entry['children'])
+                recursion(module, children, o._parents, idx, entry['children'], o_number, o_path)
                 j += 1
 
         # Collect each module.
@@ -136,8 +147,10 @@ class CachedContent(ContentMixin, CachedAbstract):
             idx = [i]
             module_index[module.id] = idx
             paths[module.id] = {}
-            all_children = list(module.learning_objects.all())
-            recursion(entry, all_children, [], idx, entry['children'])
+            children = defaultdict(list)
+            for o in module.learning_objects.all():
+                children[o.parent_id].append(o)
+            recursion(entry, children, [], idx, entry['children'], entry['number'], '')
             i += 1
 
         # Augment submittable exercise parameters.
@@ -149,8 +162,10 @@ class CachedContent(ContentMixin, CachedAbstract):
                 exercise.difficulty,
                 exercise.max_points
             )
+        # Only the fields of BaseExercise are needed here.
         for exercise in BaseExercise.objects\
-              .filter(course_module__course_instance=instance):
+              .filter(course_module__course_instance=instance)\
+              .without_subclasses():
             try:
                 tree = self._by_idx(modules, exercise_index[exercise.id])
             except KeyError:
@@ -191,9 +206,27 @@ class CachedContent(ContentMixin, CachedAbstract):
             'modules': modules,
             'categories': categories,
             'total': total,
+            **self._build_indexes(modules),
         }
 
 
+def queue_warm_up(course_instance: CourseInstance) -> None:
+    """
+    Queues a task, which regenerates the cached content of the course and
+    the cached points of its active students after CACHE_WARM_UP_DELAY
+    seconds. Further changes during the delay are covered by the same task.
+    """
+    delay = settings.CACHE_WARM_UP_DELAY
+    if delay is None:
+        return
+    if not cache.add('content-warm-up:%d' % course_instance.id, True, delay):
+        # The task is already queued
+        return
+    from ..tasks import warm_up_course # pylint: disable=import-outside-toplevel
+    instance_id = course_instance.id
+    transaction.on_commit(lambda: warm_up_course.apply_async((instance_id,), countdown=delay))
+
+
 def invalidate_content(
         sender: Type[Model], # pylint: disable=unused-argument
         instance: Union[CourseInstance, CourseModule, LearningObject, LearningObjectCategory],
@@ -203,6 +236,7 @@ def invalidate_content(
     while hasattr(course, 'course_instance'):
         course = course.course_instance
     CachedContent.invalidate(course)
+    queue_warm_up(course)
 
 
 # Automatically invalidate cached course content when edited.
@@ -1,4 +1,4 @@
-import logging
+import pickle
 import time
 from typing import Any, Dict, List, Optional, TYPE_CHECKING
 
@@ -6,29 +6,28 @@ from django.conf import settings
 from django.http.request import HttpRequest
 
 from lib.cache import CachedAbstract
+from lib.cache.compression import compress, decompress
 from lib.remote_page import RemotePageNotModified
+from ..protocol.exercise_page import build_form_template
 
 if TYPE_CHECKING:
     from course.models import CourseInstance
     from userprofile.models import UserProfile
     from ..models import BaseExercise
 
-logger = logging.getLogger('aplus.cached')
-
-try:
-    from lz4.block import compress as _compress, decompress
-    def compress(data):
-        return _compress(data, compression=1)
-except ImportError:
-    logger.warning("Unable to import lz4, using a slower zlib instead")
-    from zlib import compress as _compress, decompress
-    def compress(data):
-        return _compress(data, level=1)
-
 
 class ExerciseCache(CachedAbstract):
-    """ Exercise HTML content """
+    """
+    Exercise HTML content
+
+    The expired content is served for at most EXERCISE_CACHE_MAX_STALE
+    seconds while it is reloaded from the exercise service in the background.
+    The last loaded content is kept, if the service fails to respond.
+    The forms of the content are prepared for populating the submitted
+    values, so that the content is not parsed again for every submission.
+    """
     KEY_PREFIX = "exercise"
+    SCHEMA_VERSION = 2
 
     def __init__( # pylint: disable=too-many-arguments
             self,
@@ -46,6 +45,10 @@ class ExerciseCache(CachedAbstract):
     def _needs_generation(self, data: Dict[str, Any]) -> bool:
         expires = data['expires'] if data else None
         return not expires or time.time() > expires
+
+    def _use_stale(self, data: Dict[str, Any]) -> bool:
+        return time.time() < data['expires'] + settings.EXERCISE_CACHE_MAX_STALE
+
     # pylint: disable-next=arguments-differ
     def _generate_data(self, exercise: 'BaseExercise', data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         try:
@@ -54,11 +57,21 @@ class ExerciseCache(CachedAbstract):
                 last_modified=data['last_modified'] if data else None
             )
 
+            if not page.is_loaded and data and data['expires'] and self._use_stale(data):
+                # The exercise service is down, keep the last loaded content.
+                return data
+
             content = compress(page.content.encode('utf-8'))
+            form_template = None
+            if '<form' in page.content:
+                form_template = build_form_template(page.content)
+                if form_template is not None:
+                    form_template = compress(pickle.dumps(form_template, pickle.HIGHEST_PROTOCOL))
 
             return {
                 'head': page.head,
                 'content': content,
+                'form_template': form_template,
                 'last_modified': page.last_modified,
                 'expires': page.expires if page.is_loaded else 0,
             }
@@ -74,6 +87,12 @@ class ExerciseCache(CachedAbstract):
         content = decompress(self.data['content']).decode('utf-8')
         return content
 
+    def form_template(self) -> Optional[List[Any]]:
+        form_template = self.data['form_template']
+        if form_template is None:
+            return None
+        return pickle.loads(decompress(form_template))
+
 
 def invalidate_instance(instance: 'CourseInstance') -> None:
     for module in instance.course_modules.all():
@@ -1,4 +1,6 @@
-from typing import Tuple
+from bisect import bisect_left
+from heapq import merge
+from typing import Any, Dict, List, Optional
 from django.http.response import Http404
 from course.models import CourseModule, LearningObjectCategory
 from ..models import LearningObject
@@ -111,9 +113,29 @@ class ContentMixin:
         return self.data['modules']
 
     def modules_flatted(self):
-        for module in self.data['modules']:
-            module['flatted'] = self.flat_module(module)
-        return self.data['modules']
+        """
+        Returns copies of the modules with the flattened hierarchy of each
+        module in the list `flatted`, as yielded by `flat_module`.
+        """
+        flat = self.data['flat']
+        modules = self.modules()
+        result = []
+        for module in modules:
+            start, end = self.data['module_span'][module['id']]
+            flatted = [{'type':'level','down':True}]
+            depth = 2
+            for idx in flat[start + 1:end]:
+                if len(idx) > depth:
+                    flatted.append({'type':'level','down':True})
+                while len(idx) < depth:
+                    flatted.append({'type':'level','up':True})
+                    depth -= 1
+                depth = len(idx)
+                flatted.append(self._by_idx(modules, idx)[-1])
+            for _ in range(depth - 1):
+                flatted.append({'type':'level','up':True})
+            result.append(dict(module, flatted=flatted))
+        return result
 
     def categories(self):
         categories = list(self.data['categories'].values())
@@ -130,9 +152,9 @@ class ContentMixin:
         return NextIterator(self.modules(), enclosed=False)
 
     def begin(self):
-        for entry in self.flat_full():
-            if entry['type'] == 'exercise':
-                return entry
+        for idx in self.data['flat']:
+            if len(idx) > 1:
+                return self._by_idx(self.modules(), idx)[-1]
         return None
 
     def find_path(self, module_id, path):
@@ -142,19 +164,9 @@ class ContentMixin:
         raise NoSuchContent()
 
     def find_number(self, number):
-        hit = None
-        search = self.modules()
-        parts = number.split('.')
-        for i in range(len(parts)):
-            number = '.'.join(parts[0:i+1])
-            for s in search:
-                if s['number'] == number:
-                    hit = s
-                    search = hit['children']
-                    break
-            else:
-                raise NoSuchContent()
-        return hit
+        if number in self.data['number_index']:
+            return self._by_idx(self.modules(), self.data['number_index'][number])[-1]
+        raise NoSuchContent()
 
     def find_category(self, category_id):
         categories = self.data['categories']
@@ -166,33 +178,19 @@ class ContentMixin:
         modules = self.modules()
         idx = self._model_idx(model)
         tree = self._by_idx(modules, idx)
+        previous, following = self.data['listed_neighbours'][self._model_span(model)[0]]
         return (
             tree[-1],
             tree,
-            self._previous(idx, tree),
-            self._next(idx, tree),
+            self._by_idx(modules, self.data['flat'][previous])[-1] if previous is not None else None,
+            self._by_idx(modules, self.data['flat'][following])[-1] if following is not None else None,
         )
 
     def get_absolute_order_number(self, learning_object_id: int) -> int:
         """Get the absolute order number of the given learning object
         (i.e. how manieth chapter or exercise it is in the material).
         """
-        def inner(parent: dict, n: int) -> Tuple[bool, int]:
-            # parent is a cached dict representing a CourseModule or a LearningObject
-            for entry in parent['children']:
-                n += 1
-                if entry['id'] == learning_object_id:
-                    return True, n
-                found, n = inner(entry, n)
-                if found:
-                    return True, n
-            return False, n
-
-        n = 0
-        for module in self.modules():
-            found, n = inner(module, n)
-            if found:
-                return n
+        return self.data['order_index'].get(learning_object_id)
 
     def search_exercises(self, **kwargs):
         _, entries = self.search_entries(**kwargs)
@@ -221,61 +219,69 @@ class ContentMixin:
         if search:
             try:
                 idx = self._model_idx(search)
+                start, end = self._model_span(search)
             except NoSuchContent:
                 if raise_404:
                     raise Http404() # pylint: disable=raise-missing-from
                 raise
-            tree = self._by_idx(self.modules(), idx)
             if not entry:
-                entry = tree[-1]
+                entry = self._by_idx(self.modules(), idx)[-1]
         else:
-            tree = [{ 'type': 'all', 'children': self.modules() }]
-        exercises = []
+            start, end = 0, len(self.data['flat'])
 
-        def recursion(entry):
+        if category_id is None:
+            positions = range(start, end)
+        else:
+            # The modules and the exercises of the category within the span.
+            positions = merge(
+                self._positions_between(self.data['module_positions'], start, end),
+                self._positions_between(self.data['category_index'].get(category_id, []), start, end),
+            )
+        exercises = []
+        for position in positions:
+            e = self._by_idx(self.modules(), self.data['flat'][position])[-1]
             if (
-                entry['type'] == 'module' or ( # pylint: disable=too-many-boolean-expressions
-                    entry['type'] == 'exercise' and
-                    (category_id is None or entry['category_id'] == category_id) and
-                    (not filter_for_assistant or entry['allow_assistant_viewing'])
+                e['type'] == 'module' or (
+                    (category_id is None or e['category_id'] == category_id) and
+                    (not filter_for_assistant or e['allow_assistant_viewing'])
                 )
             ):
-                exercises.append(entry)
-            for child in entry['children']:
-                recursion(child)
-        recursion(tree[-1])
+                exercises.append(e)
         return entry, exercises
 
-    def _previous(self, idx, tree):
-        for entry in PreviousIterator(self.modules(), idx, tree, visited=True):
-            if self.is_listed(entry):
-                return entry
-        return None
-
-    def _next(self, idx, tree):
-        for entry in NextIterator(self.modules(), idx, tree, visited=True, enclosed=False):
-            if self.is_listed(entry):
-                return entry
-        return None
+    @staticmethod
+    def _positions_between(positions: List[int], start: int, end: int) -> List[int]:
+        return positions[bisect_left(positions, start):bisect_left(positions, end)]
 
     def _model_idx(self, model):
-        def find(index, search):
-            if search in index:
-                return index[search]
-            raise NoSuchContent()
-        entry_type = None
+        entry_type, entry_id = self._model_key(model)
+        index = self.data['module_index' if entry_type == 'module' else 'exercise_index']
+        if entry_id in index:
+            return index[entry_id]
+        raise NoSuchContent()
+
+    def _model_span(self, model):
+        """
+        Returns the position of the entry in the flattened hierarchy and
+        the position after its last descendant.
+        """
+        entry_type, entry_id = self._model_key(model)
+        spans = self.data['module_span' if entry_type == 'module' else 'exercise_span']
+        if entry_id in spans:
+            return spans[entry_id]
+        raise NoSuchContent()
+
+    @classmethod
+    def _model_key(cls, model):
         if isinstance(model, dict):
             entry_type = model.get('type', None)
-            if entry_type == 'module':
-                return find(self.data['module_index'], model['id'])
-            if entry_type == 'exercise':
-                return find(self.data['exercise_index'], model['id'])
+            if entry_type in ('module', 'exercise'):
+                return entry_type, model['id']
         elif isinstance(model, CourseModule):
-            return find(self.data['module_index'], model.id)
+            return 'module', model.id
         elif isinstance(model, LearningObject):
-            return find(self.data['exercise_index'], model.id)
-        else:
-            raise NoSuchContent()
+            return 'exercise', model.id
+        raise NoSuchContent()
 
     @classmethod
     def _by_idx(cls, hierarchy, idx):
@@ -286,6 +292,65 @@ class ContentMixin:
             tree.append(entry)
         return tree
 
+    @classmethod
+    def _build_indexes(cls, modules: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Returns the indexes of the hierarchy, which are stored with the data:
+        the hierarchy flattened in pre-order, the span of each entry in it,
+        the number and order lookups, the exercises of each category and
+        the previous and next listed entries of each entry.
+        """
+        flat = []
+        entries = []
+        module_span = {}
+        exercise_span = {}
+        number_index = {}
+        order_index = {}
+        category_index = {}
+        module_positions = []
+
+        def recursion(entry: Dict[str, Any], idx: List[int]) -> None:
+            position = len(flat)
+            flat.append(idx)
+            entries.append(entry)
+            number_index.setdefault(entry['number'], idx)
+            if entry['type'] == 'module':
+                module_positions.append(position)
+            else:
+                order_index[entry['id']] = len(order_index) + 1
+                category_index.setdefault(entry['category_id'], []).append(position)
+            for i, child in enumerate(entry['children']):
+                recursion(child, idx + [i])
+            spans = module_span if entry['type'] == 'module' else exercise_span
+            spans[entry['id']] = (position, len(flat))
+
+        for i, module in enumerate(modules):
+            recursion(module, [i])
+
+        listed = [cls.is_listed(entry) for entry in entries]
+        listed_neighbours: List[List[Optional[int]]] = [[None, None] for _ in flat]
+        previous = None
+        for position, is_listed in enumerate(listed):
+            listed_neighbours[position][0] = previous
+            if is_listed:
+                previous = position
+        following = None
+        for position in range(len(flat) - 1, -1, -1):
+            listed_neighbours[position][1] = following
+            if listed[position]:
+                following = position
+
+        return {
+            'flat': flat,
+            'module_span': module_span,
+            'exercise_span': exercise_span,
+            'number_index': number_index,
+            'order_index': order_index,
+            'category_index': category_index,
+            'module_positions': module_positions,
+            'listed_neighbours': [tuple(n) for n in listed_neighbours],
+        }
+
     @classmethod
     def _add_by_difficulty(cls, to, difficulty, points):
         if difficulty in to:
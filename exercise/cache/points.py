@@ -1,26 +1,31 @@
 import datetime
+from collections import defaultdict
 from copy import deepcopy
+from time import time
 from typing import (
     Any,
     Dict,
     Iterable,
     List,
     Optional,
+    Set,
     Type,
     Tuple,
     Union,
 )
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, Q
 from django.db.models.base import Model
 from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.utils import timezone
 
 from course.models import CourseInstance, CourseModule
 from deviations.models import DeadlineRuleDeviation, MaxSubmissionsRuleDeviation, SubmissionRuleDeviation
-from lib.cache import CachedAbstract
+from lib.cache import CachedAbstract, registry
 from lib.helpers import format_points
-from notification.models import Notification
+from notification.models import Notification, is_changing_in_bulk, notifications_changed
 from userprofile.models import UserProfile
 from ..models import BaseExercise, Submission, RevealRule
 from ..reveal_states import ExerciseRevealState, ModuleRevealState
@@ -43,6 +48,11 @@ def is_newer(submission: Submission, current_best_submission: Optional[Submissio
     )
 
 
+# Queued instead of an exercise id, when the whole cached entry must be
+# regenerated.
+FULL_UPDATE = 0
+
+
 class CachedPoints(ContentMixin, CachedAbstract):
     """
     Extends `CachedContent` to include data about a user's submissions and
@@ -53,8 +63,18 @@ class CachedPoints(ContentMixin, CachedAbstract):
     exercise results are hidden when the reveal rule does not evaluate to true.
     When `is_staff` is `True`, reveal rules are ignored and the results are
     always revealed.
+
+    Changes to a single exercise are queued with `queue_update`. The queued
+    exercises are recomputed incrementally the next time the cache is read,
+    instead of regenerating the whole data.
     """
     KEY_PREFIX = 'points'
+    # The data contains the indexes of CachedContent.
+    SCHEMA_VERSION = 2
+    COMPRESS = True
+    # At most this many queued updates are applied incrementally. If more
+    # updates have been queued, the data is regenerated instead.
+    MAX_QUEUED_UPDATES = 32
 
     def __init__(
             self,
@@ -66,8 +86,221 @@ class CachedPoints(ContentMixin, CachedAbstract):
         self.content = content
         self.instance = course_instance
         self.user = user
+        self._queued_updates = None
         super().__init__(course_instance, user)
-        self._extract_tuples(self.data, 0 if is_staff else 1)
+        if not is_staff:
+            self._apply_overlay(self.data)
+
+    @classmethod
+    def invalidate( # pylint: disable=arguments-differ
+            cls,
+            course_instance: CourseInstance,
+            user: User,
+            ) -> None:
+        super().invalidate(course_instance, user)
+        # An incremental update, which started before this invalidation, may
+        # still write its result to the cache. The queued full update ensures
+        # that the data is regenerated anyway.
+        cls.queue_update(course_instance, user, FULL_UPDATE)
+
+    @classmethod
+    def build_many( # pylint: disable=too-many-locals
+            cls,
+            course_instance: CourseInstance,
+            users: Iterable[User],
+            content: CachedContent,
+            is_staff: bool = False,
+            ) -> Dict[int, 'CachedPoints']:
+        """
+        Returns `CachedPoints` of many users at once, keyed by the user ids.
+
+        The cached data of all users is read with a single `cache.get_many`.
+        Missing or outdated data is generated for all users with a few
+        course-wide queries and stored with a single `cache.set_many`.
+        """
+        users = list(users)
+        result = {}
+        for user in users:
+            if not user.is_authenticated:
+                result[user.id] = cls(course_instance, user, content, is_staff)
+        users = [user for user in users if user.is_authenticated]
+        keys = {user.id: cls._key(course_instance, user, modifiers=[]) for user in users}
+        update_keys = {user.id: cls._update_key(course_instance, user) for user in users}
+        cached = cache.get_many(list(keys.values()))
+        update_seqs = cache.get_many(list(update_keys.values()))
+
+        stale = []
+        for user in users:
+            points = cls.__new__(cls)
+            points.content = content
+            points.instance = course_instance
+            points.user = user
+            points._queued_updates = None
+            points.dirty = False
+            raw = cached.get(keys[user.id])
+            updated, data = raw if isinstance(raw, tuple) and len(raw) == 2 else (None, None)
+            data = cls._load(data) if updated is not None else None
+            update_seq = update_seqs.get(update_keys[user.id])
+            if (
+                points._needs_generation(data)
+                or update_seq is None
+                or data.get('update_seq') != update_seq
+            ):
+                if update_seq is None:
+                    update_seqs[update_keys[user.id]] = cls._get_update_seq(course_instance, user)
+                stale.append(points)
+            else:
+                points.data = data
+            result[user.id] = points
+
+        if stale:
+            gen_start = time()
+            profiles = [points.user.userprofile for points in stale]
+            submitters = defaultdict(list)
+            for submission_id, profile_id in (
+                Submission.submitters.through.objects
+                .filter(
+                    submission__exercise__course_module__course_instance=course_instance,
+                    userprofile__in=profiles,
+                )
+                .values_list('submission_id', 'userprofile_id')
+            ):
+                submitters[submission_id].append(profile_id)
+            submissions = defaultdict(list)
+            for submission in (
+                Submission.objects
+                .filter(
+                    exercise__course_module__course_instance=course_instance,
+                    submitters__in=profiles,
+                )
+                .distinct()
+                .select_related()
+                .prefetch_related('exercise__parent', 'exercise__submission_feedback_reveal_rule')
+                .only('id', 'exercise', 'submission_time', 'status', 'grade', 'force_exercise_points')
+                .order_by('exercise', '-submission_time')
+            ):
+                for profile_id in submitters[submission.id]:
+                    submissions[profile_id].append(submission)
+            notifications = defaultdict(dict)
+            for row in (
+                Notification.objects
+                .filter(
+                    submission__submitters__in=profiles,
+                    submission__exercise__course_module__course_instance=course_instance,
+                )
+                .values('submission__submitters', 'submission__exercise_id')
+                .annotate(unseen=Count('id', filter=Q(seen=False)))
+                .order_by()
+            ):
+                notifications[row['submission__submitters']][row['submission__exercise_id']] = row['unseen'] > 0
+            exercises = BaseExercise.objects.filter(course_module__course_instance=course_instance)
+            deadline_deviations = (
+                DeadlineRuleDeviation.objects
+                .get_max_deviations_for_submitters(profiles, exercises)
+            )
+            submission_deviations = (
+                MaxSubmissionsRuleDeviation.objects
+                .get_max_deviations_for_submitters(profiles, exercises)
+            )
+            module_instances = list(
+                course_instance.course_modules.all()
+            )
+
+            generated = {}
+            for points, profile in zip(stale, profiles):
+                points.data = points._build_data(
+                    update_seqs[update_keys[points.user.id]],
+                    True,
+                    submissions[profile.id],
+                    notifications[profile.id],
+                    deadline_deviations.get(profile.id, []),
+                    submission_deviations.get(profile.id, []),
+                    module_instances,
+                )
+                generated[keys[points.user.id]] = (gen_start, points.data)
+            cls._store_many(generated)
+
+        if not is_staff:
+            for user in users:
+                result[user.id]._apply_overlay(result[user.id].data)
+        return result
+
+    @classmethod
+    def queue_update(cls, course_instance: CourseInstance, user: User, exercise_id: int) -> None:
+        """
+        Marks the points of a single exercise outdated. The exercise and the
+        aggregated points are recomputed when the cache is used next time.
+        """
+        cls._queue_update(course_instance, user, exercise_id)
+
+    @classmethod
+    def queue_updates(cls, course_instance: CourseInstance, user: User, exercise_ids: Iterable[int]) -> None:
+        """
+        Marks the points of many exercises outdated like `queue_update`, but
+        queues them as a single update.
+        """
+        exercise_ids = tuple(sorted(set(exercise_ids)))
+        if len(exercise_ids) == 1:
+            cls._queue_update(course_instance, user, exercise_ids[0])
+        elif exercise_ids:
+            cls._queue_update(course_instance, user, exercise_ids)
+
+    @classmethod
+    def _queue_update(
+            cls,
+            course_instance: CourseInstance,
+            user: User,
+            update: Union[int, Tuple[int, ...]],
+            ) -> None:
+        registry.clear()
+        key = cls._update_key(course_instance, user)
+        try:
+            seq = cache.incr(key)
+        except ValueError:
+            cls._get_update_seq(course_instance, user)
+            seq = cache.incr(key)
+        # Keep the value for an hour like in CachedAbstract.invalidate.
+        cache.set(cls._update_key(course_instance, user, seq), update, 60*60)
+
+    @classmethod
+    def _update_key(cls, course_instance: CourseInstance, user: User, seq: Optional[int] = None) -> str:
+        modifiers = ['updates'] if seq is None else ['updates', str(seq)]
+        return cls._key(course_instance, user, modifiers=modifiers)
+
+    @classmethod
+    def _get_update_seq(cls, course_instance: CourseInstance, user: User) -> int:
+        """Returns the sequence number of the latest queued update."""
+        key = cls._update_key(course_instance, user)
+        seq = cache.get(key)
+        if seq is None:
+            # Start from the current time in milliseconds, so that a counter
+            # recreated after an eviction does not reuse old sequence numbers.
+            cache.add(key, int(time() * 1000), None)
+            seq = cache.get(key)
+        return seq
+
+    def _get_queued_updates(self, data: Dict[str, Any]) -> Optional[Tuple[int, Set[int]]]:
+        """
+        Returns the latest update sequence number and the ids of the exercises
+        queued for update after the data was generated, or None, if the
+        updates can not be applied incrementally.
+        """
+        seq = data.get('update_seq')
+        latest = cache.get(self._update_key(self.instance, self.user))
+        if seq is None or latest is None or not 0 <= latest - seq <= self.MAX_QUEUED_UPDATES:
+            return None
+        keys = [self._update_key(self.instance, self.user, i) for i in range(seq + 1, latest + 1)]
+        updates = cache.get_many(keys) if keys else {}
+        if len(updates) < len(keys) or FULL_UPDATE in updates.values():
+            return None
+        exercise_ids = set()
+        for update in updates.values():
+            # queue_updates stores the ids of many exercises as a tuple.
+            if isinstance(update, tuple):
+                exercise_ids.update(update)
+            else:
+                exercise_ids.add(update)
+        return latest, exercise_ids
 
     def _needs_generation(self, data: Dict[str, Any]) -> bool:
         return (
@@ -79,22 +312,69 @@ class CachedPoints(ContentMixin, CachedAbstract):
             )
         )
 
+    def _needs_update(self, data: Dict[str, Any]) -> bool:
+        self._queued_updates = self._get_queued_updates(data)
+        return self._queued_updates is None or bool(self._queued_updates[1])
+
+    @staticmethod
+    def _get_submissions(
+            instance: CourseInstance,
+            user: User,
+            exercise_ids: Optional[Iterable[int]] = None,
+            ) -> List[Submission]:
+        submissions = (
+            user.userprofile.submissions
+            .filter(exercise__course_module__course_instance=instance)
+        )
+        if exercise_ids is not None:
+            submissions = submissions.filter(exercise__in=exercise_ids)
+        return list(
+            submissions
+            .select_related()
+            .prefetch_related('exercise__parent', 'exercise__submission_feedback_reveal_rule')
+            .only('id', 'exercise', 'submission_time', 'status', 'grade', 'force_exercise_points')
+            .order_by('exercise', '-submission_time')
+        )
+
+    @staticmethod
+    def _get_notifications(
+            instance: CourseInstance,
+            user: User,
+            exercise_ids: Optional[Iterable[int]] = None,
+            ) -> Dict[int, bool]:
+        """
+        Returns a dict, which maps the ids of the exercises, whose submissions
+        by the user have notifications, to whether any of them is unseen.
+        """
+        notifications = Notification.objects.filter(
+            submission__submitters=user.userprofile,
+            submission__exercise__course_module__course_instance=instance,
+        )
+        if exercise_ids is not None:
+            notifications = notifications.filter(submission__exercise__in=exercise_ids)
+        return {
+            row['submission__exercise_id']: row['unseen'] > 0
+            for row in (
+                notifications
+                .values('submission__exercise_id')
+                .annotate(unseen=Count('id', filter=Q(seen=False)))
+                .order_by()
+            )
+        }
+
     def _generate_data( # pylint: disable=arguments-differ
             self,
             instance: CourseInstance,
             user: User,
             data: Optional[Dict[str, Any]] = None,
             ) -> Dict[str, Any]:
+        # Updates queued after this point are applied to the generated data.
+        update_seq = self._get_update_seq(instance, user)
+
         # Perform all database queries before generating the cache.
         if user.is_authenticated:
-            submissions = list(
-                user.userprofile.submissions
-                .filter(exercise__course_module__course_instance=instance)
-                .select_related()
-                .prefetch_related('exercise__parent', 'exercise__submission_feedback_reveal_rule', 'notifications')
-                .only('id', 'exercise', 'submission_time', 'status', 'grade', 'force_exercise_points')
-                .order_by('exercise', '-submission_time')
-            )
+            submissions = self._get_submissions(instance, user)
+            notifications = self._get_notifications(instance, user)
             exercises = BaseExercise.objects.filter(course_module__course_instance=instance)
             deadline_deviations = list(
                 DeadlineRuleDeviation.objects
@@ -109,37 +389,65 @@ class CachedPoints(ContentMixin, CachedAbstract):
             )
         else:
             submissions = []
+            notifications = {}
             deadline_deviations = []
             submission_deviations = []
             module_instances = []
 
-        # Generate the staff and student version of the cache, and merge them.
+        return self._build_data(
+            update_seq,
+            user.is_authenticated,
+            submissions,
+            notifications,
+            deadline_deviations,
+            submission_deviations,
+            module_instances,
+        )
+
+    def _build_data( # pylint: disable=too-many-arguments
+            self,
+            update_seq: int,
+            is_authenticated: bool,
+            submissions: Iterable[Submission],
+            notifications: Dict[int, bool],
+            deadline_deviations: Iterable[DeadlineRuleDeviation],
+            submission_deviations: Iterable[MaxSubmissionsRuleDeviation],
+            module_instances: Iterable[CourseModule],
+            ) -> Dict[str, Any]:
+        """
+        Generates the staff and student version of the cache from the
+        prefetched source data. The staff version is stored as is, and the
+        student version as an overlay of the fields that differ from it.
+        """
         generate_args = (
-            user.is_authenticated, submissions, deadline_deviations, submission_deviations, module_instances
+            is_authenticated,
+            submissions,
+            notifications,
+            deadline_deviations,
+            submission_deviations,
+            module_instances,
         )
         staff_data = self._generate_data_internal(True, *generate_args)
         student_data = self._generate_data_internal(False, *generate_args)
-        self._pack_tuples(staff_data, student_data) # Now staff_data is the final, combined data.
-
-        # Pick the lowest invalidate_time if it is duplicated.
-        invalidate_time = staff_data['invalidate_time']
-        if isinstance(invalidate_time, tuple):
-            if invalidate_time[0] is not None:
-                if invalidate_time[1] is not None:
-                    staff_data['invalidate_time'] = min(invalidate_time)
-                else:
-                    staff_data['invalidate_time'] = invalidate_time[0]
-            else:
-                staff_data['invalidate_time'] = invalidate_time[1]
+        staff_data['student_overlay'] = self._diff_views(staff_data, student_data)
+
+        # Pick the lowest invalidate_time of the two versions.
+        invalidate_times = [
+            t for t in (staff_data['invalidate_time'], student_data['invalidate_time'])
+            if t is not None
+        ]
+        staff_data['invalidate_time'] = min(invalidate_times) if invalidate_times else None
 
         staff_data['points_created'] = timezone.now()
+        staff_data['update_seq'] = update_seq
         return staff_data
 
-    def _generate_data_internal( # noqa: MC0001
+    def _generate_data_internal(
             self,
             is_staff: bool,
             is_authenticated: bool,
             submissions: Iterable[Submission],
+            notifications: Dict[int, bool],
             deadline_deviations: Iterable[DeadlineRuleDeviation],
             submission_deviations: Iterable[MaxSubmissionsRuleDeviation],
             module_instances: Iterable[CourseModule],
@@ -150,65 +458,31 @@ class CachedPoints(ContentMixin, CachedAbstract):
         arguments to this method.
         """
         data = deepcopy(self.content.data)
-        module_index = data['module_index']
         exercise_index = data['exercise_index']
         modules = data['modules']
         categories = data['categories']
-        total = data['total']
         data['invalidate_time'] = None
 
         # Augment submission parameters.
         def r_augment(children: List[Dict[str, Any]]) -> None:
             for entry in children:
                 if entry['submittable']:
+                    self._init_exercise_points(entry)
                     entry.update({
-                        'submission_count': 0,
-                        'submissions': [],
-                        'best_submission': None,
-                        'points': 0,
-                        'formatted_points': '0',
-                        'passed': entry['points_to_pass'] == 0,
-                        'graded': False,
-                        'unofficial': False, # TODO: this should be True,
-                        # but we need to ensure nothing breaks when it's changed
-                        'forced_points': False,
                         'personal_deadline': None,
                         'personal_deadline_has_penalty': None,
                         'personal_max_submissions': None,
-                        'feedback_revealed': True,
-                        'feedback_reveal_time': None,
                     })
                 entry.update({
                     'is_revealed': True,
                 })
                 r_augment(entry.get('children'))
         for module in modules:
-            module.update({
-                'submission_count': 0,
-                'points': 0,
-                'formatted_points': '0',
-                'points_by_difficulty': {},
-                'unconfirmed_points_by_difficulty': {},
-                'passed': module['points_to_pass'] == 0,
-                'feedback_revealed': True,
-            })
+            self._init_points(module)
             r_augment(module['children'])
         for entry in categories.values():
-            entry.update({
-                'submission_count': 0,
-                'points': 0,
-                'formatted_points': '0',
-                'points_by_difficulty': {},
-                'unconfirmed_points_by_difficulty': {},
-                'passed': entry['points_to_pass'] == 0,
-                'feedback_revealed': True,
-            })
-        total.update({
-            'submission_count': 0,
-            'points': 0,
-            'points_by_difficulty': {},
-            'unconfirmed_points_by_difficulty': {},
-        })
+            self._init_points(entry)
+        self._init_total_points(data['total'])
 
         if is_authenticated:
             # Augment deviation data.
@@ -235,187 +509,414 @@ class CachedPoints(ContentMixin, CachedAbstract):
                     entry['max_submissions'] + deviation.extra_submissions
                 )
 
-            # Initialize variables for the submission loop.
-            exercise = None
-            entry = None
-            is_better_than = None
-            final_submission = None
-            last_submission = None
+            self._add_submissions(data, is_staff, submissions, notifications)
 
-            def update_invalidation_time(invalidate_time: Optional[datetime.datetime]) -> None:
-                if (
-                    invalidate_time is not None
-                    and invalidate_time > timezone.now()
-                    and (
-                        data['invalidate_time'] is None
-                        or invalidate_time < data['invalidate_time']
-                    )
+        if not is_staff:
+            self._check_model_answers(data, module_instances)
+
+        # Confirm points, collect points and check limits.
+        for module in modules:
+            self._confirm_points(module)
+        for module in modules:
+            self._collect_points(data, module)
+        for category in categories.values():
+            category['passed'] = (
+                category['points'] >= category['points_to_pass']
+            )
+
+        return data
+
+    def _update_data( # pylint: disable=arguments-differ too-many-locals
+            self,
+            instance: CourseInstance,
+            user: User,
+            data: Dict[str, Any],
+            ) -> Optional[Dict[str, Any]]:
+        """
+        Recomputes the exercises queued with `queue_update`, the modules
+        containing them, the categories and the total. Returns None, if the
+        data must be regenerated instead.
+        """
+        if self._queued_updates is None or not user.is_authenticated:
+            return None
+        update_seq, exercise_ids = self._queued_updates
+        modules = data['modules']
+        exercise_index = data['exercise_index']
+        if any(exercise_id not in exercise_index for exercise_id in exercise_ids):
+            self.dirty = True
+        positions = sorted({
+            exercise_index[exercise_id][0]
+            for exercise_id in exercise_ids
+            if exercise_id in exercise_index
+        })
+
+        submissions = self._get_submissions(instance, user, exercise_ids)
+        notifications = self._get_notifications(instance, user, exercise_ids)
+        module_instances = list(
+            instance.course_modules.filter(id__in=[modules[i]['id'] for i in positions])
+        )
+        for module in module_instances:
+            if (
+                module.model_answer_id is not None
+                and exercise_index.get(module.model_answer_id, [None])[0] not in positions
+            ):
+                # The model answer is in a module that is not recomputed.
+                return None
+
+        def set_revealed_recursive(entry: Dict[str, Any]) -> None:
+            entry['is_revealed'] = True
+            for child in entry.get('children', []):
+                set_revealed_recursive(child)
+
+        # The staff version of the recomputed modules is updated in place.
+        # The student version is recomputed from a copy, which has the
+        # overlay applied, and then diffed against the staff version again.
+        overlay = data['student_overlay']
+        staff_modules = modules
+        student_modules = list(modules)
+        for i in positions:
+            student_modules[i] = deepcopy(modules[i])
+            self._apply_subtree_overlay([student_modules[i]], overlay)
+            self._discard_subtree_overlay([modules[i]], overlay)
+        student_categories = deepcopy(data['categories'])
+        for key, diff in overlay['categories'].items():
+            self._apply_diff(student_categories[key], diff)
+        student_total = deepcopy(data['total'])
+        if overlay['total'] is not None:
+            self._apply_diff(student_total, overlay['total'])
+
+        views = []
+        for is_staff, view_modules, categories, total in (
+                (True, staff_modules, data['categories'], data['total']),
+                (False, student_modules, student_categories, student_total),
                 ):
-                    data['invalidate_time'] = invalidate_time
-
-            def check_reveal_rule() -> None:
-                """
-                Evaluate the reveal rule of the current exercise and ensure
-                that feedback is hidden appropriately.
-                """
-                rule = exercise.active_submission_feedback_reveal_rule
-                state = ExerciseRevealState(entry)
-                is_revealed = rule.is_revealed(state)
-                reveal_time = rule.get_reveal_time(state)
+            view = {
+                'module_index': data['module_index'],
+                'exercise_index': exercise_index,
+                'modules': view_modules,
+                'categories': categories,
+                'total': total,
+                'invalidate_time': None,
+            }
 
-                entry.update({
-                    'best_submission': entry['best_submission'] if is_revealed else last_submission.id,
-                    'points': entry['points'] if is_revealed else 0,
-                    'formatted_points': format_points(entry['points'], is_revealed, False),
-                    'passed': entry['passed'] if is_revealed else False,
+            for exercise_id in exercise_ids:
+                if exercise_id in exercise_index:
+                    entry = self._by_idx(view_modules, exercise_index[exercise_id])[-1]
+                    if entry['submittable']:
+                        self._init_exercise_points(entry)
+            self._add_submissions(view, is_staff, submissions, notifications)
+
+            if not is_staff:
+                for module in module_instances:
+                    if module.model_answer_id is not None:
+                        set_revealed_recursive(self._by_idx(view_modules, exercise_index[module.model_answer_id])[-1])
+                self._check_model_answers(view, module_instances)
+
+            for i in positions:
+                module = view_modules[i]
+                self._reset_confirmation(module, self.content.data['modules'][i])
+                self._init_points(module)
+                self._confirm_points(module)
+                self._collect_points(view, module, add_to_totals=False)
+
+            # The categories and the total are summed up from all modules.
+            for category in categories.values():
+                self._init_points(category)
+            self._init_total_points(total)
+            for module in view_modules:
+                self._collect_totals(view, module['children'], None if is_staff else overlay)
+            for category in categories.values():
+                category['passed'] = (
+                    category['points'] >= category['points_to_pass']
+                )
+            views.append(view)
+
+        # Record the differences of the student version into the overlay.
+        self._diff_modules(
+            overlay,
+            [staff_modules[i] for i in positions],
+            [student_modules[i] for i in positions],
+        )
+        overlay['categories'] = {}
+        for key, category in data['categories'].items():
+            diff = self._diff_entry(category, student_categories[key])
+            if diff is not None:
+                overlay['categories'][key] = diff
+        overlay['total'] = self._diff_entry(data['total'], student_total)
+        for view in views:
+            self._update_invalidate_time(data, view['invalidate_time'])
+
+        data['points_created'] = timezone.now()
+        data['update_seq'] = update_seq
+        return data
+
+    @staticmethod
+    def _init_points(entry: Dict[str, Any]) -> None:
+        """Initializes the points of a module or a category."""
+        entry.update({
+            'submission_count': 0,
+            'points': 0,
+            'formatted_points': '0',
+            'points_by_difficulty': {},
+            'unconfirmed_points_by_difficulty': {},
+            'passed': entry['points_to_pass'] == 0,
+            'feedback_revealed': True,
+        })
+
+    @staticmethod
+    def _init_total_points(total: Dict[str, Any]) -> None:
+        # These are only set when points are added to the total.
+        total.pop('formatted_points', None)
+        total.pop('feedback_revealed', None)
+        total.update({
+            'submission_count': 0,
+            'points': 0,
+            'points_by_difficulty': {},
+            'unconfirmed_points_by_difficulty': {},
+        })
+
+    @staticmethod
+    def _init_exercise_points(entry: Dict[str, Any]) -> None:
+        """Initializes the submission data of a submittable exercise."""
+        entry.pop('notified', None)
+        entry.pop('unseen', None)
+        entry.update({
+            'submission_count': 0,
+            'submissions': [],
+            'best_submission': None,
+            'points': 0,
+            'formatted_points': '0',
+            'passed': entry['points_to_pass'] == 0,
+            'graded': False,
+            'unofficial': False, # TODO: this should be True,
+            # but we need to ensure nothing breaks when it's changed
+            'forced_points': False,
+            'feedback_revealed': True,
+            'feedback_reveal_time': None,
+        })
+
+    @staticmethod
+    def _update_invalidate_time(data: Dict[str, Any], invalidate_time: Optional[datetime.datetime]) -> None:
+        if (
+            invalidate_time is not None
+            and invalidate_time > timezone.now()
+            and (
+                data['invalidate_time'] is None
+                or invalidate_time < data['invalidate_time']
+            )
+        ):
+            data['invalidate_time'] = invalidate_time
+
+    def _add_submissions( # noqa: MC0001
+            self,
+            data: Dict[str, Any],
+            is_staff: bool,
+            submissions: Iterable[Submission],
+            notifications: Dict[int, bool],
+            ) -> None:
+        """
+        Augments the exercise entries of data with the submissions, which must
+        be ordered by exercise, and the notification flags returned by
+        `_get_notifications`. The exercise entries must be initialized with
+        `_init_exercise_points` before this.
+        """
+        modules = data['modules']
+        exercise_index = data['exercise_index']
+
+        # Initialize variables for the submission loop.
+        exercise = None
+        entry = None
+        is_better_than = None
+        final_submission = None
+        last_submission = None
+
+        def check_reveal_rule() -> None:
+            """
+            Evaluate the reveal rule of the current exercise and ensure
+            that feedback is hidden appropriately.
+            """
+            rule = exercise.active_submission_feedback_reveal_rule
+            state = ExerciseRevealState(entry)
+            is_revealed = rule.is_revealed(state)
+            reveal_time = rule.get_reveal_time(state)
+
+            entry.update({
+                'best_submission': entry['best_submission'] if is_revealed else last_submission.id,
+                'points': entry['points'] if is_revealed else 0,
+                'formatted_points': format_points(entry['points'], is_revealed, False),
+                'passed': entry['passed'] if is_revealed else False,
+                'feedback_revealed': is_revealed,
+                'feedback_reveal_time': reveal_time,
+            })
+
+            for submission in entry['submissions']:
+                submission.update({
+                    'points': submission['points'] if is_revealed else 0,
+                    'formatted_points': format_points(submission['points'], is_revealed, False),
+                    'passed': submission['passed'] if is_revealed else False,
                     'feedback_revealed': is_revealed,
                     'feedback_reveal_time': reveal_time,
                 })
 
-                for submission in entry['submissions']:
-                    submission.update({
-                        'points': submission['points'] if is_revealed else 0,
-                        'formatted_points': format_points(submission['points'], is_revealed, False),
-                        'passed': submission['passed'] if is_revealed else False,
-                        'feedback_revealed': is_revealed,
-                        'feedback_reveal_time': reveal_time,
-                    })
+            # If the reveal rule depends on time, update the cache's
+            # invalidation time.
+            self._update_invalidate_time(data, reveal_time)
 
-                # If the reveal rule depends on time, update the cache's
-                # invalidation time.
-                update_invalidation_time(reveal_time)
-
-            # Augment submission data.
-            for submission in submissions:
-                # The submissions are ordered by exercise. Check here if the
-                # exercise has changed.
-                if exercise is None or submission.exercise.id != exercise.id:
-                    if exercise is not None and not is_staff:
-                        # Check the reveal rule of the last exercise now that
-                        # all of its submissions have been iterated.
-                        check_reveal_rule()
-                    final_submission = None
-                    last_submission = None
-                    # These variables stay constant throughout the exercise.
-                    exercise = submission.exercise
-                    try:
-                        tree = self._by_idx(modules, exercise_index[exercise.id])
-                    except KeyError:
-                        self.dirty = True
-                        continue
-                    entry = tree[-1]
-                    if exercise.grading_mode == BaseExercise.GRADING_MODE.BEST:
-                        is_better_than = has_more_points
-                    elif exercise.grading_mode == BaseExercise.GRADING_MODE.LAST:
-                        is_better_than = is_newer
-                    else:
-                        is_better_than = has_more_points
-                ready = submission.status == Submission.STATUS.READY
-                unofficial = submission.status == Submission.STATUS.UNOFFICIAL
-                if ready or submission.status in (Submission.STATUS.WAITING, Submission.STATUS.INITIALIZED):
-                    entry['submission_count'] += 1
-                entry['submissions'].append({
-                    'type': 'submission',
-                    'id': submission.id,
-                    'max_points': entry['max_points'],
-                    'points_to_pass': entry['points_to_pass'],
-                    'confirm_the_level': entry.get('confirm_the_level', False),
-                    'submission_count': 1, # to fool points badge
+        # Augment submission data.
+        for submission in submissions:
+            # The submissions are ordered by exercise. Check here if the
+            # exercise has changed.
+            if exercise is None or submission.exercise.id != exercise.id:
+                if exercise is not None and not is_staff:
+                    # Check the reveal rule of the last exercise now that
+                    # all of its submissions have been iterated.
+                    check_reveal_rule()
+                final_submission = None
+                last_submission = None
+                # These variables stay constant throughout the exercise.
+                exercise = submission.exercise
+                try:
+                    tree = self._by_idx(modules, exercise_index[exercise.id])
+                except KeyError:
+                    self.dirty = True
+                    continue
+                entry = tree[-1]
+                if exercise.grading_mode == BaseExercise.GRADING_MODE.BEST:
+                    is_better_than = has_more_points
+                elif exercise.grading_mode == BaseExercise.GRADING_MODE.LAST:
+                    is_better_than = is_newer
+                else:
+                    is_better_than = has_more_points
+            ready = submission.status == Submission.STATUS.READY
+            unofficial = submission.status == Submission.STATUS.UNOFFICIAL
+            if ready or submission.status in (Submission.STATUS.WAITING, Submission.STATUS.INITIALIZED):
+                entry['submission_count'] += 1
+            entry['submissions'].append({
+                'type': 'submission',
+                'id': submission.id,
+                'max_points': entry['max_points'],
+                'points_to_pass': entry['points_to_pass'],
+                'confirm_the_level': entry.get('confirm_the_level', False),
+                'submission_count': 1, # to fool points badge
+                'points': submission.grade,
+                'formatted_points': format_points(submission.grade, True, False),
+                'graded': submission.is_graded, # TODO: should this be official (is_graded = ready or unofficial)
+                'passed': (submission.grade >= entry['points_to_pass']),
+                'submission_status': submission.status if not submission.is_graded else False,
+                'unofficial': unofficial,
+                'date': submission.submission_time,
+                'url': submission.get_url('submission-plain'),
+                'feedback_revealed': True,
+                'feedback_reveal_time': None,
+            })
+            # Update best submission if exercise points are not forced, and
+            # one of these is true:
+            # 1) current submission in ready (thus is not unofficial) AND
+            #    a) current best is an unofficial OR
+            #    b) current submission is better depending on grading mode
+            # 2) All of:
+            #    - current submission is unofficial AND
+            #    - current best is unofficial
+            #    - current submission is better depending on grading mode
+            if submission.force_exercise_points:
+                # This submission is chosen as the final submission and no
+                # further submissions are considered.
+                entry.update({
+                    'best_submission': submission.id,
                     'points': submission.grade,
                     'formatted_points': format_points(submission.grade, True, False),
-                    'graded': submission.is_graded, # TODO: should this be official (is_graded = ready or unofficial)
-                    'passed': (submission.grade >= entry['points_to_pass']),
-                    'submission_status': submission.status if not submission.is_graded else False,
-                    'unofficial': unofficial,
-                    'date': submission.submission_time,
-                    'url': submission.get_url('submission-plain'),
-                    'feedback_revealed': True,
-                    'feedback_reveal_time': None,
+                    'passed': (ready and submission.grade >= entry['points_to_pass']),
+                    'graded': True,
+                    'unofficial': False,
+                    'forced_points': True,
                 })
-                # Update best submission if exercise points are not forced, and
-                # one of these is true:
-                # 1) current submission in ready (thus is not unofficial) AND
-                #    a) current best is an unofficial OR
-                #    b) current submission is better depending on grading mode
-                # 2) All of:
-                #    - current submission is unofficial AND
-                #    - current best is unofficial
-                #    - current submission is better depending on grading mode
-                if submission.force_exercise_points:
-                    # This submission is chosen as the final submission and no
-                    # further submissions are considered.
+                final_submission = submission
+            if not entry.get('forced_points', False):
+                if ( # pylint: disable=too-many-boolean-expressions
+                    ready and (
+                        entry['unofficial'] or
+                        is_better_than(submission, final_submission)
+                    )
+                ) or (
+                    unofficial and
+                    not entry['graded'] and # NOTE: == entry['unofficial'],
+                    # but before any submissions entry['unofficial'] is False
+                    is_better_than(submission, final_submission)
+                ):
                     entry.update({
                         'best_submission': submission.id,
                         'points': submission.grade,
                         'formatted_points': format_points(submission.grade, True, False),
                         'passed': (ready and submission.grade >= entry['points_to_pass']),
-                        'graded': True,
-                        'unofficial': False,
-                        'forced_points': True,
+                        'graded': ready, # != unofficial
+                        'unofficial': unofficial,
                     })
                     final_submission = submission
-                if not entry.get('forced_points', False):
-                    if ( # pylint: disable=too-many-boolean-expressions
-                        ready and (
-                            entry['unofficial'] or
-                            is_better_than(submission, final_submission)
-                        )
-                    ) or (
-                        unofficial and
-                        not entry['graded'] and # NOTE: == entry['unofficial'],
-                        # but before any submissions entry['unofficial'] is False
-                        is_better_than(submission, final_submission)
-                    ):
-                        entry.update({
-                            'best_submission': submission.id,
-                            'points': submission.grade,
-                            'formatted_points': format_points(submission.grade, True, False),
-                            'passed': (ready and submission.grade >= entry['points_to_pass']),
-                            'graded': ready, # != unofficial
-                            'unofficial': unofficial,
-                        })
-                        final_submission = submission
-                # Update last_submission to be the last submission, or the last
-                # official submission if there are any official submissions.
-                # Note that the submissions are ordered by descendng time.
-                if last_submission is None or (
-                    last_submission.status == Submission.STATUS.UNOFFICIAL
-                    and not unofficial
-                ):
-                    last_submission = submission
-                if submission.notifications.exists():
-                    entry['notified'] = True
-                    if submission.notifications.filter(seen=False).exists():
-                        entry['unseen'] = True
-            # All submissions of all exercises have been iterated. Check the
-            # reveal rule of the last exercise (if there was one).
-            if exercise is not None and not is_staff:
-                check_reveal_rule()
+            # Update last_submission to be the last submission, or the last
+            # official submission if there are any official submissions.
+            # Note that the submissions are ordered by descendng time.
+            if last_submission is None or (
+                last_submission.status == Submission.STATUS.UNOFFICIAL
+                and not unofficial
+            ):
+                last_submission = submission
+        # All submissions of all exercises have been iterated. Check the
+        # reveal rule of the last exercise (if there was one).
+        if exercise is not None and not is_staff:
+            check_reveal_rule()
 
-        if not is_staff:
-            def update_is_revealed_recursive(entry: Dict[str, Any], is_revealed: bool) -> None:
-                if is_revealed:
-                    return
-                entry.update({
-                    'is_revealed': is_revealed,
-                })
-                for child in entry.get('children', []):
-                    update_is_revealed_recursive(child, is_revealed)
+        for exercise_id, unseen in notifications.items():
+            if exercise_id in exercise_index:
+                entry = self._by_idx(modules, exercise_index[exercise_id])[-1]
+                entry['notified'] = True
+                if unseen:
+                    entry['unseen'] = True
 
-            for module in module_instances:
-                model_chapter = module.model_answer
-                if model_chapter is None:
-                    continue
-                reveal_rule = module.active_model_solution_reveal_rule
-                entry = self._by_idx(modules, exercise_index[model_chapter.id])[-1]
-                cached_module = self._by_idx(modules, module_index[module.id])[-1]
-                state = ModuleRevealState(cached_module)
-                is_revealed = reveal_rule.is_revealed(state)
-                reveal_time = reveal_rule.get_reveal_time(state)
-                update_is_revealed_recursive(entry, is_revealed)
-                update_invalidation_time(reveal_time)
-
-        # Confirm points.
+    def _check_model_answers(self, data: Dict[str, Any], module_instances: Iterable[CourseModule]) -> None:
+        """Hides the model answer chapters whose reveal rule is not satisfied."""
+        modules = data['modules']
+        module_index = data['module_index']
+        exercise_index = data['exercise_index']
+
+        def update_is_revealed_recursive(entry: Dict[str, Any], is_revealed: bool) -> None:
+            if is_revealed:
+                return
+            entry.update({
+                'is_revealed': is_revealed,
+            })
+            for child in entry.get('children', []):
+                update_is_revealed_recursive(child, is_revealed)
+
+        for module in module_instances:
+            model_chapter = module.model_answer
+            if model_chapter is None:
+                continue
+            reveal_rule = module.active_model_solution_reveal_rule
+            entry = self._by_idx(modules, exercise_index[model_chapter.id])[-1]
+            cached_module = self._by_idx(modules, module_index[module.id])[-1]
+            state = ModuleRevealState(cached_module)
+            is_revealed = reveal_rule.is_revealed(state)
+            reveal_time = reveal_rule.get_reveal_time(state)
+            update_is_revealed_recursive(entry, is_revealed)
+            self._update_invalidate_time(data, reveal_time)
+
+    @classmethod
+    def _reset_confirmation(cls, entry: Dict[str, Any], content_entry: Dict[str, Any]) -> None:
+        """
+        Restores the unconfirmed flags of the corresponding `CachedContent`
+        entry and clears the flags set by `_confirm_points` and
+        `_collect_points`.
+        """
+        if content_entry.get('unconfirmed', False):
+            entry['unconfirmed'] = True
+        else:
+            entry.pop('unconfirmed', None)
+        entry.pop('confirmable_points', None)
+        for child, content_child in zip(entry.get('children', []), content_entry.get('children', [])):
+            cls._reset_confirmation(child, content_child)
+
+    @classmethod
+    def _confirm_points(cls, module: Dict[str, Any]) -> None:
         def r_check(parent: Dict[str, Any], children: List[Dict[str, Any]]) -> None:
             for entry in children:
                 if (
@@ -428,42 +929,48 @@ class CachedPoints(ContentMixin, CachedAbstract):
                         child.pop('unconfirmed', None)
                         # TODO: should recurse to all descendants
                 r_check(entry, entry.get('children', []))
-        for module in modules:
-            r_check(module, module['children'])
-
-        # Collect points and check limits.
-        def add_to(target: Dict[str, Any], entry: Dict[str, Any]) -> None:
-            target['submission_count'] += entry['submission_count']
-            target['feedback_revealed'] = target.get('feedback_revealed', False) and entry['feedback_revealed']
-            # NOTE: entry can be only ready or unofficial (exercise level
-            # points are only copied, only if submission is in ready or
-            # unofficial state)
-            if entry.get('unofficial', False):
-                pass
-            # thus, all points are now ready..
-            elif entry.get('unconfirmed', False):
-                self._add_by_difficulty(
-                    target['unconfirmed_points_by_difficulty'],
-                    entry['difficulty'],
-                    entry['points']
-                )
-            # and finally, only remaining points are official (not unofficial & not unconfirmed)
-            else:
-                target['points'] += entry['points']
-                target['formatted_points'] = format_points(
-                    target['points'],
-                    target['feedback_revealed'],
-                    True,
-                )
-                self._add_by_difficulty(
-                    target['points_by_difficulty'],
-                    entry['difficulty'],
-                    entry['points']
-                )
+        r_check(module, module['children'])
+
+    def _add_points(self, target: Dict[str, Any], entry: Dict[str, Any]) -> None:
+        target['submission_count'] += entry['submission_count']
+        target['feedback_revealed'] = target.get('feedback_revealed', False) and entry['feedback_revealed']
+        # NOTE: entry can be only ready or unofficial (exercise level
+        # points are only copied, only if submission is in ready or
+        # unofficial state)
+        if entry.get('unofficial', False):
+            pass
+        # thus, all points are now ready..
+        elif entry.get('unconfirmed', False):
+            self._add_by_difficulty(
+                target['unconfirmed_points_by_difficulty'],
+                entry['difficulty'],
+                entry['points']
+            )
+        # and finally, only remaining points are official (not unofficial & not unconfirmed)
+        else:
+            target['points'] += entry['points']
+            target['formatted_points'] = format_points(
+                target['points'],
+                target['feedback_revealed'],
+                True,
+            )
+            self._add_by_difficulty(
+                target['points_by_difficulty'],
+                entry['difficulty'],
+                entry['points']
+            )
+
+    def _collect_points(self, data: Dict[str, Any], module: Dict[str, Any], add_to_totals: bool = True) -> None:
+        """
+        Sums up the points of the exercises into their parents and the module,
+        and checks whether the module is passed. The points are also added to
+        the categories and the total of data, if `add_to_totals` is True.
+        """
+        categories = data['categories']
+        total = data['total']
 
         def r_collect(
-                module: Dict[str, Any],
-                parent: Dict[str, Any],
+                parent: Optional[Dict[str, Any]],
                 children: List[Dict[str, Any]],
                 ) -> Tuple[bool, bool]:
             passed = True
@@ -483,10 +990,11 @@ class CachedPoints(ContentMixin, CachedAbstract):
                         submissions += entry['submission_count']
                         if entry['graded']:
                             points += entry['points']
-                            add_to(module, entry)
-                            add_to(categories[entry['category_id']], entry)
-                            add_to(total, entry)
-                r_passed, r_is_revealed = r_collect(module, entry, entry.get('children', []))
+                            self._add_points(module, entry)
+                            if add_to_totals:
+                                self._add_points(categories[entry['category_id']], entry)
+                                self._add_points(total, entry)
+                r_passed, r_is_revealed = r_collect(entry, entry.get('children', []))
                 passed = r_passed and passed
                 is_revealed = r_is_revealed and is_revealed
             if confirm_entry and submissions > 0:
@@ -497,18 +1005,133 @@ class CachedPoints(ContentMixin, CachedAbstract):
                 parent['points'] = points
                 parent['formatted_points'] = format_points(points, is_revealed, True)
             return passed, is_revealed
-        for module in modules:
-            passed, _ = r_collect(module, None, module['children'])
-            module['passed'] = (
-                passed
-                and module['points'] >= module['points_to_pass']
-            )
-        for category in categories.values():
-            category['passed'] = (
-                category['points'] >= category['points_to_pass']
-            )
 
-        return data
+        passed, _ = r_collect(None, module['children'])
+        module['passed'] = (
+            passed
+            and module['points'] >= module['points_to_pass']
+        )
+
+    def _collect_totals(
+            self,
+            data: Dict[str, Any],
+            children: List[Dict[str, Any]],
+            overlay: Optional[Dict[str, Any]] = None,
+            ) -> None:
+        """
+        Adds the points of the exercises to the categories and the total of
+        data in the same order as `_collect_points`. The exercises are read
+        through the student overlay, if one is given.
+        """
+        for entry in children:
+            diff = overlay['exercises'].get(entry['id']) if overlay is not None else None
+            if diff is not None:
+                entry = dict(entry)
+                self._apply_diff(entry, diff)
+            if entry['submittable'] and not entry['confirm_the_level'] and entry['graded']:
+                self._add_points(data['categories'][entry['category_id']], entry)
+                self._add_points(data['total'], entry)
+            self._collect_totals(data, entry.get('children', []), overlay)
+
+    @staticmethod
+    def _diff_entry(
+            staff_entry: Dict[str, Any],
+            student_entry: Dict[str, Any],
+            ) -> Optional[Tuple[Dict[str, Any], List[str]]]:
+        """
+        Returns the fields of the student version of an entry that differ
+        from the staff version and the fields that are missing from it, or
+        None if the versions are equal. The children are not compared.
+        """
+        changed = {
+            key: value
+            for key, value in student_entry.items()
+            if key != 'children' and (key not in staff_entry or staff_entry[key] != value)
+        }
+        removed = [key for key in staff_entry if key not in student_entry]
+        if not changed and not removed:
+            return None
+        return changed, removed
+
+    @staticmethod
+    def _apply_diff(entry: Dict[str, Any], diff: Tuple[Dict[str, Any], List[str]]) -> None:
+        changed, removed = diff
+        for key in removed:
+            entry.pop(key, None)
+        entry.update(changed)
+
+    def _diff_modules(
+            self,
+            overlay: Dict[str, Any],
+            staff_modules: List[Dict[str, Any]],
+            student_modules: List[Dict[str, Any]],
+            ) -> None:
+        """Records the differences of the modules and their exercises into overlay."""
+        def r_diff(key: str, staff_entries: List[Dict[str, Any]], student_entries: List[Dict[str, Any]]) -> None:
+            for staff_entry, student_entry in zip(staff_entries, student_entries):
+                diff = self._diff_entry(staff_entry, student_entry)
+                if diff is not None:
+                    overlay[key][staff_entry['id']] = diff
+                r_diff('exercises', staff_entry.get('children', []), student_entry.get('children', []))
+        r_diff('modules', staff_modules, student_modules)
+
+    def _diff_views(self, staff_data: Dict[str, Any], student_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the student overlay: the differences of the student version
+        keyed by the module, exercise and category ids.
+        """
+        overlay = {
+            'modules': {},
+            'exercises': {},
+            'categories': {},
+            'total': self._diff_entry(staff_data['total'], student_data['total']),
+        }
+        self._diff_modules(overlay, staff_data['modules'], student_data['modules'])
+        for key, category in staff_data['categories'].items():
+            diff = self._diff_entry(category, student_data['categories'][key])
+            if diff is not None:
+                overlay['categories'][key] = diff
+        return overlay
+
+    def _apply_overlay(self, data: Dict[str, Any]) -> None:
+        """
+        Turns the staff version in data into the student version. Only the
+        entries named in the overlay are visited, through the indexes.
+        """
+        overlay = data['student_overlay']
+        modules = data['modules']
+        for module_id, diff in overlay['modules'].items():
+            self._apply_diff(self._by_idx(modules, data['module_index'][module_id])[-1], diff)
+        for exercise_id, diff in overlay['exercises'].items():
+            self._apply_diff(self._by_idx(modules, data['exercise_index'][exercise_id])[-1], diff)
+        for category_id, diff in overlay['categories'].items():
+            self._apply_diff(data['categories'][category_id], diff)
+        if overlay['total'] is not None:
+            self._apply_diff(data['total'], overlay['total'])
+
+    def _apply_subtree_overlay(
+            self,
+            entries: List[Dict[str, Any]],
+            overlay: Dict[str, Any],
+            key: str = 'modules',
+            ) -> None:
+        """Applies the overlay to the given entries and their descendants."""
+        for entry in entries:
+            diff = overlay[key].get(entry['id'])
+            if diff is not None:
+                self._apply_diff(entry, diff)
+            self._apply_subtree_overlay(entry.get('children', []), overlay, 'exercises')
+
+    def _discard_subtree_overlay(
+            self,
+            entries: List[Dict[str, Any]],
+            overlay: Dict[str, Any],
+            key: str = 'modules',
+            ) -> None:
+        """Removes the given entries and their descendants from the overlay."""
+        for entry in entries:
+            overlay[key].pop(entry['id'], None)
+            self._discard_subtree_overlay(entry.get('children', []), overlay, 'exercises')
 
     def created(self) -> Tuple[datetime.datetime, datetime.datetime]:
         return self.data['points_created'], super().created()
@@ -564,49 +1187,31 @@ class CachedPoints(ContentMixin, CachedAbstract):
                 submissions.extend(s['id'] for s in entry.get('submissions', []))
         return submissions
 
-    def _pack_tuples(self, value1, value2, parent_container=None, parent_key=None):
-        """
-        Compare two data structures, and when conflicting values are found,
-        pack them into a tuple. `value1` is modified in this operation.
-
-        Example: when called with `value1={"key1": "a", "key2": "b"}` and
-        `value2={"key1": "a", "key2": "c"}`, `value1` will become
-        `{"key1": "a", "key2": ("b", "c")}`.
-        """
-        if isinstance(value1, dict):
-            for key, inner_value1 in value1.items():
-                inner_value2 = value2[key]
-                self._pack_tuples(inner_value1, inner_value2, value1, key)
-        elif isinstance(value1, list):
-            for index, inner_value1 in enumerate(value1):
-                inner_value2 = value2[index]
-                self._pack_tuples(inner_value1, inner_value2, value1, index)
-        else:
-            if value1 != value2:
-                parent_container[parent_key] = (value1, value2)
-
-    def _extract_tuples(self, value, tuple_index, parent_container=None, parent_key=None):
-        """
-        Find tuples within a data structure, and replace them with the value
-        at `tuple_index` in the tuple. `value` is modified in this operation.
-
-        Example: when called with `value={"key1": "a", "key2": ("b", "c")}` and
-        `tuple_index=0`, `value` will become `{"key1": "a", "key2": "b"}`.
-        """
-        if isinstance(value, dict):
-            for key, inner_value in value.items():
-                self._extract_tuples(inner_value, tuple_index, value, key)
-        elif isinstance(value, list):
-            for index, inner_value in enumerate(value):
-                self._extract_tuples(inner_value, tuple_index, value, index)
-        elif isinstance(value, tuple):
-            parent_container[parent_key] = value[tuple_index]
+def warm_up_cache(course_instance: CourseInstance, days: int) -> int:
+    """
+    Regenerates the cached content of the course and the cached points of
+    the users who have submitted in the course during the last `days` days.
+    Returns the number of the users.
+    """
+    content = CachedContent(course_instance)
+    users = list(
+        User.objects
+        .filter(
+            userprofile__submissions__exercise__course_module__course_instance=course_instance,
+            userprofile__submissions__submission_time__gte=timezone.now() - datetime.timedelta(days=days),
+        )
+        .distinct()
+        .select_related('userprofile')
+    )
+    CachedPoints.build_many(course_instance, users, content)
+    return len(users)
 
 # pylint: disable-next=unused-argument
 def invalidate_content(sender: Type[Model], instance: Submission, **kwargs: Any) -> None:
+    # Only the points of the submitted exercise need to be recomputed.
     course = instance.exercise.course_instance
     for profile in instance.submitters.all():
-        CachedPoints.invalidate(course, profile.user)
+        CachedPoints.queue_update(course, profile.user, instance.exercise_id)
 
 def invalidate_content_m2m( # pylint: disable=too-many-arguments
         sender: Type[Model], # pylint: disable=unused-argument
@@ -624,15 +1229,17 @@ def invalidate_content_m2m( # pylint: disable=too-many-arguments
     if reverse:
         # instance is a UserProfile
         if model == Submission:
-            seen_courses = set()
+            seen_exercises = set()
             for submission_pk in pk_set:
                 try:
                     submission = Submission.objects.get(pk=submission_pk)
-                    course_instance = submission.exercise.course_instance
-                    if course_instance.pk not in seen_courses:
-                        CachedPoints.invalidate(course_instance, instance.user)
-                    else:
-                        seen_courses.add(course_instance.pk)
+                    if submission.exercise_id not in seen_exercises:
+                        seen_exercises.add(submission.exercise_id)
+                        CachedPoints.queue_update(
+                            submission.exercise.course_instance,
+                            instance.user,
+                            submission.exercise_id,
+                        )
                 except Submission.DoesNotExist:
                     pass
     else:
@@ -640,10 +1247,28 @@ def invalidate_content_m2m( # pylint: disable=too-many-arguments
         invalidate_content(Submission, instance)
 # pylint: disable-next=unused-argument
 def invalidate_notification(sender: Type[Model], instance: Notification, **kwargs: Any) -> None:
+    if is_changing_in_bulk():
+        return
     course = instance.course_instance
     if not course and instance.submission:
         course = instance.submission.exercise.course_instance
-    CachedPoints.invalidate(course, instance.recipient.user)
+    if instance.submission_id is not None:
+        # Notifications only affect the flags of the submitted exercise.
+        CachedPoints.queue_update(course, instance.recipient.user, instance.submission.exercise_id)
+    else:
+        CachedPoints.invalidate(course, instance.recipient.user)
+# pylint: disable-next=unused-argument
+def invalidate_notifications_many(sender: Type[Model], notifications: List[Notification], **kwargs: Any) -> None:
+    # Queue a single update for each recipient in each course.
+    updates = defaultdict(set)
+    for notification in notifications:
+        key = (notification.course_instance, notification.recipient.user)
+        updates[key].add(notification.submission.exercise_id if notification.submission_id is not None else None)
+    for (course, user), exercise_ids in updates.items():
+        if None in exercise_ids:
+            CachedPoints.invalidate(course, user)
+        else:
+            CachedPoints.queue_updates(course, user, exercise_ids)
 # pylint: disable-next=unused-argument
 def invalidate_deviation(sender: Type[Model], instance: SubmissionRuleDeviation, **kwargs: Any) -> None:
     # Invalidate for the student who received the deviation as well as all
@@ -676,6 +1301,7 @@ post_save.connect(invalidate_content, sender=Submission)
 post_delete.connect(invalidate_content, sender=Submission)
 post_save.connect(invalidate_notification, sender=Notification)
 post_delete.connect(invalidate_notification, sender=Notification)
+notifications_changed.connect(invalidate_notifications_many, sender=Notification)
 post_save.connect(invalidate_deviation, sender=DeadlineRuleDeviation)
 post_delete.connect(invalidate_deviation, sender=DeadlineRuleDeviation)
 post_save.connect(invalidate_deviation, sender=MaxSubmissionsRuleDeviation)
@@ -1,6 +1,6 @@
 import json
 import os
-from typing import Any, TYPE_CHECKING, List, Optional, Tuple
+from typing import Any, Dict, TYPE_CHECKING, List, Optional, Tuple
 from urllib.parse import urlsplit
 
 from django.conf import settings
@@ -9,8 +9,9 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.core.files.storage import default_storage
 from django.http.request import HttpRequest
-from django.db import models
-from django.db.models import signals
+from django.db import models, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery, signals
+from django.db.models.functions import Coalesce
 from django.db.models.signals import post_delete, post_save
 from django.template import loader
 from django.utils import timezone
@@ -30,6 +31,7 @@ from lib.api.authentication import (
     get_graderauth_submission_params,
     get_graderauth_exercise_params,
 )
+from lib.circuit_breaker import CircuitBreaker
 from lib.fields import DefaultForeignKey, DefaultOneToOneField, JSONField
 from lib.helpers import (
     Enum,
@@ -343,6 +345,7 @@ class LearningObject(UrlMixin, ModelWithInheritance):
         cache = ExerciseCache(self, language, request, students, url_name, ordinal)
         page.head = cache.head()
         page.content = cache.content()
+        page.form_template_loader = cache.form_template
         page.is_loaded = True
         return page
 
@@ -468,7 +471,25 @@ class CourseChapter(LearningObject):
 
 
 class BaseExerciseManager(JWTAccessible["BaseExercise"], LearningObjectManager):
-    pass
+
+    def get_names_with_unavailable_service(self, instance: CourseInstance) -> str:
+        """
+        Returns the names of the exercises of the course instance, whose
+        exercise service has failed so that its circuit is not closed.
+        """
+        hosts = CircuitBreaker.unavailable_hosts()
+        if not hosts:
+            return ''
+        exercises = (
+            self.without_subclasses()
+            .filter(course_module__course_instance=instance)
+            .values_list('name', 'service_url')
+        )
+        names = [
+            name for name, service_url in exercises
+            if urlsplit(service_url).netloc in hosts
+        ]
+        return ", ".join(f"'{name}'" for name in names[:10])
 
 
 @register_jwt_accessible_class("exercise")
@@ -726,12 +747,20 @@ class BaseExercise(LearningObject):
         return False,["ERROR"]
 
     def one_has_deadline_deviation(self, students):
+        # The deviations of all students in one query, in the order of the students
+        order = {profile.id: i for i, profile in enumerate(students)}
+        normal_deadline = self.course_module.closing_time
+        deviations = sorted(
+            self.deadlineruledeviation_set.filter(submitter__in=list(order)),
+            key=lambda d: order[d.submitter_id],
+        )
         deviation = None
-        for profile in students:
-            for d in self.deadlineruledeviation_set.filter(submitter=profile):
-                if not deviation\
-                        or d.get_new_deadline() > deviation.get_new_deadline():
-                    deviation = d
+        for d in deviations:
+            if not deviation\
+                    or d.get_new_deadline(normal_deadline) > deviation.get_new_deadline(normal_deadline):
+                deviation = d
+        if deviation:
+            deviation.exercise = self
         return deviation
 
     def number_of_submitters(self):
@@ -756,18 +785,24 @@ class BaseExercise(LearningObject):
             return self.max_submissions + deviation.extra_submissions
         return self.max_submissions
 
-    def one_has_submissions(self, students: List[UserProfile]) -> Tuple[bool, List[str]]:
+    def one_has_submissions(
+            self,
+            students: List[UserProfile],
+            stats: Optional[Dict[int, Tuple[bool, int, int]]] = None,
+            ) -> Tuple[bool, List[str]]:
         if len(students) == 1 and self.status in (self.STATUS.ENROLLMENT, self.STATUS.ENROLLMENT_EXTERNAL):
             enrollment = self.course_instance.get_enrollment_for(students[0].user)
             if not enrollment or enrollment.status != Enrollment.ENROLLMENT_STATUS.ACTIVE:
                 return True, []
+        if stats is None:
+            stats = self._get_submitter_stats(students)
         submission_count = 0
         for profile in students:
             # The students are in the same group, therefore, each student should
             # have the same submission count. However, max submission deviation
             # may be set for only one group member.
-            submission_count = self.get_submissions_for_student(profile, True).count()
-            if submission_count < self.max_submissions_for_student(profile):
+            _is_staff, submission_count, max_submissions = stats[profile.id]
+            if submission_count < max_submissions:
                 return True, []
         # Even in situations where the student could otherwise make an infinite
         # number of submissions, there is still a hard limit.
@@ -865,35 +900,39 @@ class BaseExercise(LearningObject):
         elif enrollment and enrollment.status == Enrollment.ENROLLMENT_STATUS.ACTIVE and enrollment.selected_group:
             group = enrollment.selected_group
 
+        # The members are needed by the group checks and as the submitters.
+        members = list(group.members.all()) if group else None
+
         if self.max_group_size > 1:
             # Check groups cannot be changed after submitting.
             submission = self.get_submissions_for_student(profile).first()
             if submission:
-                if self._detect_group_changes(profile, group, submission):
+                submitters = list(submission.submitters.all())
+                if self._detect_group_changes(profile, members, submitters):
                     msg = _('EXERCISE_WARNING_GROUP_CANNOT_CHANGE_FOR_SAME_EXERCISE_MSG')
                     warning = _('EXERCISE_WARNING_HAS_PREVIOUSLY_SUBMITTED_EXERCISE -- {with_group}, {msg}')
-                    if submission.submitters.count() == 1:
+                    if len(submitters) == 1:
                         warning = format_lazy(warning, with_group=_('ALONE'), msg=msg)
                     else:
                         collaborators = StudentGroup.format_collaborator_names(
-                                submission.submitters.all(), profile)
+                                submitters, profile)
                         with_group = format_lazy(_('WITH -- {}'), collaborators)
                         warning = format_lazy(warning, with_group=with_group, msg=msg)
                     warnings.append(warning)
                     return self.SUBMIT_STATUS.INVALID_GROUP, warnings, students
 
-            elif self._detect_submissions(profile, group):
+            elif self._detect_submissions(profile, members):
                 warnings.append(
                     format_lazy(
                         _('EXERCISE_WARNING_COLLABS_HAVE_SUBMITTED_EXERCISE_WITH_DIFF_GROUP -- {collaborators}'),
-                        collaborators=group.collaborator_names(profile),
+                        collaborators=StudentGroup.format_collaborator_names(members, profile),
                     )
                 )
                 return self.SUBMIT_STATUS.INVALID_GROUP, warnings, students
 
         # Get submitters.
         if group:
-            students = list(group.members.all())
+            students = members
 
         # Check group size.
         if not (self.min_group_size <= len(students) <= self.max_group_size):
@@ -911,7 +950,9 @@ class BaseExercise(LearningObject):
             access_ok, access_warnings = True, []
         else:
             access_ok, access_warnings = self.one_has_access(students)
-        is_staff = all(self.course_instance.is_course_staff(p.user) for p in students)
+        # The roles, submission counts and deviations of all students at once
+        stats = self._get_submitter_stats(students)
+        is_staff = all(stats[p.id][0] for p in students)
         ok = (access_ok and len(warnings) == 0) or is_staff # pylint: disable=consider-using-ternary
         all_warnings = warnings + access_warnings
         if not ok:
@@ -920,7 +961,7 @@ class BaseExercise(LearningObject):
                     'EXERCISE_WARNING_CANNOT_SUBMIT_UNKNOWN_REASON'))
             return self.SUBMIT_STATUS.INVALID, all_warnings, students
 
-        submit_limit_ok, submit_limit_warnings = self.one_has_submissions(students)
+        submit_limit_ok, submit_limit_warnings = self.one_has_submissions(students, stats)
         if not submit_limit_ok and not is_staff:
             # access_warnings are not needed here
             return (self.SUBMIT_STATUS.AMOUNT_EXCEEDED,
@@ -929,20 +970,62 @@ class BaseExercise(LearningObject):
 
         return self.SUBMIT_STATUS.ALLOWED, all_warnings + submit_limit_warnings, students
 
-    def _detect_group_changes(self, profile, group, submission):
-        submitters = list(submission.submitters.all())
-        if group:
-            return not group.equals(submitters)
+    def _detect_group_changes(self, profile, members, submitters):
+        if members is not None:
+            return set(members) != set(submitters)
         return len(submitters) > 1 or submitters[0] != profile
 
-    def _detect_submissions(self, profile, group):
-        if group:
-            return not all((
-                len(self.get_submissions_for_student(p)) == 0
-                for p in group.members.all() if p != profile
-            ))
+    def _detect_submissions(self, profile, members):
+        if members is not None:
+            return self.submissions.filter(
+                submitters__in=[p for p in members if p != profile],
+            ).exists()
         return False
 
+    def _get_submitter_stats(self, students: List[UserProfile]) -> Dict[int, Tuple[bool, int, int]]:
+        """
+        Returns whether each student is course staff, the number of their
+        submissions without errors and their max submissions, keyed by the
+        profile id. All students are queried at once.
+        """
+        staff_enrollments = Enrollment.objects.filter(
+            course_instance=self.course_instance,
+            user_profile=OuterRef('pk'),
+            role__in=(Enrollment.ENROLLMENT_ROLE.TEACHER, Enrollment.ENROLLMENT_ROLE.ASSISTANT),
+            status=Enrollment.ENROLLMENT_STATUS.ACTIVE,
+        )
+        submission_counts = (
+            self.submissions.exclude_errors()
+            .filter(submitters=OuterRef('pk'))
+            .order_by()
+            .values('exercise')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        extra_submissions = (
+            self.maxsubmissionsruledeviation_set
+            .filter(submitter=OuterRef('pk'))
+            .values('extra_submissions')[:1]
+        )
+        rows = (
+            UserProfile.objects
+            .filter(id__in=[p.id for p in students])
+            .annotate(
+                is_staff=Exists(staff_enrollments),
+                submission_count=Coalesce(Subquery(submission_counts), 0),
+                extra_submissions=Subquery(extra_submissions),
+            )
+            .values_list('id', 'user__is_superuser', 'is_staff', 'submission_count', 'extra_submissions')
+        )
+        return {
+            profile_id: (
+                is_superuser or is_staff,
+                count,
+                self.max_submissions + (extra or 0),
+            )
+            for profile_id, is_superuser, is_staff, count, extra in rows
+        }
+
     def get_total_submitter_count(self):
         return UserProfile.objects \
             .filter(submissions__exercise=self) \
@@ -1009,6 +1092,30 @@ class BaseExercise(LearningObject):
             page.errors.append(msg)
             return page
 
+    def queue_grading(self, submission, user=None, url_name="exercise"):
+        """
+        Sends the submission to the grader in a celery task, which starts
+        after the current transaction has been committed. Returns a page,
+        which tells to wait for the feedback. See `ASYNC_GRADING`.
+        """
+        from .tasks import grade_submission # pylint: disable=import-outside-toplevel
+        # The service is in SUBMISSION_RETRY_SERVICES, so the submission is
+        # retried after it expires, if the task is lost or the grading fails.
+        submission.mark_pending()
+        args = (submission.id, url_name, user.id if user else None)
+        transaction.on_commit(lambda: grade_submission.delay(*args))
+        page = ExercisePage(self)
+        page.is_wait = True
+        return page
+
+    @property
+    def can_grade_asynchronously(self):
+        """Can the submissions be graded outside the web request that
+        created them, i.e., with `queue_grading`? Only the submissions of
+        the services, whose submissions are retried, are graded so, because
+        otherwise a lost task would leave the submission ungraded."""
+        return urlsplit(self.service_url).netloc in settings.SUBMISSION_RETRY_SERVICES
+
     def modify_post_parameters(self, data, files, user, students, request, url): # pylint: disable=too-many-arguments
         """
         Allows to modify submission POST parameters before they are sent to
@@ -1227,6 +1334,11 @@ class LTIExercise(BaseExercise):
         # (A+ would upload a submission to the service and expect it to be graded)
         return False
 
+    @property
+    def can_grade_asynchronously(self):
+        # The LTI parameters are built from the web request.
+        return False
+
 
 # Note: One option would have been to create a common LTIExerciseBase class between
 # legacy LTI and LTI 1.3, but the two protocols are fairly different, and the migrations
@@ -1297,6 +1409,10 @@ class LTI1p3Exercise(BaseExercise):
     def can_regrade(self):
         return False
 
+    @property
+    def can_grade_asynchronously(self):
+        return False
+
 
 class StaticExercise(BaseExercise):
     """
@@ -1342,6 +1458,11 @@ class StaticExercise(BaseExercise):
     def can_regrade(self):
         return False
 
+    @property
+    def can_grade_asynchronously(self):
+        # The grading does not contact any service.
+        return False
+
 
 def build_upload_dir(instance, filename):
     """
@@ -0,0 +1,111 @@
+from datetime import timedelta
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from course.models import Course, CourseInstance, CourseModule, LearningObjectCategory
+from exercise.cache.content import CachedContent
+from exercise.models import BaseExercise, CourseChapter
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the generation time of the cached course content for synthetic courses. "
+        "The modules of the courses consist of chapters with four embedded exercises each. "
+        "The courses are created in a transaction, which is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sizes',
+            nargs='*',
+            type=int,
+            default=[100, 1000, 10000],
+            metavar='SIZE',
+            help="Numbers of learning objects in the courses (default: 100 1000 10000)",
+        )
+        parser.add_argument(
+            '--modules',
+            type=int,
+            default=10,
+            help="Number of modules in each course (default: 10)",
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help="Number of measurements of each course, the fastest one is reported (default: 3)",
+        )
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            with transaction.atomic():
+                instance = self.create_course(size, options['modules'])
+                best = min(self.measure(instance) for _ in range(options['repeat']))
+                transaction.set_rollback(True)
+            self.stdout.write("{} learning objects: {:.1f} ms".format(size, best * 1000))
+
+    def create_course(self, size, module_count):
+        now = timezone.now()
+        course = Course.objects.create(
+            name="Benchmark course",
+            code="BENCH-{}".format(size),
+            url="benchmark-{}".format(size),
+        )
+        instance = CourseInstance.objects.create(
+            instance_name="Benchmark",
+            starting_time=now,
+            ending_time=now + timedelta(days=30),
+            course=course,
+            url="benchmark",
+        )
+        category = LearningObjectCategory.objects.create(
+            name="Benchmark category",
+            course_instance=instance,
+        )
+        for m in range(module_count):
+            module = CourseModule.objects.create(
+                name="Module {}".format(m + 1),
+                url="module-{}".format(m + 1),
+                order=m + 1,
+                course_instance=instance,
+                opening_time=now,
+                closing_time=now + timedelta(days=30),
+            )
+            # The objects are divided evenly between the modules.
+            count = size // module_count + (m < size % module_count)
+            c = 0
+            while count > 0:
+                c += 1
+                chapter = CourseChapter.objects.create(
+                    name="Chapter {}".format(c),
+                    url="chapter-{}".format(c),
+                    order=c,
+                    course_module=module,
+                    category=category,
+                )
+                count -= 1
+                for e in range(min(4, count)):
+                    BaseExercise.objects.create(
+                        name="Exercise {}.{}".format(c, e + 1),
+                        url="exercise-{}".format(e + 1),
+                        order=e + 1,
+                        course_module=module,
+                        category=category,
+                        parent=chapter,
+                        max_points=10,
+                    )
+                    count -= 1
+        return instance
+
+    def measure(self, instance):
+        # The data is generated without reading or storing the cache, so that
+        # the cache is not left with the content of a rolled back course.
+        content = CachedContent.__new__(CachedContent)
+        content.instance = instance
+        content.dirty = False
+        start = perf_counter()
+        content._generate_data(instance)
+        return perf_counter() - start
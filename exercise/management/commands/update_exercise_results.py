@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from course.models import CourseInstance
+from exercise.models import BaseExercise, ExerciseResult
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the exercise results of all submitters from their submissions. "
+        "Run this once to fill the results of the existing submissions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'instance_ids',
+            nargs='*',
+            type=int,
+            metavar='INSTANCE_ID',
+            help="Ids of the course instances (default: all course instances)",
+        )
+
+    def handle(self, *args, **options):
+        if options['instance_ids']:
+            instances = []
+            for instance_id in options['instance_ids']:
+                try:
+                    instances.append(CourseInstance.objects.get(pk=instance_id))
+                except CourseInstance.DoesNotExist as exc:
+                    raise CommandError("Course instance id {} not found".format(instance_id)) from exc
+        else:
+            instances = CourseInstance.objects.all()
+
+        for instance in instances:
+            exercises = (
+                BaseExercise.objects
+                .without_subclasses()
+                .filter(course_module__course_instance=instance)
+                .order_by('id')
+            )
+            count = 0
+            for exercise in exercises:
+                # One transaction per exercise
+                ExerciseResult.objects.update_results(exercise)
+                count += 1
+            self.stdout.write("{}: updated the results of {} exercises".format(instance, count))
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from course.models import CourseInstance
+from exercise.cache.points import warm_up_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Regenerate the cached content of course instances and the cached "
+        "points of their recently active students"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'instance_ids',
+            nargs='+',
+            type=int,
+            metavar='INSTANCE_ID',
+            help="Ids of the course instances",
+        )
+        parser.add_argument(
+            '-d',
+            '--days',
+            type=int,
+            default=settings.CACHE_WARM_UP_ACTIVE_DAYS,
+            help="Regenerate the points of the users who have submitted in the course "
+                 "during the past N days (default: %(default)s).",
+        )
+
+    def handle(self, *args, **options):
+        for instance_id in options['instance_ids']:
+            try:
+                instance = CourseInstance.objects.get(pk=instance_id)
+            except CourseInstance.DoesNotExist as exc:
+                raise CommandError("Course instance id {} not found".format(instance_id)) from exc
+            count = warm_up_cache(instance, options['days'])
+            self.stdout.write("{}: warmed up the cache for {} users".format(instance, count))
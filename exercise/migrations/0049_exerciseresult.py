@@ -0,0 +1,37 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userprofile', '0006_auto_20210812_1536'),
+        ('exercise', '0048_alter_revealrule_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExerciseResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grading_mode', models.IntegerField(choices=[(1, 'GRADING_MODE_BEST'), (2, 'GRADING_MODE_LAST')], default=1, verbose_name='LABEL_GRADING_MODE')),
+                ('points', models.IntegerField(default=0, verbose_name='LABEL_POINTS')),
+                ('submission_count', models.IntegerField(default=0, verbose_name='LABEL_SUBMISSION_COUNT')),
+                ('unofficial_points', models.IntegerField(default=0, verbose_name='LABEL_UNOFFICIAL_POINTS')),
+                ('unofficial_count', models.IntegerField(default=0, verbose_name='LABEL_UNOFFICIAL_SUBMISSION_COUNT')),
+                ('unofficial', models.BooleanField(default=False, verbose_name='LABEL_UNOFFICIAL')),
+                ('forced', models.BooleanField(default=False, verbose_name='LABEL_FORCE_EXERCISE_POINTS')),
+                ('last_submission_time', models.DateTimeField(blank=True, null=True, verbose_name='LABEL_LAST_SUBMISSION_TIME')),
+                ('best_submission', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='exercise.submission', verbose_name='LABEL_BEST_SUBMISSION')),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='exercise.baseexercise', verbose_name='LABEL_EXERCISE')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exercise_results', to='userprofile.userprofile', verbose_name='LABEL_SUBMITTER')),
+            ],
+            options={
+                'verbose_name': 'MODEL_NAME_EXERCISE_RESULT',
+                'verbose_name_plural': 'MODEL_NAME_EXERCISE_RESULT_PLURAL',
+                'unique_together': {('exercise', 'profile')},
+            },
+        ),
+    ]
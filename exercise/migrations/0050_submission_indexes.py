@@ -0,0 +1,37 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercise', '0049_exerciseresult'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['exercise', 'status'], name='exercise_sub_ex_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['exercise', '-submission_time'], name='exercise_sub_ex_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['submission_time'], name='exercise_sub_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingsubmission',
+            index=models.Index(fields=['submission_time'], name='exercise_pending_time_idx'),
+        ),
+        # The automatic through table of Submission.submitters can not have
+        # indexes in the model state. The submissions of the users are looked
+        # up with this index only, without reading the table.
+        migrations.RunSQL(
+            'CREATE INDEX exercise_sub_submitters_profile_idx'
+            ' ON exercise_submission_submitters (userprofile_id, submission_id);',
+            'DROP INDEX exercise_sub_submitters_profile_idx;',
+        ),
+    ]
@@ -6,7 +6,7 @@ from django.utils.text import format_lazy
 from django.utils.translation import gettext_lazy as _
 
 from lib.email_messages import email_course_error
-from lib.remote_page import RemotePage, RemotePageException
+from lib.remote_page import RemotePage, RemotePageException, RemotePageUnavailable
 from .exercise_page import ExercisePage
 
 from lti_tool.utils import send_lti_points
@@ -31,6 +31,10 @@ def load_exercise_page(request, url, last_modified, exercise):
             RemotePage(url, instance_id=exercise.course_instance.id, stamp=last_modified),
             exercise
         )
+    except RemotePageUnavailable:
+        # The failures that opened the circuit have been reported already.
+        messages.error(request,
+            _('EXERCISE_SERVICE_ERROR_CONNECTION_FAILED'))
     except RemotePageException:
         messages.error(request,
             _('EXERCISE_SERVICE_ERROR_CONNECTION_FAILED'))
@@ -55,6 +59,9 @@ def load_feedback_page(request, url, exercise, submission, no_penalties=False):
         remote_page = RemotePage(url, post=True, data=data, files=files, instance_id=exercise.course_instance.id)
         submission.clean_post_parameters()
         parse_page_content(page, remote_page, exercise)
+    except RemotePageUnavailable:
+        # The failures that opened the circuit have been reported already.
+        page.errors.append(_('ASSESSMENT_SERVICE_ERROR_CONNECTION_FAILED'))
     except RemotePageException:
         page.errors.append(_('ASSESSMENT_SERVICE_ERROR_CONNECTION_FAILED'))
         if exercise.course_instance.visible_to_students:
@@ -164,8 +171,7 @@ def parse_page_content(
         page.is_accepted = True
         page.is_wait = False
 
-    remote_page.fix_relative_urls()
-    remote_page.find_and_replace('data-aplus-exercise', [{
+    remote_page.process_elements('data-aplus-exercise', [{
         'id': ('chapter-exercise-' + str(o.order)),
         'data-aplus-exercise': o.get_absolute_url(),
     } for i,o in enumerate(exercise.children.all())])
@@ -1,8 +1,25 @@
-from typing import Dict, List, Optional, cast
+from typing import Any, Callable, Dict, List, Optional, cast
 
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString, Tag
 
+
+def _find_exercise_element(soup: BeautifulSoup) -> Optional[Tag]:
+    """
+    Finds the element that contains the exercise content. Returns `None` if
+    not found.
+    """
+    # The exercise content element may be identified by a number of
+    # different ids or classes
+    exercise_element = soup.find(id=['exercise', 'aplus', 'chapter'])
+    if not isinstance(exercise_element, Tag):
+        exercise_element = soup.find({'class': 'entry-content'})
+    if not isinstance(exercise_element, Tag):
+        exercise_element = soup.body
+
+    return exercise_element
+
+
 class ExercisePage:
     """
     Represents the pages that are received from exercise services as objects.
@@ -21,6 +38,10 @@ class ExercisePage:
             if hasattr(exercise, 'max_points') else 0
         self.head = ""
         self.content = ""
+        # The content prepared for populate_form, see build_form_template.
+        # The cached form template is loaded only when the form is populated.
+        self.form_template = None
+        self.form_template_loader: Optional[Callable[[], Optional[List[Any]]]] = None
         self.clean_content = ""
         self.last_modified = ""
         self.expires = 0
@@ -51,9 +72,33 @@ class ExercisePage:
         If `feedback_revealed` is False, file input fields in the form
         are marked as disabled and the submit button is removed.
         """
+        if self.form_template is None and self.form_template_loader is not None:
+            self.form_template = self.form_template_loader()
+            self.form_template_loader = None
+        if self.form_template is None:
+            self.form_template = build_form_template(self.content)
+        if self.form_template is None:
+            # Forms nested in forms are populated in the parsed tree.
+            self._populate_soup(field_values, data_values, allow_submit, feedback_revealed)
+            return
+        self.content = render_form_template(
+            self.form_template,
+            field_values or {},
+            data_values,
+            allow_submit,
+            feedback_revealed,
+        )
+
+    def _populate_soup(
+            self,
+            field_values: Optional[Dict[str, List[str]]],
+            data_values: Optional[Dict[str, str]],
+            allow_submit: bool,
+            feedback_revealed: bool,
+        ) -> None:
         soup = BeautifulSoup(self.content, 'html5lib')
 
-        exercise_element = self._find_exercise_element(soup)
+        exercise_element = _find_exercise_element(soup)
         if exercise_element is None:
             return
         if field_values is None:
@@ -72,21 +117,6 @@ class ExercisePage:
                 self._remove_submit_button(form_element)
         self.content = str(exercise_element)
 
-    def _find_exercise_element(self, soup: BeautifulSoup) -> Optional[Tag]:
-        """
-        Finds the element that contains the exercise content. Returns `None` if
-        not found.
-        """
-        # The exercise content element may be identified by a number of
-        # different ids or classes
-        exercise_element = soup.find(id=['exercise', 'aplus', 'chapter'])
-        if not isinstance(exercise_element, Tag):
-            exercise_element = soup.find({'class': 'entry-content'})
-        if not isinstance(exercise_element, Tag):
-            exercise_element = soup.body
-
-        return exercise_element
-
     def _populate_fields(
             self,
             form_element: Tag,
@@ -149,3 +179,157 @@ class ExercisePage:
         """
         for submit_element in form_element.find_all(['input', 'button'], type='submit'):
             cast(Tag, submit_element).decompose()
+
+
+# Separates the slots from the HTML in the serialized form template. The HTML
+# parser replaces the null characters, so they never occur in the content.
+SLOT_MARKER = '\x00'
+
+
+def build_form_template(content: str) -> Optional[List[Any]]:
+    """
+    Parses the content and prepares it for `render_form_template`, so that the
+    forms can be populated without parsing the content again. The form
+    template is a list of the forms and the HTML split into literal parts and
+    slots for the form elements, which are modified when populating the form.
+    Returns `None`, if the form template can not be built.
+    """
+    soup = BeautifulSoup(content, 'html5lib')
+    exercise_element = _find_exercise_element(soup)
+    if exercise_element is None:
+        return None
+
+    forms = []
+    slots = []
+
+    def add_slot(element: Tag, slot: List[Any]) -> None:
+        marker = NavigableString('{0}{1:d}{0}'.format(SLOT_MARKER, len(slots)))
+        slots.append(slot)
+        element.replace_with(marker)
+
+    def add_marker(element: Tag, slot: List[Any], after: bool = False) -> None:
+        marker = NavigableString('{0}{1:d}{0}'.format(SLOT_MARKER, len(slots)))
+        slots.append(slot)
+        if after:
+            element.insert_after(marker)
+        else:
+            element.insert_before(marker)
+
+    for form_element in exercise_element.find_all('form'):
+        if form_element.find('form'):
+            return None
+        form = len(forms)
+        file_names = []
+        for submit_element in form_element.find_all(['input', 'button'], type='submit'):
+            add_marker(submit_element, ['submit', form])
+            add_marker(submit_element, ['end'], after=True)
+        for field_element in form_element.find_all(['input', 'select', 'textarea']):
+            name = field_element.get('name')
+            if field_element.name == 'input':
+                if field_element.get('type') == 'file':
+                    file_names.append(name)
+                add_slot(field_element, ['input', form, name, dict(field_element.attrs)])
+            elif field_element.name == 'select':
+                for option_element in field_element.find_all('option'):
+                    add_slot(option_element, [
+                        'option',
+                        name,
+                        dict(option_element.attrs),
+                        option_element.decode_contents(),
+                    ])
+            elif field_element.name == 'textarea':
+                inner = field_element.decode_contents()
+                field_element.clear()
+                start = str(field_element)[:-len('</textarea>')]
+                add_slot(field_element, ['textarea', name, start, inner])
+        forms.append(file_names)
+        add_marker(form_element, ['form', form, dict(form_element.attrs)])
+        add_marker(form_element, ['end_form'], after=True)
+        form_element.unwrap()
+
+    parts: List[Any] = str(exercise_element).split(SLOT_MARKER)
+    for i in range(1, len(parts), 2):
+        parts[i] = slots[int(parts[i])]
+    return [forms, parts]
+
+
+def render_form_template(
+        form_template: List[Any],
+        field_values: Dict[str, List[str]],
+        data_values: Optional[Dict[str, str]],
+        allow_submit: bool,
+        feedback_revealed: bool,
+    ) -> str:
+    """
+    Renders the form template built by `build_form_template` with the provided
+    values, like `ExercisePage.populate_form` does to the parsed content.
+    """
+    forms, parts = form_template
+    remove_submit = [
+        not allow_submit or (
+            not feedback_revealed
+            and any(name not in field_values for name in file_names)
+        )
+        for file_names in forms
+    ]
+    html = []
+    skip = 0
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            if not skip:
+                html.append(part)
+            continue
+        kind = part[0]
+        if kind == 'submit':
+            if skip or remove_submit[part[1]]:
+                skip += 1
+        elif kind == 'end':
+            if skip:
+                skip -= 1
+        elif skip:
+            continue
+        elif kind == 'form':
+            attrs = dict(part[2])
+            if data_values is not None:
+                for data_key, data_value in data_values.items():
+                    attrs[f'data-{data_key}'] = data_value
+            html.append(_start_tag('form', attrs))
+        elif kind == 'end_form':
+            html.append('</form>')
+        elif kind == 'input':
+            _, form, name, attrs = part
+            if name not in field_values:
+                if not feedback_revealed and attrs.get('type') == 'file':
+                    attrs = dict(attrs, disabled='')
+            elif attrs.get('type') in ('radio', 'checkbox'):
+                attrs = dict(attrs)
+                if attrs.get('value') in field_values[name]:
+                    attrs['checked'] = ''
+                else:
+                    attrs.pop('checked', None)
+            else:
+                attrs = dict(attrs, value=field_values[name][0])
+            html.append(_start_tag('input', attrs))
+        elif kind == 'option':
+            _, name, attrs, inner = part
+            if name in field_values:
+                attrs = dict(attrs)
+                if attrs.get('value') in field_values[name]:
+                    attrs['selected'] = ''
+                else:
+                    attrs.pop('selected', None)
+            html.append(_start_tag('option', attrs) + inner + '</option>')
+        elif kind == 'textarea':
+            _, name, start, inner = part
+            if name in field_values:
+                inner = NavigableString(field_values[name][0]).output_ready()
+            html.append(start + inner + '</textarea>')
+    return ''.join(html)
+
+
+def _start_tag(name: str, attrs: Dict[str, Any]) -> str:
+    element = Tag(name=name, attrs=attrs, can_be_empty_element=name == 'input')
+    html = str(element)
+    if name == 'input':
+        return html
+    return html[:-len(name) - 3]
@@ -46,7 +46,8 @@
         })
         .done(function(data) {
           poller.count++;
-          if (data.trim() === "ready" || data.trim() === "error" || data.trim() === "unofficial") {
+          const status = data.trim();
+          if (status === "ready" || status === "error" || status === "unofficial" || status === "rejected") {
             poller.ready();
           } else if (poller.element.is(":visible")) {
             if (poller.count < poller.settings.poll_delays.length) {
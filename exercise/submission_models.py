@@ -1,16 +1,17 @@
+from collections import defaultdict
 import itertools
 import json
 import logging
 from mimetypes import guess_type
 import os
-from typing import IO, Dict, Iterable, List, Tuple, TYPE_CHECKING, Callable
+from typing import IO, Any, Dict, Iterable, List, Tuple, TYPE_CHECKING, Callable
 from urllib.parse import urlparse
 
 from binaryornot.check import is_binary
 from django.conf import settings
-from django.db import models, DatabaseError
+from django.db import models, transaction, DatabaseError
 from django.db.models import F
-from django.db.models.signals import post_delete
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.http.request import HttpRequest
 from django.utils import timezone
 from django.utils.translation import get_language, gettext_lazy as _
@@ -18,6 +19,7 @@ from django.utils.translation import get_language, gettext_lazy as _
 from exercise.protocol.exercise_page import ExercisePage
 from authorization.models import JWTAccessible
 from authorization.object_permissions import register_jwt_accessible_class
+from lib.circuit_breaker import CircuitBreaker
 from lib.fields import DefaultForeignKey, JSONField, PercentField
 from lib.helpers import (
     get_random_string,
@@ -353,6 +355,8 @@ class Submission(UrlMixin, models.Model):
         verbose_name=_('LABEL_EXERCISE'),
         on_delete=models.CASCADE,
         related_name="submissions")
+    # The through table has an extra index on (userprofile, submission),
+    # see migration 0050.
     submitters = models.ManyToManyField(UserProfile,
         verbose_name=_('LABEL_SUBMITTERS'),
         related_name="submissions")
@@ -425,6 +429,11 @@ class Submission(UrlMixin, models.Model):
         verbose_name_plural = _('MODEL_NAME_SUBMISSION_PLURAL')
         app_label = 'exercise'
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['exercise', 'status'], name='exercise_sub_ex_status_idx'),
+            models.Index(fields=['exercise', '-submission_time'], name='exercise_sub_ex_time_idx'),
+            models.Index(fields=['submission_time'], name='exercise_sub_time_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -609,10 +618,11 @@ class Submission(UrlMixin, models.Model):
                 "site": settings.BASE_URL,
             })
 
-        if not PendingSubmission.objects.is_grader_stable():
-            # We have a successful grading task in the recovery state. It may be a sign that problems
-            # have been resolved, so immediately retry the next pending submission, to speed up recovery
-            retry_submissions()
+        grading_host = urlparse(self.exercise.service_url).netloc
+        if grading_host in settings.SUBMISSION_RETRY_SERVICES and CircuitBreaker(grading_host).recovered():
+            # The grader has come back after a failure. Retry its pending submissions now
+            # instead of waiting for the periodic task, to speed up the recovery.
+            retry_submissions.delay(grading_host)
 
     def set_rejected(self):
         self.status = self.STATUS.REJECTED
@@ -829,31 +839,6 @@ def _delete_file(sender, instance, **kwargs): # pylint: disable=unused-argument
 post_delete.connect(_delete_file, SubmittedFile)
 
 
-class PendingSubmissionManager(models.Manager):
-
-    def is_grader_stable(self):
-        total_retries = self.aggregate(sum=models.Sum('num_retries'))['sum']
-        return not (total_retries and total_retries > settings.GRADER_STABLE_THRESHOLD)
-
-
-    def get_exercise_names_if_grader_is_unstable(self, instance):
-        total_retries_per_exercise = self.values(
-            'submission__exercise__name',
-        ).filter(
-            submission__exercise__course_module__course_instance=instance.id,
-        ).annotate(
-            num_retries=models.Sum('num_retries'),
-        ).order_by(
-            '-num_retries',
-        )[:10]
-        total_retries = sum(entry['num_retries'] for entry in total_retries_per_exercise)
-        # Check if the grader can be considered unstable on this course instance
-        if total_retries > settings.GRADER_STABLE_THRESHOLD:
-            exercises = ", ".join(f"'{entry['submission__exercise__name']}'" for entry in total_retries_per_exercise)
-            return exercises
-        return ''
-
-
 class PendingSubmission(models.Model):
     submission = models.OneToOneField(Submission,
         verbose_name=_('LABEL_SUBMISSION'),
@@ -867,8 +852,332 @@ class PendingSubmission(models.Model):
         verbose_name=_('LABEL_NUMBER_OF_RETRIES'),
         default=0,
     )
-    objects = PendingSubmissionManager()
 
     class Meta:
         verbose_name = _('MODEL_NAME_PENDING_SUBMISSION')
         verbose_name_plural = _('MODEL_NAME_PENDING_SUBMISSION_PLURAL')
+        indexes = [models.Index(fields=['submission_time'], name='exercise_pending_time_idx')]
+
+
+class ExerciseResultQuerySet(models.QuerySet):
+
+    def values_submitter_points(
+            self,
+            revealed_ids: Iterable[int] = None,
+            include_unofficial: bool = False,
+            ) -> 'ExerciseResultQuerySet':
+        """
+        Returns the same rows as `SubmissionQuerySet.annotate_submitter_points`
+        chained after `values('submitters__user_id', 'exercise_id')` and the
+        submission count annotation `count`, when the submissions with status
+        `ERROR` and `REJECTED`, and `UNOFFICIAL` unless `include_unofficial`
+        is `True`, are excluded.
+
+        Provide `revealed_ids`, if you want to hide unrevealed points from the
+        queryset.
+        """
+        if include_unofficial:
+            count = F('submission_count') + F('unofficial_count')
+            total = F('unofficial_points')
+        else:
+            count = F('submission_count')
+            total = F('points')
+        if revealed_ids is not None:
+            # revealed_ids may be an empty set.
+            if revealed_ids:
+                total = models.Case(
+                    models.When(~models.Q(exercise__in=revealed_ids), then=0),
+                    default=total,
+                )
+            else:
+                total = models.Value(0)
+        return (
+            self.annotate(count=count, total=total)
+            .filter(count__gt=0)
+            .values('exercise_id', 'count', 'total', submitters__user_id=F('profile__user_id'))
+        )
+
+
+class ExerciseResultManager(models.Manager):
+    _queryset_class = ExerciseResultQuerySet
+
+    def update_results(
+            self,
+            exercise: exercise_models.BaseExercise,
+            profile_ids: Iterable[int] = None,
+            ) -> None:
+        """
+        Recomputes the results of the given submitters, or all submitters if
+        `profile_ids` is None, in the exercise. When called inside the
+        transaction that modifies the submissions, the results are committed
+        together with the submissions.
+        """
+        with transaction.atomic(using=self.db):
+            results = self.filter(exercise=exercise)
+            submissions = (
+                Submission.objects
+                .filter(exercise=exercise)
+                .exclude(status__in=(Submission.STATUS.ERROR, Submission.STATUS.REJECTED))
+            )
+            if profile_ids is not None:
+                profile_ids = sorted(set(profile_ids))
+                if not profile_ids:
+                    return
+                # The rows are created first, so that they can be locked.
+                # The locks serialize the concurrent updates of the same
+                # submitters, and the later update reads the submissions after
+                # the earlier one has been committed.
+                self.bulk_create(
+                    [
+                        ExerciseResult(exercise=exercise, profile_id=profile_id, grading_mode=exercise.grading_mode)
+                        for profile_id in profile_ids
+                    ],
+                    ignore_conflicts=True,
+                )
+                results = results.filter(profile_id__in=profile_ids)
+                submissions = submissions.filter(submitters__in=profile_ids)
+            current = {
+                result.profile_id: result
+                for result in results.select_for_update().order_by('profile_id')
+            }
+
+            by_profile = defaultdict(list)
+            for row in submissions.values_list(
+                    'submitters__id',
+                    'id',
+                    'status',
+                    'grade',
+                    'submission_time',
+                    'force_exercise_points',
+                    named=True,
+                    ).order_by():
+                by_profile[row.submitters__id].append(row)
+
+            changed = []
+            created = []
+            for profile_id, rows in by_profile.items():
+                result = current.pop(profile_id, None)
+                if result is None:
+                    result = ExerciseResult(exercise=exercise, profile_id=profile_id)
+                    created.append(result)
+                else:
+                    changed.append(result)
+                result.set_submissions(exercise.grading_mode, rows)
+
+            # The submitters who no longer have any submissions
+            if current:
+                self.filter(pk__in=[result.pk for result in current.values()]).delete()
+            if changed:
+                self.bulk_update(changed, ExerciseResult.COMPUTED_FIELDS)
+            if created:
+                # A concurrent update may have created some of the rows.
+                self.bulk_create(created, ignore_conflicts=True)
+
+
+class ExerciseResult(models.Model):
+    """
+    The points of a submitter in an exercise, maintained from the submissions.
+    See `ExerciseResultQuerySet.values_submitter_points` for reading them like
+    `SubmissionQuerySet.annotate_submitter_points` computes them.
+
+    The submissions with status `ERROR` and `REJECTED` are ignored. `points`
+    and `submission_count` count the official submissions, and
+    `unofficial_points` and `unofficial_count` the unofficial ones too.
+    """
+    COMPUTED_FIELDS = [
+        'grading_mode',
+        'best_submission',
+        'points',
+        'submission_count',
+        'unofficial_points',
+        'unofficial_count',
+        'unofficial',
+        'forced',
+        'last_submission_time',
+    ]
+
+    profile = models.ForeignKey(UserProfile,
+        verbose_name=_('LABEL_SUBMITTER'),
+        on_delete=models.CASCADE,
+        related_name="exercise_results",
+    )
+    exercise = models.ForeignKey(exercise_models.BaseExercise,
+        verbose_name=_('LABEL_EXERCISE'),
+        on_delete=models.CASCADE,
+        related_name="results",
+    )
+    # The grading mode of the exercise when the points were computed
+    grading_mode = models.IntegerField(
+        verbose_name=_('LABEL_GRADING_MODE'),
+        choices=exercise_models.BaseExercise.GRADING_MODE.choices,
+        default=exercise_models.BaseExercise.GRADING_MODE.BEST,
+    )
+    best_submission = models.ForeignKey(Submission,
+        verbose_name=_('LABEL_BEST_SUBMISSION'),
+        on_delete=models.SET_NULL,
+        related_name="+",
+        blank=True, null=True,
+    )
+    points = models.IntegerField(
+        verbose_name=_('LABEL_POINTS'),
+        default=0,
+    )
+    submission_count = models.IntegerField(
+        verbose_name=_('LABEL_SUBMISSION_COUNT'),
+        default=0,
+    )
+    unofficial_points = models.IntegerField(
+        verbose_name=_('LABEL_UNOFFICIAL_POINTS'),
+        default=0,
+    )
+    unofficial_count = models.IntegerField(
+        verbose_name=_('LABEL_UNOFFICIAL_SUBMISSION_COUNT'),
+        default=0,
+    )
+    # The best submission is unofficial, when unofficial submissions are included
+    unofficial = models.BooleanField(
+        verbose_name=_('LABEL_UNOFFICIAL'),
+        default=False,
+    )
+    forced = models.BooleanField(
+        verbose_name=_('LABEL_FORCE_EXERCISE_POINTS'),
+        default=False,
+    )
+    last_submission_time = models.DateTimeField(
+        verbose_name=_('LABEL_LAST_SUBMISSION_TIME'),
+        blank=True, null=True,
+    )
+
+    objects = ExerciseResultManager()
+
+    class Meta:
+        verbose_name = _('MODEL_NAME_EXERCISE_RESULT')
+        verbose_name_plural = _('MODEL_NAME_EXERCISE_RESULT_PLURAL')
+        app_label = 'exercise'
+        unique_together = ('exercise', 'profile')
+
+    def __str__(self):
+        return "{} {}: {}".format(self.profile, self.exercise_id, self.points)
+
+    def set_submissions(self, grading_mode: int, submissions: List[Tuple]) -> None:
+        """
+        Computes the fields from the submissions of the submitter, which
+        are rows of `id`, `status`, `grade`, `submission_time` and
+        `force_exercise_points` without the `ERROR` and `REJECTED` ones.
+        """
+        official = [s for s in submissions if s.status != Submission.STATUS.UNOFFICIAL]
+        best, self.forced = self._find_best(grading_mode, official, (Submission.STATUS.READY,))
+        unofficial_best, _forced = self._find_best(
+            grading_mode,
+            submissions,
+            (Submission.STATUS.READY, Submission.STATUS.UNOFFICIAL),
+        )
+        self.grading_mode = grading_mode
+        self.best_submission_id = best.id if best else None
+        self.points = best.grade if best else 0
+        self.submission_count = len(official)
+        self.unofficial_points = unofficial_best.grade if unofficial_best else 0
+        self.unofficial_count = len(submissions) - len(official)
+        self.unofficial = (
+            unofficial_best is not None
+            and unofficial_best.status == Submission.STATUS.UNOFFICIAL
+        )
+        self.last_submission_time = max(s.submission_time for s in submissions) if submissions else None
+
+    @staticmethod
+    def _find_best(grading_mode: int, submissions: List[Tuple], statuses: Tuple[str, ...]) -> Tuple[Any, bool]:
+        """
+        Returns the submission that gives the points, and whether the points
+        were forced, following `SubmissionQuerySet.annotate_submitter_points`.
+        """
+        forced = [s for s in submissions if s.force_exercise_points]
+        if forced:
+            return max(forced, key=lambda s: (s.grade, s.submission_time)), True
+        graded = [s for s in submissions if s.status in statuses]
+        if not graded:
+            return None, False
+        if grading_mode == exercise_models.BaseExercise.GRADING_MODE.LAST:
+            return max(graded, key=lambda s: (s.submission_time, s.id)), False
+        return max(graded, key=lambda s: (s.grade, s.submission_time)), False
+
+
+# Submission fields that affect the exercise results
+_RESULT_FIELDS = {'exercise', 'exercise_id', 'status', 'grade', 'submission_time', 'force_exercise_points'}
+
+
+def _is_cascaded(origin) -> bool:
+    # The results are deleted in the same cascade as the submissions of the
+    # deleted exercise, so they must not be recomputed.
+    return (
+        origin is not None
+        and not isinstance(origin, Submission)
+        and getattr(origin, 'model', None) is not Submission
+    )
+
+
+# pylint: disable-next=unused-argument too-many-arguments
+def _update_results(sender, instance, update_fields=None, raw=False, origin=None, **kwargs):
+    if not settings.USE_EXERCISE_RESULTS or raw or _is_cascaded(origin):
+        return
+    if update_fields is not None and not _RESULT_FIELDS.intersection(update_fields):
+        return
+    profile_ids = getattr(instance, '_result_profile_ids', None)
+    if profile_ids is None:
+        profile_ids = instance.submitters.values_list('id', flat=True)
+    ExerciseResult.objects.update_results(instance.exercise, profile_ids)
+
+
+def _remember_submitters(sender, instance, origin=None, **kwargs): # pylint: disable=unused-argument
+    if not settings.USE_EXERCISE_RESULTS or _is_cascaded(origin):
+        return
+    # The submitters can not be read after the submission has been deleted.
+    instance._result_profile_ids = list(instance.submitters.values_list('id', flat=True))
+
+
+# pylint: disable-next=too-many-arguments unused-argument
+def _update_results_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not settings.USE_EXERCISE_RESULTS:
+        return
+    if action == 'pre_clear':
+        instance._result_cleared_ids = list(
+            instance.submissions.values_list('id', flat=True) if reverse
+            else instance.submitters.values_list('id', flat=True)
+        )
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_result_cleared_ids', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        # instance is a UserProfile and pk_set contains submissions
+        exercises = (
+            exercise_models.BaseExercise.objects
+            .without_subclasses()
+            .filter(submissions__in=pk_set)
+            .distinct()
+        )
+        for exercise in exercises:
+            ExerciseResult.objects.update_results(exercise, [instance.id])
+    else:
+        # instance is a Submission and pk_set contains user profiles
+        ExerciseResult.objects.update_results(instance.exercise, pk_set)
+
+
+def _update_exercise_results(sender, instance, **kwargs): # pylint: disable=unused-argument
+    # The results are recomputed when the grading mode of the exercise changes.
+    if (
+        settings.USE_EXERCISE_RESULTS
+        and isinstance(instance, exercise_models.BaseExercise)
+        and ExerciseResult.objects
+            .filter(exercise=instance)
+            .exclude(grading_mode=instance.grading_mode)
+            .exists()
+    ):
+        ExerciseResult.objects.update_results(instance)
+
+
+post_save.connect(_update_results, Submission)
+pre_delete.connect(_remember_submitters, Submission)
+post_delete.connect(_update_results, Submission)
+m2m_changed.connect(_update_results_m2m, Submission.submitters.through)
+post_save.connect(_update_exercise_results, exercise_models.LearningObject)
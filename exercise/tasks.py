@@ -1,8 +1,16 @@
 import logging
-from time import sleep
+from typing import Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.html import format_html_join
 
 from aplus.celery import app
-from .exercise_models import BaseExercise, ExerciseTask
+from course.models import CourseInstance
+from lib.throttle import map_per_host
+from .cache.points import warm_up_cache
+from .exercise_models import BaseExercise, ExerciseTask, LearningObject
 from .submission_models import Submission
 
 logger = logging.getLogger('aplus.exercise')
@@ -28,8 +36,10 @@ def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None:
 
     count = 0
     total = qs.count()
-    for submission in qs:
-        page = exercise.grade(submission)
+    # The grading requests are sent concurrently within GRADER_REQUEST_LIMITS.
+    host = urlparse(exercise.service_url).netloc
+    graded = map_per_host(exercise.grade, ((host, submission) for submission in qs))
+    for submission, page in graded:
         for error in page.errors:
             logger.error( # pylint: disable=logging-fstring-interpolation
                 f"regrade_exercises task error (Exercise: {exercise.id}, Submission: {submission.id}): {error}"
@@ -43,7 +53,6 @@ def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None:
                 'total': total,
             },
         )
-        sleep(0.5)  # Delay 500 ms to avoid choking grader
 
     # Tell DB that there is no task running anymore
     try:
@@ -54,3 +63,57 @@ def regrade_exercises(self, exerciseid: int, regrade_type: str) -> None:
             exercise.id)
         return
     task.delete()
+
+
+@app.task
+def grade_submission(submission_id: int, url_name: str, user_id: Optional[int] = None) -> None:
+    """
+    Sends the submission to the grader like `ExerciseView.post` does in the
+    web request. See `BaseExercise.queue_grading`.
+    """
+    try:
+        submission = Submission.objects.get(pk=submission_id)
+    except Submission.DoesNotExist:
+        logger.warning("grade_submission task: submission id %s not found", submission_id)
+        return
+    exercise = submission.exercise
+    page = exercise.grade(submission, url_name=url_name)
+    for error in page.errors:
+        logger.error(
+            "grade_submission task error (Exercise: %s, Submission: %s): %s",
+            exercise.id, submission.id, error,
+        )
+    if page.errors and submission.status == Submission.STATUS.INITIALIZED:
+        # The grader could not be reached. Show the errors to the student, who
+        # waits for the feedback. The submission is still pending, so it is
+        # graded again, when it expires. See `BaseExercise.queue_grading`.
+        submission.status = Submission.STATUS.ERROR
+        submission.feedback = format_html_join(
+            '', '<div class="alert alert-danger">{}</div>', ((error,) for error in page.errors),
+        )
+        submission.save(update_fields=['status', 'feedback'])
+
+    # Enroll after succesfull enrollment exercise.
+    if (
+        user_id is not None
+        and exercise.status in (
+            LearningObject.STATUS.ENROLLMENT,
+            LearningObject.STATUS.ENROLLMENT_EXTERNAL,
+        )
+        and submission.status == Submission.STATUS.READY
+    ):
+        instance = exercise.course_instance
+        user = User.objects.filter(pk=user_id).first()
+        if user and not instance.is_course_staff(user):
+            instance.enroll_student(user)
+
+
+@app.task
+def warm_up_course(instance_id: int) -> None:
+    try:
+        instance = CourseInstance.objects.get(pk=instance_id)
+    except CourseInstance.DoesNotExist:
+        logger.warning("warm_up_course task: course instance id %s not found", instance_id)
+        return
+    count = warm_up_cache(instance, settings.CACHE_WARM_UP_ACTIVE_DAYS)
+    logger.info("warm_up_course task: warmed up the cache of %s for %d users", instance, count)
@@ -2,6 +2,7 @@ import json
 import urllib
 from datetime import datetime, timedelta
 from io import BytesIO, StringIO
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -11,20 +12,23 @@ from django.test import TestCase
 from django.test.client import RequestFactory
 from django.utils import timezone
 from django.utils.datastructures import MultiValueDict
+from requests.models import Response
 
 from course.models import Course, CourseInstance, CourseHook, CourseModule, \
-    LearningObjectCategory
+    LearningObjectCategory, StudentGroup
 from deviations.models import DeadlineRuleDeviation, \
     MaxSubmissionsRuleDeviation
 from exercise.exercise_models import build_upload_dir
 from exercise.exercise_summary import UserExerciseSummary
 from exercise.models import BaseExercise, StaticExercise, \
     ExerciseWithAttachment, Submission, SubmittedFile, LearningObject, \
-    RevealRule, CourseChapter
+    RevealRule, CourseChapter, PendingSubmission
 from exercise.protocol.exercise_page import ExercisePage
 from exercise.reveal_states import ExerciseRevealState, ModuleRevealState
 from exercise.submission_models import build_upload_dir as build_upload_dir_for_submission_model
+from exercise.tasks import grade_submission
 from lib.helpers import build_aplus_url
+from lib.remote_page import RemotePageException
 
 class ExerciseTest(TestCase):
     def setUp(self): # pylint: disable=too-many-statements
@@ -295,6 +299,30 @@ class ExerciseTest(TestCase):
         self.assertEqual(self.course_instance, self.learning_object.course_instance)
         self.assertEqual(self.course_instance, self.broken_learning_object.course_instance)
 
+    def test_learning_object_subclasses(self):
+        objects = LearningObject.objects.filter(course_module__course_instance=self.course_instance)
+        joined = list(objects.select_subclasses().order_by('id'))
+        self.assertIn(StaticExercise, [type(o) for o in joined])
+        self.assertIn(ExerciseWithAttachment, [type(o) for o in joined])
+        # One query for the base rows and one for each present subclass.
+        types = {type(o) for o in joined} - {LearningObject}
+        with self.assertNumQueries(1 + len(types)):
+            dispatched = list(objects.order_by('id'))
+        self.assertEqual([type(o) for o in dispatched], [type(o) for o in joined])
+        for a, b in zip(dispatched, joined):
+            self.assertEqual(a, b)
+            self.assertEqual(a.get_deferred_fields(), b.get_deferred_fields())
+            for field in type(a)._meta.concrete_fields:
+                if field.attname not in a.get_deferred_fields():
+                    self.assertEqual(getattr(a, field.attname), getattr(b, field.attname))
+        static = next(o for o in dispatched if isinstance(o, StaticExercise))
+        with self.assertNumQueries(0):
+            self.assertEqual(static.course_module.course_instance, self.course_instance)
+        self.assertEqual(
+            {type(o) for o in objects.without_subclasses()},
+            {LearningObject},
+        )
+
     def test_base_exercise_one_has_submissions(self):
         self.assertFalse(self.base_exercise.one_has_submissions([self.user.userprofile])[0])
         self.assertTrue(self.static_exercise.one_has_submissions([self.user.userprofile])[0])
@@ -413,6 +441,44 @@ class ExerciseTest(TestCase):
             self.old_base_exercise.check_submission_allowed(self.grader.userprofile)[0],
             self.old_base_exercise.SUBMIT_STATUS.ALLOWED)
 
+    def test_group_submission_allowed_queries(self):
+        user3 = User.objects.create(username="testUser3")
+        group_exercise = BaseExercise.objects.create(
+            name="group exercise",
+            course_module=self.course_module,
+            category=self.learning_object_category,
+            url="g1",
+            max_submissions=1,
+            min_group_size=1,
+            max_group_size=3,
+        )
+        profiles = [self.user.userprofile, self.user2.userprofile, user3.userprofile]
+        for profile in profiles:
+            self.course_instance.enroll_student(profile.user)
+        group = StudentGroup.objects.create(course_instance=self.course_instance)
+        group.members.set(profiles)
+        MaxSubmissionsRuleDeviation.objects.create(
+            exercise=group_exercise,
+            submitter=user3.userprofile,
+            extra_submissions=1,
+        )
+        submission = Submission.objects.create(exercise=group_exercise, status=Submission.STATUS.READY)
+        submission.submitters.set(profiles)
+        request = RequestFactory().post('/', {'_aplus_group': group.id})
+
+        # Enrollment, group and its members, the latest submission and its
+        # submitters, and the roles, submission counts and deviations of the
+        # members in one query.
+        with self.assertNumQueries(6):
+            status, warnings, students = group_exercise.check_submission_allowed(profiles[0], request)
+        self.assertEqual(status, group_exercise.SUBMIT_STATUS.ALLOWED)
+        self.assertEqual(warnings, [])
+        self.assertEqual(set(students), set(profiles))
+
+        MaxSubmissionsRuleDeviation.objects.all().delete()
+        status, warnings, students = group_exercise.check_submission_allowed(profiles[0], request)
+        self.assertEqual(status, group_exercise.SUBMIT_STATUS.AMOUNT_EXCEEDED)
+
     def test_base_exercise_submission_deviation(self):
         self.assertFalse(self.base_exercise.one_has_submissions([self.user.userprofile])[0])
         deviation = MaxSubmissionsRuleDeviation.objects.create( # pylint: disable=unused-variable
@@ -682,6 +748,23 @@ class ExerciseTest(TestCase):
         self.assertEqual("ready", self.submission.status)
         self.assertTrue(self.submission.is_graded)
 
+    def test_submission_json_fields(self):
+        self.submission.submission_data = [["key", "value"]]
+        self.submission.meta_data = {"lang": "en"}
+        self.submission.save()
+
+        submission = Submission.objects.get(id=self.submission.id)
+        submission.meta_data["lang"] = "fi"
+        submission.save()
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual(submission.submission_data, [["key", "value"]])
+        self.assertEqual(submission.meta_data, {"lang": "fi"})
+        self.assertIsNone(submission.grading_data)
+
+        Submission.objects.filter(id=submission.id).update(grading_data="not json")
+        submission.refresh_from_db()
+        self.assertIsNone(submission.grading_data)
+
     def test_submission_absolute_url(self):
         self.assertEqual(
             "/Course-Url/T-00.1000_d1/test-module/b1/submissions/1/",
@@ -874,6 +957,103 @@ class ExerciseTest(TestCase):
 
         exercise.delete()
 
+    def test_async_grading(self):
+        exercise = BaseExercise.objects.create(
+            order=5,
+            name="test exercise 5",
+            course_module=self.course_module,
+            category=self.learning_object_category,
+            url="ccc",
+            max_points=50,
+            points_to_pass=50,
+            max_submissions=0,
+            service_url="http://grader.invalid/testServiceURL",
+        )
+        self.course_instance.enroll_student(self.user)
+        self.client.login(username="testUser", password="testPassword")
+
+        with self.settings(ASYNC_GRADING=True, SUBMISSION_RETRY_SERVICES=["grader.invalid"]), \
+                patch.object(grade_submission, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(exercise.get_absolute_url(), {"key": "value"})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.endswith("?wait=1"))
+        submission = self.user.userprofile.submissions.get(exercise=exercise)
+        self.assertEqual(submission.status, Submission.STATUS.INITIALIZED)
+        delay.assert_called_once_with(submission.id, "exercise", self.user.id)
+        # The submission is retried, if the task is lost.
+        self.assertTrue(PendingSubmission.objects.filter(submission=submission).exists())
+
+        response = self.client.get(submission.get_url('submission-poll'))
+        self.assertEqual(response.content, b"initialized")
+
+        # The static exercises are graded in the request.
+        with self.settings(ASYNC_GRADING=True), patch.object(grade_submission, 'delay') as delay:
+            self.client.post(self.static_exercise.get_absolute_url(), {"key": "value"})
+        self.assertFalse(delay.called)
+
+        # The submissions of the services, which are not retried, are graded in the request.
+        with self.settings(ASYNC_GRADING=True), \
+                patch.object(grade_submission, 'delay') as delay, \
+                patch('lib.remote_page.request_for_response', side_effect=RemotePageException("failed")):
+            response = self.client.post(exercise.get_absolute_url(), {"key": "value"})
+        self.assertFalse(response.url.endswith("?wait=1"))
+        self.assertFalse(delay.called)
+
+    def test_grade_submission_task(self):
+        response = Response()
+        response._content = ( # pylint: disable=protected-access
+            b'<html><head><meta name="status" content="accepted" />'
+            b'<meta name="points" content="5" /><meta name="max-points" content="10" /></head>'
+            b'<body><div id="aplus"><p>Graded</p></div></body></html>'
+        )
+        response.status_code = 200
+        exercise = BaseExercise.objects.create(
+            name="test enrollment exercise 2",
+            course_module=self.course_module,
+            category=self.learning_object_category,
+            url="enroll-exercise-2",
+            max_points=10,
+            max_submissions=0,
+            status="enrollment",
+            service_url="http://grader.invalid/enroll",
+        )
+        submission = Submission.objects.create(exercise=exercise)
+        submission.submitters.add(self.user2.userprofile)
+        self.assertFalse(self.course_instance.is_student(self.user2))
+        with patch('lib.remote_page.request_for_response', return_value=response):
+            grade_submission(submission.id, "exercise", self.user2.id)
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, Submission.STATUS.READY)
+        self.assertEqual((submission.grade, submission.service_points, submission.service_max_points), (5, 5, 10))
+        self.assertIn('<p>Graded</p>', submission.feedback)
+        # The submitter is enrolled after grading the enrollment exercise.
+        self.assertTrue(self.course_instance.is_student(self.user2))
+
+        # The grading errors are logged and shown to the student, who waits for the feedback.
+        submission = Submission.objects.create(exercise=self.base_exercise)
+        submission.submitters.add(self.user.userprofile)
+        PendingSubmission.objects.create(submission=submission, submission_time=timezone.now())
+        with patch('lib.remote_page.request_for_response', side_effect=RemotePageException("failed")), \
+                self.assertLogs('aplus.exercise', 'ERROR') as logs:
+            grade_submission(submission.id, "exercise", self.user.id)
+        self.assertIn("Submission: {}".format(submission.id), logs.output[0])
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, Submission.STATUS.ERROR)
+        self.assertIn('alert-danger', submission.feedback)
+        self.client.login(username="testUser", password="testPassword")
+        response = self.client.get(submission.get_url('submission-poll'))
+        self.assertEqual(response.content, b"error")
+        # The submission is still retried.
+        self.assertTrue(PendingSubmission.objects.filter(submission=submission).exists())
+
+        # The submission may have been deleted before the task runs.
+        submission_id = submission.id
+        submission.delete()
+        with self.assertLogs('aplus.exercise', 'WARNING') as logs:
+            grade_submission(submission_id, "exercise", self.user.id)
+        self.assertIn("submission id {} not found".format(submission_id), logs.output[0])
+
     def test_can_show_model_solutions(self):
         course_module_with_late_submissions_open = CourseModule.objects.create(
             name="test module late open",
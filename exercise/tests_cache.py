@@ -1,8 +1,18 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
 from lib.testdata import CourseTestCase
-from course.models import CourseModule, LearningObjectCategory
+from course.models import CourseInstance, CourseModule, LearningObjectCategory
+from notification.models import Notification
 from .cache.content import CachedContent
-from .cache.hierarchy import PreviousIterator
-from .cache.points import CachedPoints
+from .cache.hierarchy import NoSuchContent, PreviousIterator
+from .cache.points import CachedPoints, FULL_UPDATE, warm_up_cache
 from .models import BaseExercise, StaticExercise, Submission, CourseChapter, RevealRule
 from deviations.models import DeadlineRuleDeviation
 
@@ -98,6 +108,27 @@ class CachedContentTest(CourseTestCase):
         sizes = [3,4,3]
         for i,m in enumerate(c.modules_flatted()):
             self.assertEqual(len(list(m['flatted'])), sizes[i])
+        self.assertNotIn('flatted', c.modules()[0])
+
+    def test_indexes(self):
+        c = CachedContent(self.instance)
+        # All modules have the same number, the first one is found.
+        self.assertEqual(c.find_number('1')['id'], self.module0.id)
+        self.assertEqual(c.find_number('1.1')['id'], self.exercise0.id)
+        with self.assertRaises(NoSuchContent):
+            c.find_number('1.9')
+        self.assertEqual(c.get_absolute_order_number(self.exercise0.id), 1)
+        self.assertEqual(c.get_absolute_order_number(self.exercise.id), 2)
+        self.assertEqual(c.get_absolute_order_number(self.exercise3.id), 4)
+        self.assertEqual(
+            [e['id'] for e in c.search_exercises(category_id=self.category.id)],
+            [self.exercise0.id, self.exercise.id, self.exercise2.id, self.exercise3.id],
+        )
+        self.assertEqual(
+            [e['id'] for e in c.search_exercises(module_id=self.module.id, category_id=self.category.id)],
+            [self.exercise.id, self.exercise2.id],
+        )
+        self.assertEqual(c.search_exercises(category_id=self.category.id + 1), [])
 
     def test_deep(self):
         self.subexercise = StaticExercise.objects.create(
@@ -114,9 +145,33 @@ class CachedContentTest(CourseTestCase):
             order=1,
         )
         c = CachedContent(self.instance)
-        _exercise, _tree, _prev, nex = c.find(self.subexercise)
+        exercise, _tree, _prev, nex = c.find(self.subexercise)
         self.assertEqual(nex['type'], 'module')
         self.assertEqual(nex['id'], self.module2.id)
+        subexercise = StaticExercise.objects.get(id=self.subexercise.id)
+        self.assertEqual(exercise['number'], '{:d}.{}'.format(self.module.order, subexercise.number()))
+        self.assertEqual(exercise['get_path'], 'e2/s1')
+        self.assertEqual(exercise['get_path'], subexercise.get_path())
+        self.assertEqual(exercise['hierarchical_name'], subexercise.hierarchical_name())
+        self.assertEqual(exercise['link'], subexercise.get_display_url())
+        self.assertEqual(c.find_path(self.module.id, 'e2/s1'), self.subexercise.id)
+
+    @override_settings(CACHE_WARM_UP_DELAY=10)
+    def test_warm_up_queued(self):
+        cache.delete('content-warm-up:%d' % self.instance.id)
+        with patch('exercise.tasks.warm_up_course.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.exercise0.save()
+                self.module0.save()
+        # The changes are handled by one task.
+        apply_async.assert_called_once_with((self.instance.id,), countdown=10)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_content_cache', '12', '--modules', '2', '--repeat', '1', stdout=out)
+        self.assertTrue(out.getvalue().startswith("12 learning objects: "))
+        # The synthetic course is rolled back.
+        self.assertFalse(CourseInstance.objects.filter(url="benchmark").exists())
 
 
 class CachedPointsTest(CourseTestCase):
@@ -180,6 +235,175 @@ class CachedPointsTest(CourseTestCase):
         module = p.modules()[1]
         self.assertTrue(module['passed'])
 
+    def test_incremental_update(self):
+        c = CachedContent(self.instance)
+        for is_staff in (True, False):
+            p = CachedPoints(self.instance, self.student, c, is_staff)
+            created = p.created()
+            self.submission2.set_points(2,2)
+            self.submission2.set_ready()
+            self.submission2.save()
+            self.submission3.set_points(1,2)
+            self.submission3.set_ready()
+            self.submission3.save()
+            # The saved submissions are applied without regenerating the data.
+            with patch.object(CachedPoints, '_generate_data', side_effect=AssertionError):
+                updated = CachedPoints(self.instance, self.student, c, is_staff)
+            self.assertNotEqual(updated.created(), created)
+            CachedPoints.invalidate(self.instance, self.student)
+            regenerated = CachedPoints(self.instance, self.student, c, is_staff)
+            self.assertEqual(updated.modules(), regenerated.modules())
+            self.assertEqual(updated.categories(), regenerated.categories())
+            self.assertEqual(updated.total(), regenerated.total())
+
+    def test_notifications_update(self):
+        c = CachedContent(self.instance)
+        CachedPoints(self.instance, self.student, c)
+        Notification.send_many([self.submission, self.submission3], self.teacher.userprofile)
+        # The notified exercises are queued as a single incremental update.
+        with patch.object(CachedPoints, '_generate_data', side_effect=AssertionError):
+            p = CachedPoints(self.instance, self.student, c)
+        for exercise in (self.exercise, self.exercise2):
+            entry, _, _, _ = p.find(exercise)
+            self.assertTrue(entry['notified'])
+            self.assertTrue(entry['unseen'])
+        Notification.remove_many([self.submission3])
+        with patch.object(CachedPoints, '_generate_data', side_effect=AssertionError):
+            p = CachedPoints(self.instance, self.student, c)
+        entry, _, _, _ = p.find(self.exercise2)
+        self.assertFalse(entry.get('notified', False))
+
+    def test_full_update(self):
+        c = CachedContent(self.instance)
+        CachedPoints(self.instance, self.student, c)
+        self.submission2.set_points(2,2)
+        self.submission2.set_ready()
+        self.submission2.save()
+        # A queued full update, e.g. from a racing invalidation, regenerates the data.
+        CachedPoints.queue_update(self.instance, self.student, FULL_UPDATE)
+        generate = CachedPoints._generate_data
+        with patch.object(CachedPoints, '_generate_data', autospec=True, side_effect=generate) as mock:
+            p = CachedPoints(self.instance, self.student, c)
+        self.assertTrue(mock.called)
+        entry, _, _, _ = p.find(self.exercise)
+        self.assertEqual(entry['points'], 100)
+
+    def test_generation_queries(self):
+        c = CachedContent(self.instance)
+
+        def count_queries():
+            CachedPoints.invalidate(self.instance, self.student)
+            with CaptureQueriesContext(connection) as context:
+                p = CachedPoints(self.instance, self.student, c)
+            return p, len(context.captured_queries)
+
+        _, queries = count_queries()
+        for exercise in (self.exercise, self.exercise2, self.exercise3):
+            for _ in range(5):
+                submission = Submission.objects.create(exercise=exercise)
+                submission.submitters.add(self.student.userprofile)
+                submission.set_points(1,2)
+                submission.set_ready()
+                submission.save()
+                Notification.send(self.teacher.userprofile, submission)
+        Notification.objects.filter(submission__exercise=self.exercise2).update(seen=True)
+        p, more_queries = count_queries()
+        self.assertEqual(more_queries, queries)
+        entry, _, _, _ = p.find(self.exercise)
+        self.assertTrue(entry['notified'])
+        self.assertTrue(entry['unseen'])
+        entry, _, _, _ = p.find(self.exercise2)
+        self.assertTrue(entry['notified'])
+        self.assertFalse(entry.get('unseen', False))
+        entry, _, _, _ = p.find(self.exercise0)
+        self.assertFalse(entry.get('notified', False))
+
+    def test_build_many(self):
+        DeadlineRuleDeviation.objects.create(
+            exercise=self.exercise2,
+            submitter=self.user.userprofile,
+            granter=self.teacher.userprofile,
+            extra_minutes=60,
+        )
+        self.submission3.set_points(1,2)
+        self.submission3.set_ready()
+        self.submission3.save()
+        c = CachedContent(self.instance)
+        users = [self.student, self.user, self.teacher]
+        for is_staff in (True, False):
+            for user in users:
+                CachedPoints.invalidate(self.instance, user)
+            many = CachedPoints.build_many(self.instance, users, c, is_staff)
+            # The generated data is cached.
+            with self.assertNumQueries(0):
+                cached = CachedPoints.build_many(self.instance, users, c, is_staff)
+            for user in users:
+                self.assertEqual(cached[user.id].created(), many[user.id].created())
+                CachedPoints.invalidate(self.instance, user)
+                single = CachedPoints(self.instance, user, c, is_staff)
+                self.assertEqual(many[user.id].modules(), single.modules())
+                self.assertEqual(many[user.id].categories(), single.categories())
+                self.assertEqual(many[user.id].total(), single.total())
+        # The deviation of a group member applies to the student too.
+        entry, _, _, _ = many[self.student.id].find(self.exercise2)
+        self.assertIsNotNone(entry['personal_deadline'])
+
+    def test_build_many_queries(self):
+        c = CachedContent(self.instance)
+        users = [self.student, self.user, self.teacher]
+
+        def count_queries():
+            for user in users:
+                CachedPoints.invalidate(self.instance, user)
+            with CaptureQueriesContext(connection) as context:
+                CachedPoints.build_many(self.instance, users, c)
+            return len(context.captured_queries)
+
+        count_queries()
+        queries = count_queries()
+        for exercise in (self.exercise, self.exercise2, self.exercise3):
+            for _ in range(5):
+                submission = Submission.objects.create(exercise=exercise)
+                submission.submitters.add(self.student.userprofile, self.user.userprofile)
+                submission.set_points(1,2)
+                submission.set_ready()
+                submission.save()
+        # The number of queries does not grow with the number of submissions.
+        self.assertEqual(count_queries(), queries)
+
+    def test_student_overlay(self):
+        self.exercise2.submission_feedback_reveal_rule = RevealRule.objects.create(
+            trigger=RevealRule.TRIGGER.MANUAL,
+        )
+        self.exercise2.save()
+        self.submission3.set_points(1,2)
+        self.submission3.set_ready()
+        self.submission3.save()
+        c = CachedContent(self.instance)
+        staff = CachedPoints(self.instance, self.student, c, True)
+        student = CachedPoints(self.instance, self.student, c)
+        staff_entry, _, _, _ = staff.find(self.exercise2)
+        student_entry, _, _, _ = student.find(self.exercise2)
+        self.assertEqual(staff_entry['points'], 50)
+        self.assertTrue(staff_entry['feedback_revealed'])
+        self.assertEqual(student_entry['points'], 0)
+        self.assertFalse(student_entry['feedback_revealed'])
+        # Only the entries that differ are stored for the student.
+        overlay = staff.data['student_overlay']
+        self.assertEqual(list(overlay['exercises']), [self.exercise2.id])
+        self.assertEqual(list(overlay['modules']), [self.module.id])
+        self.assertEqual(student.find(self.module0)[0], staff.find(self.module0)[0])
+
+    def test_warm_up(self):
+        c = CachedContent(self.instance)
+        for user in (self.student, self.user, self.teacher):
+            CachedPoints.invalidate(self.instance, user)
+        # Only the student and the user have submitted.
+        self.assertEqual(warm_up_cache(self.instance, 7), 2)
+        with patch.object(CachedPoints, '_generate_data', side_effect=AssertionError):
+            CachedPoints(self.instance, self.student, c)
+            CachedPoints(self.instance, self.user, c)
+
     def test_unconfirmed(self):
         self.category2 = LearningObjectCategory.objects.create(
             course_instance=self.instance,
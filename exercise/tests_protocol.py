@@ -0,0 +1,137 @@
+import os
+import re
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase, override_settings
+from requests.models import Response
+
+from lib.remote_page import RemotePage
+from .protocol.aplus import parse_page_content
+from .protocol.exercise_page import ExercisePage, build_form_template
+
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'protocol', 'test_pages')
+
+# The pages, their URLs and the form values populated into them
+PAGES = {
+    'chapter': (
+        'http://grader.localhost/static/prog1/m01/ch2.html',
+        [{}],
+    ),
+    'exercise': (
+        'http://grader.localhost/prog1/quiz/',
+        [
+            {
+                'field_values': {
+                    'name': ['Alice'],
+                    'color': ['blue'],
+                    'langs': ['python', 'c'],
+                    'level': ['2', '3'],
+                    'answer': ['My <answer> & more'],
+                },
+                'data_values': {'draft-timestamp': '1690000000000'},
+            },
+            {
+                'field_values': {'name': ['Bob']},
+                'allow_submit': False,
+                'feedback_revealed': False,
+            },
+        ],
+    ),
+    'feedback': (
+        'http://grader.localhost/prog1/exercise1/',
+        [{}],
+    ),
+}
+
+
+def process_page(name):
+    """
+    Parses the test page like the exercise protocol does and returns the
+    results as named sections of text.
+    """
+    url, populate_args = PAGES[name]
+    with open(os.path.join(PAGES_DIR, name + '.html'), 'rb') as f:
+        response = Response()
+        response._content = f.read() # pylint: disable=protected-access
+    response.status_code = 200
+    response.headers['Last-Modified'] = 'Mon, 10 Jul 2023 10:00:00 GMT'
+
+    children = [
+        Mock(order=i, get_absolute_url=Mock(return_value='/prog1/2023/m01/ch2/e{:d}/'.format(i)))
+        for i in range(1, 3)
+    ]
+    exercise = Mock(max_points=0, description='', children=Mock(all=Mock(return_value=children)))
+    exercise.name = name
+    page = ExercisePage(exercise)
+    with patch('lib.remote_page.request_for_response', return_value=response):
+        parse_page_content(page, RemotePage(url), exercise)
+
+    sections = {
+        'meta': '\n'.join([
+            'title: {}'.format(page.meta['title']),
+            'description: {}'.format(page.meta['description']),
+            'points: {} / {}'.format(page.points, page.max_points),
+            'flags: {}'.format(' '.join(
+                flag for flag in ('is_graded', 'is_accepted', 'is_rejected', 'is_wait')
+                if getattr(page, flag)
+            )),
+            'last_modified: {}'.format(page.last_modified),
+        ]),
+        'head': page.head,
+        'content': page.content,
+        'clean_content': page.clean_content,
+    }
+    content = page.content
+    for i, kwargs in enumerate(populate_args):
+        page.content = content
+        page.populate_form(**kwargs)
+        sections['populated_{:d}'.format(i)] = page.content
+    return sections
+
+
+def read_expected(name):
+    with open(os.path.join(PAGES_DIR, name + '.expected.html'), encoding='utf-8') as f:
+        parts = re.split(r'^<!-- section: (\w+) -->\n', f.read(), flags=re.MULTILINE)
+    return {key: value[:-1] for key, value in zip(parts[1::2], parts[2::2])}
+
+
+def write_expected(name):
+    """
+    Writes the golden file of the test page. Run this from `manage.py shell`
+    only when the expected output is meant to change, and review the diff.
+    """
+    with override_settings(GITMANAGER_URL='', REMOTE_PAGE_HOSTS_MAP={}):
+        sections = process_page(name)
+    with open(os.path.join(PAGES_DIR, name + '.expected.html'), 'w', encoding='utf-8') as f:
+        for key, value in sections.items():
+            f.write('<!-- section: {} -->\n{}\n'.format(key, value))
+
+
+@override_settings(GITMANAGER_URL='', REMOTE_PAGE_HOSTS_MAP={})
+class ExercisePageTest(SimpleTestCase):
+    """
+    Compares the processed exercise service pages to the golden files.
+    """
+    maxDiff = None
+
+    def test_pages(self):
+        for name in PAGES:
+            with self.subTest(page=name):
+                sections = process_page(name)
+                expected = read_expected(name)
+                self.assertEqual(list(sections.keys()), list(expected.keys()))
+                for key, value in expected.items():
+                    self.assertEqual(sections[key], value, key)
+
+    def test_form_template_loader(self):
+        expected = read_expected('exercise')
+        loader = Mock(return_value=build_form_template(expected['content']))
+        page = ExercisePage(Mock(max_points=0, description=''))
+        page.form_template_loader = loader
+        for i, kwargs in enumerate(PAGES['exercise'][1]):
+            page.content = expected['content']
+            page.populate_form(**kwargs)
+            self.assertEqual(page.content, expected['populated_{:d}'.format(i)])
+        # The cached form template is loaded once.
+        loader.assert_called_once_with()
@@ -0,0 +1,135 @@
+import re
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from aplus.celery import retry_submissions
+from lib.testdata import CourseTestCase
+from .cache.content import CachedContent
+from .cache.points import CachedPoints
+from .models import Submission
+from .submission_models import PendingSubmission
+
+
+# The tables, which grow large in production, must not be scanned through.
+LARGE_TABLES = {
+    Submission._meta.db_table,
+    Submission.submitters.through._meta.db_table,
+    PendingSubmission._meta.db_table,
+}
+
+
+class QueryPlanTest(CourseTestCase):
+    """
+    Runs EXPLAIN for the queries of the hot code paths and fails, if the
+    database would scan a large table sequentially. The plans of SQLite do not
+    depend on the size of the tables, as the tables are not analyzed. In
+    PostgreSQL, sequential scans are disabled for the plans, so that a scan
+    is planned only if there is no usable index.
+    """
+
+    def setUp(self):
+        super().setUp()
+        profiles = [
+            User.objects.create(username='seeded{:d}'.format(i)).userprofile
+            for i in range(20)
+        ]
+        submissions = Submission.objects.bulk_create(
+            Submission(
+                exercise=exercise,
+                status=Submission.STATUS.READY,
+                grade=i % 10,
+            )
+            for exercise in (self.exercise, self.exercise2, self.exercise0)
+            for i in range(100)
+        )
+        Through = Submission.submitters.through
+        Through.objects.bulk_create(
+            Through(submission_id=submission.id, userprofile_id=profiles[i % len(profiles)].id)
+            for i, submission in enumerate(submissions)
+        )
+        PendingSubmission.objects.bulk_create(
+            PendingSubmission(submission=submission, submission_time=timezone.now())
+            for submission in submissions[::10]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher)
+
+    def sequential_scans(self, sql):
+        if connection.vendor == 'sqlite':
+            # SQLite reports the aliases of the tables, e.g. "U0".
+            aliases = {alias: table for table, alias in re.findall(r'"(\w+)" ([A-Z]\d+)\b', sql)}
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [(line, re.match(r'SCAN (\w+)', line)) for line in plan]
+            return [
+                line for line, match in scans
+                if match and aliases.get(match.group(1), match.group(1)) in LARGE_TABLES
+            ]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                plan = [row[0] for row in cursor.fetchall()]
+            scans = [(line, re.search(r'Seq Scan on (\w+)', line)) for line in plan]
+            return [line for line, match in scans if match and match.group(1) in LARGE_TABLES]
+        self.skipTest("Query plans are not checked on {}".format(connection.vendor))
+        return []
+
+    def assertNoSequentialScans(self, queries):
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(table in sql for table in LARGE_TABLES):
+                continue
+            checked += 1
+            scans = self.sequential_scans(sql)
+            self.assertFalse(scans, "Sequential scan in query:\n{}\n{}".format(sql, '\n'.join(scans)))
+        self.assertGreater(checked, 0)
+
+    def test_cached_points(self):
+        cache.clear()
+        content = CachedContent(self.instance)
+        with CaptureQueriesContext(connection) as queries:
+            CachedPoints.build_many(self.instance, [self.student, self.user], content)
+        self.assertNoSequentialScans(queries)
+
+        self.submission2.set_points(2, 2)
+        self.submission2.set_ready()
+        self.submission2.save()
+        with CaptureQueriesContext(connection) as queries:
+            CachedPoints(self.instance, self.student, content)
+        self.assertNoSequentialScans(queries)
+
+    def test_results_data(self):
+        url = '/api/v2/courses/{:d}/resultsdata/'.format(self.instance.id)
+        for params in ({'format': 'csv'}, {'format': 'csv', 'show_unofficial': 'true'}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNoSequentialScans(queries)
+
+    def test_statistics(self):
+        params = {
+            'starttime': (timezone.now() - timedelta(days=7)).isoformat(),
+            'endtime': timezone.now().isoformat(),
+        }
+        for url in (
+                '/api/v2/statistics/',
+                '/api/v2/courses/{:d}/statistics/'.format(self.instance.id),
+                '/api/v2/exercises/{:d}/statistics/'.format(self.exercise.id)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNoSequentialScans(queries)
+
+    def test_retry_submissions(self):
+        with CaptureQueriesContext(connection) as queries:
+            retry_submissions()
+        self.assertNoSequentialScans(queries)
@@ -1,5 +1,6 @@
 from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+from django.conf import settings
 from django.contrib import messages
 from django.http.request import HttpRequest
 from django.http.response import Http404, HttpResponse, HttpResponseNotFound
@@ -171,9 +172,18 @@ class ExerciseView(BaseRedirectMixin, ExerciseBaseView, EnrollableViewMixin):
                 # Deactivate the current draft if it exists.
                 self.exercise.unset_submission_draft(self.profile)
 
-                page = self.exercise.grade(new_submission,
-                    request,
-                    url_name=self.post_url_name)
+                if (
+                    settings.ASYNC_GRADING
+                    and self.exercise.can_grade_asynchronously
+                    and not new_submission.lti_launch_id
+                ):
+                    page = self.exercise.queue_grading(new_submission,
+                        request.user,
+                        url_name=self.post_url_name)
+                else:
+                    page = self.exercise.grade(new_submission,
+                        request,
+                        url_name=self.post_url_name)
                 for error in page.errors:
                     messages.error(request, error)
 
@@ -1,12 +1,105 @@
+from collections import defaultdict
+from itertools import islice
+import copy
+
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.query import ModelIterable
+
+from model_utils.managers import InheritanceIterable, InheritanceQuerySet, InheritanceManager
+
+
+class ContentTypeIterable(ModelIterable):
+    """
+    Yields the objects as instances of their leaf classes. The rows of the
+    base table are read first, and the columns of the subclass tables are
+    then read with one query per subclass present in the rows, instead of
+    joining every subclass table to the base query.
+    """
+    batch_size = 1000
+
+    def __iter__(self):
+        rows = super().__iter__()
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield from self._as_leaf_classes(batch)
+
+    def _as_leaf_classes(self, objects):
+        base_model = self.queryset.model
+        by_type = defaultdict(list)
+        for obj in objects:
+            if obj.content_type_id is not None:
+                by_type[obj.content_type_id].append(obj)
+
+        base_fields = {f.attname for f in base_model._meta.concrete_fields}
+        content_types = ContentType.objects.db_manager(self.queryset.db)
+        leaves = {}
+        for content_type_id, group in by_type.items():
+            model_class = content_types.get_for_id(content_type_id).model_class()
+            if model_class is None or model_class is base_model or not issubclass(model_class, base_model):
+                continue
+            attnames = [f.attname for f in model_class._meta.concrete_fields if f.attname not in base_fields]
+            values = {
+                row[0]: row[1:]
+                for row in model_class._base_manager.using(self.queryset.db)
+                    .filter(pk__in=[obj.pk for obj in group])
+                    .values_list('pk', *attnames)
+            }
+            for obj in group:
+                if obj.pk not in values:
+                    continue
+                leaf = model_class.__new__(model_class)
+                leaf.__dict__.update(obj.__dict__)
+                # Copies the cache of the related objects too
+                leaf._state = copy.copy(obj._state)
+                leaf.__dict__.update(zip(attnames, values[obj.pk]))
+                leaves[obj.pk] = leaf
+
+        return [leaves.get(obj.pk, obj) for obj in objects]
 
-from model_utils.managers import InheritanceManager
+
+class ModelWithInheritanceQuerySet(InheritanceQuerySet):
+    def dispatch_subclasses(self):
+        """
+        Returns the objects as instances of their leaf classes by reading
+        the subclass tables separately for each present content type.
+        See `ContentTypeIterable`.
+        """
+        qs = self._chain()
+        qs.subclasses = []
+        qs._iterable_class = ContentTypeIterable
+        return qs
+
+    def select_subclasses(self, *subclasses):
+        """
+        Returns the objects as instances of their leaf classes by joining
+        the subclass tables to the query. See `InheritanceQuerySet`.
+        """
+        qs = super().select_subclasses(*subclasses)
+        qs._iterable_class = InheritanceIterable
+        return qs
+
+    def without_subclasses(self):
+        """Returns the objects as instances of the model of the queryset."""
+        qs = self._chain()
+        qs.subclasses = []
+        qs._iterable_class = ModelIterable
+        return qs
 
 
 class ModelWithInheritanceManager(InheritanceManager):
+    _queryset_class = ModelWithInheritanceQuerySet
+
     def get_queryset(self):
-        return super().get_queryset().select_related('content_type').select_subclasses()
+        return super().get_queryset().select_related('content_type').dispatch_subclasses()
+
+    def dispatch_subclasses(self):
+        return self.get_queryset().dispatch_subclasses()
+
+    def without_subclasses(self):
+        return self.get_queryset().without_subclasses()
 
 
 class ModelWithInheritance(models.Model):
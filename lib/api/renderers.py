@@ -1,4 +1,9 @@
+import csv
+from typing import Any, Dict, Iterable, Iterator, List
+
 from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.request import Request
 from rest_framework_csv.renderers import CSVRenderer
 
 def remove_newlines(x):
@@ -25,3 +30,40 @@ class CSVExcelRenderer(CSVRenderer):
                 renderer_context.update(new_writer_opts)
         response = super().render(data, media_type, renderer_context, writer_opts)
         return '\uFEFF'.encode('UTF-8') + response
+
+
+class _Echo:
+    "File-like object, which returns the written value"
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(
+        request: Request,
+        rows: Iterable[Dict[str, Any]],
+        header: List[str],
+        filename: str,
+        ) -> StreamingHttpResponse:
+    """
+    Returns a response, which writes the rows as CSV while they are
+    iterated, in the format of the accepted CSV renderer. The header must
+    be known up front, and the values of other keys are left out.
+    """
+    excel = isinstance(request.accepted_renderer, CSVExcelRenderer)
+    delimiter = ','
+    if excel:
+        delimiter = request.GET.get('sep', settings.EXCEL_CSV_DEFAULT_DELIMITER)
+
+    def generate() -> Iterator[str]:
+        writer = csv.DictWriter(_Echo(), header, extrasaction='ignore', delimiter=delimiter)
+        if excel:
+            yield '\uFEFF'
+        yield writer.writeheader()
+        for row in rows:
+            if excel:
+                row = {k: remove_newlines(v) for k, v in row.items()}
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(generate(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
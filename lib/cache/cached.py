@@ -1,14 +1,80 @@
 from datetime import datetime
 from django.core.cache import cache
-from time import time
+from django.db import connections
+from time import sleep, time
+import inspect
 import logging
+import pickle
+import threading
+
+from . import registry
+from .compression import compress, decompress
+from .local import local_cache
 
 
 logger = logging.getLogger('aplus.cached')
 
 
-class CachedAbstract:
+class CachedMeta(type):
+    """
+    Shares the instances constructed with equal arguments during a request.
+    See `lib.cache.registry`.
+    """
+    def __call__(cls, *args, **kwargs):
+        try:
+            if '_init_signature' not in cls.__dict__:
+                cls._init_signature = inspect.signature(cls.__init__)
+            bound = cls._init_signature.bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            key = (cls, tuple(
+                tuple(value) if isinstance(value, list) else value
+                for value in list(bound.arguments.values())[1:]
+            ))
+            hash(key)
+        except TypeError:
+            # Unhashable arguments, the instance can not be shared
+            return super().__call__(*args, **kwargs)
+        return registry.memoize(key, lambda: super(CachedMeta, cls).__call__(*args, **kwargs))
+
+
+class CachedAbstract(metaclass=CachedMeta):
     KEY_PREFIX = 'abstract'
+    # Version of the format of the cached data. Increase it when the format
+    # changes, so that the data cached by an older version is regenerated.
+    SCHEMA_VERSION = 1
+    # Store the data pickled and compressed. Large nested structures, like
+    # the course content tree, compress to a fraction of their size.
+    COMPRESS = False
+    # Only one process at a time generates the data. It holds a lease,
+    # which expires after LEASE_TIMEOUT seconds in case the process dies.
+    # Other processes use the previous (stale) data meanwhile, if there is
+    # any, or wait at most WAIT_TIMEOUT seconds for the new data.
+    LEASE_TIMEOUT = 60
+    WAIT_TIMEOUT = 5
+    WAIT_INTERVAL = 0.05
+
+    @classmethod
+    def _dump(cls, data):
+        if cls.COMPRESS:
+            data = compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        return (cls.SCHEMA_VERSION, data)
+
+    @classmethod
+    def _load(cls, value):
+        """
+        Returns the data stored by _dump, or None if it was stored
+        in another format.
+        """
+        if not isinstance(value, tuple) or len(value) != 2 or value[0] != cls.SCHEMA_VERSION:
+            return None
+        data = value[1]
+        if cls.COMPRESS:
+            try:
+                data = pickle.loads(decompress(data))
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Failed to decode cached data of %s", cls.__name__)
+                return None
+        return data
 
     @classmethod
     def _key(cls, *models, modifiers):
@@ -17,6 +83,71 @@ class CachedAbstract:
         keys.extend(modifiers)
         return "%s:%s" % (cls.KEY_PREFIX, ','.join(keys))
 
+    @classmethod
+    def _version_key(cls, cache_key):
+        return "%s:version" % cache_key
+
+    @classmethod
+    def _lease_key(cls, cache_key):
+        return "%s:lease" % cache_key
+
+    @classmethod
+    def _fetch(cls, cache_key):
+        """
+        Returns the raw cached value. When the local memory cache is enabled,
+        the value is read from it, if the small version key in the shared
+        cache shows that it is still current.
+        """
+        if not local_cache.enabled:
+            return cache.get(cache_key)
+        version = cache.get(cls._version_key(cache_key))
+        if version is not None:
+            raw = local_cache.get(cache_key, version)
+            if raw is not None:
+                return raw
+        raw = cache.get(cache_key)
+        if isinstance(raw, tuple) and len(raw) == 2 and raw[0] is not None and raw[0] == version:
+            local_cache.set(cache_key, version, raw)
+        return raw
+
+    @classmethod
+    def _store(cls, cache_key, updated, data, add=False):
+        """
+        Stores the data, which was generated or updated at time `updated`.
+        With `add`, the data is stored only if the key is not in the cache.
+        Returns False, if the data was not stored.
+        """
+        value = (updated, cls._dump(data))
+        if local_cache.enabled:
+            # The version is set before the data, so that a concurrent
+            # invalidation, which deletes the version, can not be missed.
+            cache.set(cls._version_key(cache_key), updated, None)
+        if add:
+            if not cache.add(cache_key, value, None):
+                return False
+        else:
+            cache.set(cache_key, value, None)
+        if local_cache.enabled:
+            local_cache.set(cache_key, updated, value)
+        return True
+
+    @classmethod
+    def _store_many(cls, values):
+        """Stores many `(updated, data)` values keyed by the cache keys at once."""
+        values = {
+            cache_key: (updated, cls._dump(data))
+            for cache_key, (updated, data) in values.items()
+        }
+        if local_cache.enabled:
+            cache.set_many({
+                cls._version_key(cache_key): value[0]
+                for cache_key, value in values.items()
+            }, None)
+        cache.set_many(values, None)
+        if local_cache.enabled:
+            for cache_key, value in values.items():
+                local_cache.set(cache_key, value[0], value)
+
     @classmethod
     def invalidate(cls, *models, modifiers=[]): # pylint: disable=dangerous-default-value
         cache_key = cls._key(*models, modifiers=modifiers)
@@ -25,11 +156,25 @@ class CachedAbstract:
         # The invalidation time is stored in the data field for debug messages
         # Keep this value in the cache for an hour, so it will be removed from
         # the memory at some point, but not before all generations have finished.
-        cache.set(cache_key, (None, time()), 60*60)
+        # The previous data is kept as the third field, so that it can be
+        # served while the new data is generated.
+        raw = cache.get(cache_key)
+        if isinstance(raw, tuple) and len(raw) == 2 and raw[0] is not None:
+            cache.set(cache_key, (None, time(), raw[1]), 60*60)
+        elif isinstance(raw, tuple) and len(raw) == 3:
+            # Already invalidated, the stale data is still the latest data
+            cache.set(cache_key, (None, time(), raw[2]), 60*60)
+        else:
+            cache.set(cache_key, (None, time()), 60*60)
+        registry.clear()
+        if local_cache.enabled:
+            # Other processes stop using their local copies of the data.
+            cache.delete(cls._version_key(cache_key))
 
     def __init__(self, *models, modifiers=[]): # pylint: disable=dangerous-default-value
         self.__models = models
         self.__cache_key = self.__class__._key(*models, modifiers=modifiers)
+        registry.note_construction("%s[%s]" % (self.__class__.__name__, self.__cache_key))
         self.data = self.__get_data()
 
     def __get_data(self):
@@ -37,23 +182,122 @@ class CachedAbstract:
         cache_name = "%s[%s]" % (self.__class__.__name__, cache_key)
 
         # Retrieve currently cached data
-        raw = cache.get(cache_key)
-        updated, data = raw if isinstance(raw, tuple) and len(raw) == 2 else (None, None)
+        raw = self._fetch(cache_key)
+        updated, data = raw[:2] if isinstance(raw, tuple) and len(raw) in (2, 3) else (None, None)
 
         # Cache is invalidated, if updated is None
         if updated is None:
             data = None
+            # The data before the invalidation
+            stale = raw[2] if isinstance(raw, tuple) and len(raw) == 3 else None
+        else:
+            data = self._load(data)
+            stale = None
 
         # Use the cached data, if it doesn't require regeneration
         # TODO: updated should be passed to _needs_generation
         if not self._needs_generation(data):
+            if not self._needs_update(data):
+                return data
+            # Try to bring the data up to date without a full regeneration
+            self.dirty = False
+            update_start = time()
+            logger.debug("Updating cached data for %s", cache_name)
+            updated_data = self._update_data(*self.__models, data=data)
+            if updated_data is not None:
+                # NOTE: without check-and-set (CAS), this may overwrite an
+                # invalidation made during the update. Subclasses must
+                # record invalidations in a way that _needs_update sees them.
+                self._store(cache_key, update_start, updated_data)
+                return updated_data
+            logger.debug("Cached data for %s can not be updated, regenerating", cache_name)
+
+        # Generate the data in only one process at a time
+        lease_key = self._lease_key(cache_key)
+        leased = cache.add(lease_key, time(), self.LEASE_TIMEOUT)
+        if not leased:
+            if data is None and stale is not None:
+                data = self._load(stale)
+            if data is not None:
+                logger.debug("Data for %s is being generated, using the stale data", cache_name)
+                return data
+            logger.debug("Data for %s is being generated, waiting for it", cache_name)
+            new_data = self.__wait_for_data(cache_key, lease_key)
+            if new_data is not None:
+                return new_data
+            logger.debug("Waiting for data for %s timed out, generating it", cache_name)
+        elif data is not None and self._use_stale(data):
+            logger.debug("Data for %s is stale, regenerating it in the background", cache_name)
+            self._run_in_background(self.__regenerate, cache_key, cache_name, raw, data, lease_key)
             return data
 
-        # If the cache contains invalid value, clear it
-        if raw is not None:
-            cache.delete(cache_key)
+        try:
+            return self.__generate_data(cache_key, cache_name, raw, data)
+        finally:
+            if leased:
+                cache.delete(lease_key)
+
+    def __wait_for_data(self, cache_key, lease_key):
+        """
+        Waits for another process to generate the data. Returns the stale
+        data of an invalidated value, if the data did not appear in time,
+        and None, if there is no stale data either.
+        """
+        stale = None
+        deadline = time() + self.WAIT_TIMEOUT
+        while time() < deadline:
+            sleep(self.WAIT_INTERVAL)
+            raw = cache.get(cache_key)
+            if isinstance(raw, tuple) and len(raw) == 2 and raw[0] is not None:
+                data = self._load(raw[1])
+                if not self._needs_generation(data):
+                    return data
+            elif isinstance(raw, tuple) and len(raw) == 3:
+                stale = raw[2]
+            if cache.get(lease_key) is None:
+                # The other process finished without storing the data
+                break
+        return self._load(stale) if stale is not None else None
+
+    def __regenerate(self, cache_key, cache_name, raw, data, lease_key): # pylint: disable=too-many-arguments
+        """
+        Generates the data, while the stale data is still served from the
+        cache, and releases the lease.
+        """
+        try:
+            self.dirty = False
+            gen_start = time()
+            logger.debug("Regenerating stale data for %s", cache_name)
+            new_data = self._generate_data(*self.__models, data=data)
+            # The data is not stored, if it was invalidated or updated meanwhile.
+            # NOTE: without check-and-set (CAS), an invalidation between
+            # the get and the set may be overwritten.
+            current = cache.get(cache_key)
+            if isinstance(current, tuple) and current[:1] == raw[:1]:
+                self._store(cache_key, gen_start, new_data)
+        except Exception: # pylint: disable=broad-except
+            logger.exception("Failed to regenerate stale data for %s", cache_name)
+        finally:
+            cache.delete(lease_key)
 
-        # Generate a new data
+    @staticmethod
+    def _is_same_value(current, raw):
+        """
+        Returns True, if the raw cached value has not been replaced since
+        it was read. The values are identified by their update time, and
+        the invalidated values by their invalidation time.
+        """
+        if isinstance(raw, tuple) and len(raw) in (2, 3):
+            if not isinstance(current, tuple) or len(current) not in (2, 3):
+                return False
+            if raw[0] is None:
+                return current[:2] == raw[:2]
+            return current[0] == raw[0]
+        return current == raw
+
+    def __generate_data(self, cache_key, cache_name, raw, data):
+        # Generate a new data. The invalid value is kept in the cache
+        # meanwhile, so that the other processes can use its stale data.
         self.dirty = False
         gen_start = time()
         gen_start_dt = str(datetime.fromtimestamp(gen_start))
@@ -61,9 +305,18 @@ class CachedAbstract:
         data = self._generate_data(*self.__models, data=data)
 
         # If another process invalidated the cache or generated a newer
-        # value for it during the generation time, then cache.add()
-        # returns False and keeps the current value in the cache
-        cache_updated = cache.add(cache_key, (gen_start, data), None)
+        # value for it during the generation time, then the value differs
+        # from the one read before the generation and it is not replaced.
+        current = raw if raw is None else cache.get(cache_key)
+        if current is None:
+            # cache.add() keeps a value stored meanwhile by another process
+            cache_updated = self._store(cache_key, gen_start, data, add=True)
+        elif self._is_same_value(current, raw):
+            # NOTE: without check-and-set (CAS), an invalidation between
+            # the get and this set may be overwritten.
+            cache_updated = self._store(cache_key, gen_start, data)
+        else:
+            cache_updated = False
         if cache_updated:
             logger.debug("Set newly generated data for %s with ts %s", cache_name, gen_start_dt)
             # The generated value should be in the cache now
@@ -78,7 +331,10 @@ class CachedAbstract:
             return data
 
         # Someone invalidated or updated the value in the cache before we completed
-        curr_updated, curr_data = current if isinstance(current, tuple) and len(current) == 2 else (None, None)
+        if isinstance(current, tuple) and len(current) in (2, 3):
+            curr_updated, curr_data = current[:2]
+        else:
+            curr_updated, curr_data = None, None
         if curr_updated is None:
             # Update time is None, so data was invalidated.
             # New value is not stored in the cache, but returned
@@ -107,7 +363,9 @@ class CachedAbstract:
                 curr_dt,
                 gen_start_dt
             )
-            data = curr_data
+            curr_data = self._load(curr_data)
+            if curr_data is not None:
+                data = curr_data
         else:
             # We have newer value, so force the cache to this new value
             try:
@@ -123,7 +381,7 @@ class CachedAbstract:
                 curr_dt,
                 gen_start_dt
             )
-            cache.set(cache_key, (gen_start, data), None)
+            self._store(cache_key, gen_start, data)
             # NOTE: there is a chance that the cache was invalidated between
             # get and this set. To fix that, we would require operation
             # check-and-set (CAS), which is not supported by Django
@@ -132,5 +390,39 @@ class CachedAbstract:
     def _needs_generation(self, data):
         return data is None
 
+    def _use_stale(self, data): # pylint: disable=unused-argument
+        """
+        Returns True, if the data, which needs generation, may still be used
+        while the new data is generated in the background.
+        """
+        return False
+
+    def _run_in_background(self, func, *args):
+        """
+        Runs func(*args) after the stale data has been returned. The default
+        runs it in a thread of this process.
+        """
+        def run():
+            try:
+                func(*args)
+            finally:
+                # The thread has its own database connection.
+                connections.close_all()
+        threading.Thread(target=run, daemon=True).start()
+
+    def _needs_update(self, data): # pylint: disable=unused-argument
+        """
+        Returns True, if valid data should be partially updated with
+        _update_data before it is used.
+        """
+        return False
+
     def _generate_data(self, *models, data=None):
         raise NotImplementedError("Subclass of CachedAbstract needs to implement _generate_data")
+
+    def _update_data(self, *models, data): # pylint: disable=unused-argument
+        """
+        Returns an updated version of data, or None if the data must be
+        fully regenerated instead.
+        """
+        return None
@@ -0,0 +1,14 @@
+import logging
+
+
+logger = logging.getLogger('aplus.cached')
+
+try:
+    from lz4.block import compress as _compress, decompress
+    def compress(data: bytes) -> bytes:
+        return _compress(data, compression=1)
+except ImportError:
+    logger.warning("Unable to import lz4, using a slower zlib instead")
+    from zlib import compress as _compress, decompress
+    def compress(data: bytes) -> bytes:
+        return _compress(data, level=1)
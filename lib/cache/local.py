@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional
+import pickle
+
+from django.conf import settings
+
+
+class LocalMemoryCache:
+    """
+    Process local LRU cache, which is bounded by the total size of the
+    pickled values. Each value is stored with a version, and it is returned
+    only when the requested version matches.
+    """
+
+    def __init__(self, max_size: Optional[int] = None) -> None:
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size is None:
+            self._max_size = settings.CACHED_LOCAL_MEMORY_SIZE
+        return self._max_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: str, version: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            pickled = entry[1]
+        # Every reader gets its own copy, which it may modify.
+        return pickle.loads(pickled)
+
+    def set(self, key: str, version: Hashable, value: Any) -> None:
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remove(key)
+            if len(pickled) > self.max_size:
+                return
+            self._entries[key] = (version, pickled)
+            self._size += len(pickled)
+            while self._size > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+
+local_cache = LocalMemoryCache()
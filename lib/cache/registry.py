@@ -0,0 +1,84 @@
+"""
+Request-scoped registry for objects, which are expensive to construct or
+look up and are used many times while handling a single request, like the
+cached content and points of a course, or the role of the user in a course.
+
+The registry is active only inside `request_scope` (see
+`lib.middleware.RequestRegistryMiddleware`). Outside of it, for example in
+management commands and celery tasks, every lookup is computed again.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Hashable, Iterator, Optional
+import logging
+
+from django.conf import settings
+
+
+logger = logging.getLogger('aplus.cached')
+
+
+class RequestRegistry:
+    def __init__(self) -> None:
+        self.values = {}
+        self.constructions = Counter()
+
+    def memoize(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        if key in self.values:
+            return self.values[key]
+        value = func()
+        self.values[key] = value
+        return value
+
+    def clear(self) -> None:
+        self.values.clear()
+
+    def report_duplicates(self) -> None:
+        for name, count in self.constructions.items():
+            if count > 1:
+                logger.warning("%s was constructed %d times during a single request", name, count)
+
+
+_registry: ContextVar[Optional[RequestRegistry]] = ContextVar('request_registry', default=None)
+
+
+@contextmanager
+def request_scope() -> Iterator[RequestRegistry]:
+    registry = RequestRegistry()
+    token = _registry.set(registry)
+    try:
+        yield registry
+    finally:
+        _registry.reset(token)
+        if settings.DEBUG:
+            registry.report_duplicates()
+
+
+def memoize(key: Hashable, func: Callable[[], Any]) -> Any:
+    """
+    Returns the value stored with key during the current request. The value
+    is computed with func, if it is not stored yet or there is no request.
+    """
+    registry = _registry.get()
+    if registry is None:
+        return func()
+    return registry.memoize(key, func)
+
+
+def clear() -> None:
+    """
+    Forgets the values of the current request. This is called whenever
+    the cached data is invalidated, so that the rest of the request sees
+    the change.
+    """
+    registry = _registry.get()
+    if registry is not None:
+        registry.clear()
+
+
+def note_construction(name: str) -> None:
+    """Counts the constructions of an object for the duplicate report in debug mode."""
+    registry = _registry.get()
+    if registry is not None and settings.DEBUG:
+        registry.constructions[name] += 1
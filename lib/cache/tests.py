@@ -1,11 +1,18 @@
-from django.test import SimpleTestCase
-from threading import Thread, Event, Barrier
+from django.test import SimpleTestCase, override_settings
+from threading import Thread, Event, Barrier, Timer
+from time import time
 from unittest.mock import patch
+import pickle
 
 from lib.cache.cached import CachedAbstract
+from lib.cache.local import LocalMemoryCache
+from lib.cache.registry import memoize, request_scope
 
 
 class TestCached(CachedAbstract):
+    # Generate concurrently without waiting for the lease
+    WAIT_TIMEOUT = 0
+
     def __init__(self, func):
         self._fake_func = func
         super().__init__()
@@ -14,6 +21,29 @@ class TestCached(CachedAbstract):
         return self._fake_func(data)
 
 
+class CompressedTestCached(TestCached):
+    COMPRESS = True
+
+
+class LeasedTestCached(TestCached):
+    WAIT_TIMEOUT = 1
+    WAIT_INTERVAL = 0.01
+
+
+class RevalidatedTestCached(TestCached):
+    """Expired data is used while it is regenerated by the queued jobs"""
+    jobs = []
+
+    def _needs_generation(self, data):
+        return data is None or data['expires'] < time()
+
+    def _use_stale(self, data): # pylint: disable=unused-argument
+        return True
+
+    def _run_in_background(self, func, *args):
+        self.jobs.append(lambda: func(*args))
+
+
 mock_cache = {}
 
 def mock_delete(key):
@@ -154,3 +184,254 @@ class CachedTest(SimpleTestCase):
         # thread 3 reads data from thread 2
         cached3 = TestCached(lambda x: "Ignored data")
         self.assertEqual(cached3.data, data2)
+
+    def test_schema_version(self):
+        """
+        Data stored with another schema version should be regenerated
+        """
+        data1 = "Old data"
+        cached1 = TestCached(lambda x: data1)
+        self.assertEqual(cached1.data, data1)
+
+        data2 = "New data"
+        with patch.object(TestCached, 'SCHEMA_VERSION', TestCached.SCHEMA_VERSION + 1):
+            cached2 = TestCached(lambda x: data2)
+        self.assertEqual(cached2.data, data2)
+
+    def test_compressed(self):
+        """
+        Compressed cache should return the stored value and store it smaller
+        """
+        data1 = {
+            'modules': [
+                {
+                    'type': 'exercise',
+                    'id': i,
+                    'status': 'ready',
+                    'name': "Exercise %d" % i,
+                    'link': '/course/instance/module/exercise-%d/' % i,
+                    'max_points': 10,
+                    'points_to_pass': 0,
+                    'submission_count': 0,
+                    'points': 0,
+                    'formatted_points': '0',
+                    'passed': False,
+                    'graded': False,
+                    'unofficial': False,
+                    'feedback_revealed': True,
+                    'feedback_reveal_time': None,
+                    'children': [],
+                }
+                for i in range(500)
+            ],
+        }
+        cached1 = CompressedTestCached(lambda x: data1)
+        self.assertEqual(cached1.data, data1)
+
+        cached2 = CompressedTestCached(lambda x: "Ignored data")
+        self.assertEqual(cached2.data, data1)
+
+        _, stored = next(iter(mock_cache.values()))
+        self.assertLess(
+            len(pickle.dumps(stored, pickle.HIGHEST_PROTOCOL)) * 5,
+            len(pickle.dumps(data1, pickle.HIGHEST_PROTOCOL)),
+        )
+
+    def test_local_cache(self):
+        """
+        Local memory cache should be used until the data is invalidated
+        """
+        with patch('lib.cache.cached.local_cache', LocalMemoryCache(10000)):
+            data1 = "Local data"
+            cached1 = TestCached(lambda x: data1)
+            self.assertEqual(cached1.data, data1)
+
+            # The shared value is not read while the version matches
+            key = TestCached._key(modifiers=[])
+            updated, _ = mock_cache[key]
+            mock_cache[key] = (updated, TestCached._dump("Shared data"))
+            cached2 = TestCached(lambda x: "Ignored data")
+            self.assertEqual(cached2.data, data1)
+
+            TestCached.invalidate()
+            data3 = "New data"
+            cached3 = TestCached(lambda x: data3)
+            self.assertEqual(cached3.data, data3)
+
+    def test_stale_while_generated(self):
+        """
+        Stale data should be used while another process generates the data
+        """
+        data1 = "Stale data"
+        cached1 = LeasedTestCached(lambda x: data1)
+        self.assertEqual(cached1.data, data1)
+        LeasedTestCached.invalidate()
+
+        key = LeasedTestCached._key(modifiers=[])
+        mock_cache[LeasedTestCached._lease_key(key)] = time()
+        cached2 = LeasedTestCached(lambda x: "Ignored data")
+        self.assertEqual(cached2.data, data1)
+
+        # The lease has been released
+        del mock_cache[LeasedTestCached._lease_key(key)]
+        data3 = "New data"
+        cached3 = LeasedTestCached(lambda x: data3)
+        self.assertEqual(cached3.data, data3)
+
+    def test_stale_while_generated_by_lease_holder(self):
+        """
+        Stale data should be used while another thread holds the lease and generates the data
+        """
+        data1 = "Stale data"
+        LeasedTestCached(lambda x: data1)
+        LeasedTestCached.invalidate()
+
+        started = Event()
+        release = Event()
+        data2 = "New data"
+        def generate(data):
+            started.set()
+            release.wait(1)
+            return data2
+        def run():
+            # The cache connections are thread local
+            with cache_patcher():
+                LeasedTestCached(generate)
+        th = Thread(target=run)
+        th.start()
+        self.assertTrue(started.wait(1))
+
+        def generate_concurrently(data):
+            self.fail("The data should not be generated concurrently")
+        start = time()
+        cached2 = LeasedTestCached(generate_concurrently)
+        self.assertEqual(cached2.data, data1)
+        self.assertLess(time() - start, LeasedTestCached.WAIT_TIMEOUT)
+
+        release.set()
+        th.join()
+        cached3 = LeasedTestCached(generate_concurrently)
+        self.assertEqual(cached3.data, data2)
+
+    def test_stale_while_revalidate(self):
+        """
+        Expired data should be returned while it is regenerated in the background once
+        """
+        RevalidatedTestCached.jobs.clear()
+        cached1 = RevalidatedTestCached(lambda x: {'value': 1, 'expires': 0})
+        self.assertEqual(cached1.data['value'], 1)
+        self.assertEqual(RevalidatedTestCached.jobs, [])
+
+        cached2 = RevalidatedTestCached(lambda x: {'value': 2, 'expires': time() + 60})
+        self.assertEqual(cached2.data['value'], 1)
+        self.assertEqual(len(RevalidatedTestCached.jobs), 1)
+        # The data is being regenerated
+        cached3 = RevalidatedTestCached(lambda x: {'value': 3, 'expires': time() + 60})
+        self.assertEqual(cached3.data['value'], 1)
+        self.assertEqual(len(RevalidatedTestCached.jobs), 1)
+
+        RevalidatedTestCached.jobs.pop()()
+        cached4 = RevalidatedTestCached(lambda x: {'value': 4, 'expires': time() + 60})
+        self.assertEqual(cached4.data['value'], 2)
+        self.assertEqual(RevalidatedTestCached.jobs, [])
+
+    def test_stale_revalidated_after_invalidation(self):
+        """
+        Regenerated data should not overwrite an invalidation
+        """
+        RevalidatedTestCached.jobs.clear()
+        RevalidatedTestCached(lambda x: {'value': 1, 'expires': 0})
+        RevalidatedTestCached(lambda x: {'value': 2, 'expires': time() + 60})
+        RevalidatedTestCached.invalidate()
+        RevalidatedTestCached.jobs.pop()()
+        cached = RevalidatedTestCached(lambda x: {'value': 3, 'expires': time() + 60})
+        self.assertEqual(cached.data['value'], 3)
+
+    def test_wait_for_lease(self):
+        """
+        Without stale data, the data generated by the lease holder should be waited for
+        """
+        key = LeasedTestCached._key(modifiers=[])
+        lease_key = LeasedTestCached._lease_key(key)
+        mock_cache[lease_key] = time()
+        data1 = "Generated data"
+
+        def generate():
+            mock_cache[key] = (time(), LeasedTestCached._dump(data1))
+            del mock_cache[lease_key]
+        timer = Timer(0.05, generate)
+        timer.start()
+        cached = LeasedTestCached(lambda x: "Ignored data")
+        timer.join()
+        self.assertEqual(cached.data, data1)
+
+
+class LocalMemoryCacheTest(SimpleTestCase):
+    def test_version(self):
+        local = LocalMemoryCache(1000)
+        local.set('key', 1, "value")
+        self.assertEqual(local.get('key', 1), "value")
+        self.assertIsNone(local.get('key', 2))
+        self.assertIsNone(local.get('key', 1))
+
+    def test_size_limit(self):
+        value = "x" * 100
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        local = LocalMemoryCache(size * 2)
+        local.set('key1', 1, value)
+        local.set('key2', 1, value)
+        # key1 is used more recently than key2
+        self.assertEqual(local.get('key1', 1), value)
+        local.set('key3', 1, value)
+        self.assertEqual(local.get('key1', 1), value)
+        self.assertIsNone(local.get('key2', 1))
+        self.assertEqual(local.get('key3', 1), value)
+        # Too big values are not stored at all
+        local.set('key4', 1, value * 3)
+        self.assertIsNone(local.get('key4', 1))
+        self.assertEqual(local.get('key3', 1), value)
+
+
+@cache_patcher()
+class RequestRegistryTest(SimpleTestCase):
+    def setUp(self):
+        mock_cache.clear()
+
+    def test_memoize(self):
+        values = iter(range(10))
+        with request_scope():
+            self.assertEqual(memoize('key', lambda: next(values)), 0)
+            self.assertEqual(memoize('key', lambda: next(values)), 0)
+        # A new request computes the value again
+        with request_scope():
+            self.assertEqual(memoize('key', lambda: next(values)), 1)
+        # Nothing is stored outside of a request
+        self.assertEqual(memoize('key', lambda: next(values)), 2)
+        self.assertEqual(memoize('key', lambda: next(values)), 3)
+
+    def test_shared_instance(self):
+        """
+        Instances constructed with equal arguments should be shared during a request
+        """
+        def func(data): # pylint: disable=unused-argument
+            return "Some data"
+        with request_scope():
+            cached1 = TestCached(func)
+            cached2 = TestCached(func)
+            self.assertIs(cached1, cached2)
+            # Invalidation forgets the shared instances
+            TestCached.invalidate()
+            cached3 = TestCached(func)
+            self.assertIsNot(cached1, cached3)
+        self.assertIsNot(TestCached(func), TestCached(func))
+
+    @override_settings(DEBUG=True)
+    def test_duplicates(self):
+        """
+        Debug mode should report duplicate constructions of the same cache
+        """
+        with self.assertLogs('aplus.cached', 'WARNING') as logs:
+            with request_scope():
+                TestCached(lambda x: "Some data")
+                TestCached(lambda x: "Some data")
+        self.assertIn("constructed 2 times", logs.output[0])
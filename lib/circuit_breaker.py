@@ -0,0 +1,164 @@
+import logging
+import random
+from time import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger('aplus.circuit_breaker')
+
+
+class CircuitBreaker:
+    """
+    Keeps track of the failing requests to an exercise service host. The state
+    is kept in the shared cache, so that all the web and celery processes see
+    the same state.
+
+    closed: The requests pass. The requests and their failures are counted in
+    windows of GRADER_CIRCUIT_WINDOW seconds. When the current and the previous
+    window hold at least GRADER_CIRCUIT_MIN_REQUESTS requests and the share of
+    the failures reaches GRADER_CIRCUIT_ERROR_RATE, the circuit opens.
+
+    open: The requests fail immediately without contacting the host. The
+    circuit stays open for GRADER_CIRCUIT_OPEN_TIME seconds, doubled on each
+    consecutive opening up to GRADER_CIRCUIT_MAX_OPEN_TIME. The time is
+    jittered, so that the processes do not all probe the host at once.
+
+    half-open: One request at a time is let through to probe the host. A
+    success closes the circuit and a failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    KEY_PREFIX = 'circuit'
+    # The hosts, whose circuit has been opened, for the alerts
+    INDEX_KEY = 'circuit-hosts'
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+
+    @classmethod
+    def for_url(cls, url: str) -> 'CircuitBreaker':
+        return cls(urlparse(url).netloc)
+
+    def _key(self, *parts) -> str:
+        return ':'.join((self.KEY_PREFIX, self.host) + tuple(str(p) for p in parts))
+
+    def _window_keys(self) -> List[str]:
+        window = int(time() // settings.GRADER_CIRCUIT_WINDOW)
+        return [
+            self._key(w, counter)
+            for w in (window, window - 1)
+            for counter in ('requests', 'failures')
+        ]
+
+    @classmethod
+    def _state(cls, opened: Optional[Tuple[float, int]]) -> str:
+        if opened is None:
+            return cls.CLOSED
+        if time() < opened[0]:
+            return cls.OPEN
+        return cls.HALF_OPEN
+
+    def state(self) -> str:
+        return self._state(cache.get(self._key('open')))
+
+    def allow_request(self) -> bool:
+        """
+        Returns False, if the request must fail without contacting the host.
+        """
+        state = self.state()
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        # Only one request probes the host at a time.
+        return cache.add(self._key('probe'), True, settings.EXERCISE_HTTP_TIMEOUT)
+
+    def record_success(self) -> None:
+        self._count(self._window_keys()[:1])
+        if self.state() == self.HALF_OPEN:
+            self._close()
+
+    def record_failure(self) -> None:
+        keys = self._window_keys()
+        self._count(keys[:2])
+        opened = cache.get(self._key('open'))
+        if opened is not None:
+            if self._state(opened) == self.HALF_OPEN:
+                # The probe failed.
+                self._open(opened[1] + 1)
+            return
+        counts = cache.get_many(keys)
+        requests = counts.get(keys[0], 0) + counts.get(keys[2], 0)
+        failures = counts.get(keys[1], 0) + counts.get(keys[3], 0)
+        if (requests >= settings.GRADER_CIRCUIT_MIN_REQUESTS
+                and failures >= requests * settings.GRADER_CIRCUIT_ERROR_RATE):
+            self._open(1)
+
+    def _count(self, keys: List[str]) -> None:
+        for key in keys:
+            cache.add(key, 0, 2 * settings.GRADER_CIRCUIT_WINDOW)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # The counter expired in between.
+                pass
+
+    def _open(self, openings: int) -> None:
+        open_time = min(
+            settings.GRADER_CIRCUIT_OPEN_TIME * 2 ** (openings - 1),
+            settings.GRADER_CIRCUIT_MAX_OPEN_TIME,
+        )
+        open_time = random.uniform(open_time / 2, open_time)
+        # The number of openings is remembered for a while after the open
+        # time, so that a host failing again is closed off for longer.
+        timeout = open_time + settings.GRADER_CIRCUIT_MAX_OPEN_TIME
+        cache.set(self._key('open'), (time() + open_time, openings), timeout)
+        cache.delete(self._key('probe'))
+        # NOTE: without check-and-set, a concurrent update may drop a host
+        # from the index. The circuit works regardless, only the alert is lost.
+        now = time()
+        index = {
+            host: expires
+            for host, expires in (cache.get(self.INDEX_KEY) or {}).items()
+            if expires > now
+        }
+        index[self.host] = now + timeout
+        cache.set(self.INDEX_KEY, index, None)
+        logger.warning("Circuit of %s opened for %d sec", self.host, open_time)
+
+    def _close(self) -> None:
+        cache.delete_many([self._key('open'), self._key('probe')] + self._window_keys())
+        cache.set(self._key('recovered'), True, settings.GRADER_CIRCUIT_MAX_OPEN_TIME)
+        index = cache.get(self.INDEX_KEY) or {}
+        if index.pop(self.host, None) is not None:
+            cache.set(self.INDEX_KEY, index, None)
+        logger.info("Circuit of %s closed", self.host)
+
+    def recovered(self) -> bool:
+        """
+        Returns True once after the circuit has been closed by a probe.
+        """
+        return bool(cache.delete(self._key('recovered')))
+
+    @classmethod
+    def unavailable_hosts(cls) -> Dict[str, str]:
+        """
+        Returns the hosts, whose circuit is not closed, and their states.
+        """
+        index = cache.get(cls.INDEX_KEY)
+        if not index:
+            return {}
+        breakers = {cls(host)._key('open'): host for host in index}
+        opened = cache.get_many(list(breakers.keys()))
+        return {
+            host: cls._state(opened[key])
+            for key, host in breakers.items()
+            if key in opened
+        }
+
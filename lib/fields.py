@@ -5,6 +5,7 @@ from django import forms
 from django.core import exceptions, validators
 from django.db import models
 from django.db.models.fields import related_descriptors
+from django.db.models.query_utils import DeferredAttribute
 from django.utils.translation import gettext_lazy as _
 
 from .widgets import DurationInput, SearchSelect
@@ -200,10 +201,45 @@ class UsersSearchSelectField(SearchSelectField):
         super().__init__(*args, **kwargs)
 
 
+class JSONText(str):
+    """
+    JSON loaded from the database, which has not been parsed yet.
+    """
+    __slots__ = ()
+
+
+class JSONFieldDescriptor(DeferredAttribute):
+    """
+    Parses the JSON loaded from the database when the attribute is accessed
+    for the first time. The rows, whose JSON is never accessed, skip the
+    parsing and are saved back as the same text.
+    """
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, JSONText):
+            try:
+                value = JSONField.parse_json(value)
+            except exceptions.ValidationError:
+                value = None
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # A data descriptor is looked up before the instance dictionary.
+        instance.__dict__[self.field.attname] = value
+
+
 class JSONField(models.TextField):
     """
     Stores JSON object in a text field.
+
+    The JSON of a model instance is parsed lazily, see `JSONFieldDescriptor`.
+    `values()` and `values_list()` return the unparsed `JSONText`.
     """
+    descriptor_class = JSONFieldDescriptor
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -227,10 +263,9 @@ class JSONField(models.TextField):
         return json.dumps(value)
 
     def from_db_value(self, value, expression, connection): # pylint: disable=unused-argument
-        try:
-            return JSONField.parse_json(value)
-        except (exceptions.ValidationError):
+        if not value:
             return None
+        return JSONText(value)
 
     def get_prep_value(self, value):
         return JSONField.print_json(value)
@@ -5,6 +5,7 @@ from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
 from django.shortcuts import render
 
+from lib.cache.registry import request_scope
 from lib.helpers import remove_query_param_from_url
 
 
@@ -34,3 +35,17 @@ class LocaleMiddleware(MiddlewareMixin):
         if 'Content-Language' not in response:
             response['Content-Language'] = language
         return response
+
+
+class RequestRegistryMiddleware:
+    """
+    Shares the cached data and the course roles of the user between all
+    views, serializers and templatetags of a request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_scope():
+            return self.get_response(request)
@@ -1,12 +1,17 @@
+from http.cookiejar import DefaultCookiePolicy
 import logging
+import os
 import posixpath
+import random
 import re
+import threading
 import time
-from typing import Mapping, Optional, Sequence, Tuple
+from typing import Dict, Mapping, Optional, Sequence, Tuple
 from urllib.parse import urlparse, urljoin
 
 from bs4 import BeautifulSoup, Tag
 import requests
+from requests.adapters import HTTPAdapter
 from requests.models import Response
 
 from aplus_auth.payload import Permission, Permissions
@@ -15,11 +20,87 @@ from django.utils.http import parse_http_date_safe
 from django.utils.text import format_lazy
 from django.utils.translation import gettext_lazy as _
 
-from aplus_auth.requests import post as aplus_post, get as aplus_get
+from aplus_auth.requests import Session
+from .circuit_breaker import CircuitBreaker
 
 
 logger = logging.getLogger('aplus.remote_page')
 
+# The attributes of the elements, whose relative URLs are fixed
+LINK_ATTRIBUTES = {
+    "img": "src",
+    "script": "src",
+    "iframe": "src",
+    "link": "href",
+    "a": "href",
+    "video": "poster",
+    "source": "src",
+}
+# Starts with "#", "//" or "https:".
+ABSOLUTE_URL = re.compile('^(#|\/\/|\w+:)', re.IGNORECASE) # noqa: W605
+# Ends with filename extension ".html" and possibly "#anchor".
+CHAPTER_URL = re.compile('.*\.html(#.+)?$', re.IGNORECASE) # noqa: W605
+# Starts with at least one "../".
+START_DOTDOT_PATH = re.compile(r"^(../)+")
+# May end with the language suffix _en or _en/#anchor or _en#anchor.
+LANG_SUFFIX = re.compile(r'(?P<lang>_[a-z]{2})?(?P<slash>/)?(?P<anchor>#.+)?$')
+# Detect certain A+ exercise info URLs so that they are not broken by
+# the transformations: "../../module1/chapter/module1_chapter_exercise/info/model/".
+# URLs /plain, /info, /info/model, /info/template.
+EXERCISE_INFO_URL = re.compile(r'/((plain)|(info(/model|/template)?))/?(#.+)?$')
+
+# The session of this process and the id of the process that created it
+_session: Optional[Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> Session:
+    """
+    Returns the HTTP session of this process. The session keeps the
+    connections to the exercise services alive, at most
+    EXERCISE_HTTP_POOL_SIZE idle connections per host.
+    """
+    global _session, _session_pid # pylint: disable=global-statement
+    with _session_lock:
+        # The connections are not shared with the forked worker processes.
+        if _session is None or _session_pid != os.getpid():
+            session = Session()
+            # The cookies set by a service must not leak into the requests
+            # made for other users.
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            for prefix in ('http://', 'https://'):
+                session.mount(prefix, HTTPAdapter(
+                    pool_connections=settings.EXERCISE_HTTP_POOL_HOSTS,
+                    pool_maxsize=settings.EXERCISE_HTTP_POOL_SIZE,
+                ))
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def connection_pool_statistics() -> Dict[str, Dict[str, int]]:
+    """
+    Returns the number of requests, opened connections and idle connections
+    per exercise service host in this process.
+    """
+    if _session is None or _session_pid != os.getpid():
+        return {}
+    stats = {}
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["{}://{}:{}".format(pool.scheme, pool.host, pool.port)] = {
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                # The empty slots of the pool are None.
+                'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+            }
+    return stats
+
 
 class RemotePageException(Exception):
     def __init__(self, message, code=500):
@@ -32,6 +113,17 @@ class RemotePageNotFound(RemotePageException):
         super().__init__(message, 404)
 
 
+class RemotePageUnavailable(RemotePageException):
+    """
+    The request was not made, because the circuit of the host is open.
+    """
+    def __init__(self):
+        super().__init__(format_lazy(
+            _('CONNECTING_TO_COURSE_SERVICE_FAILED -- {code}'),
+            code=503,
+        ), 503)
+
+
 class RemotePageNotModified(Exception):
 
     def __init__(self, expires=None):
@@ -42,6 +134,20 @@ def parse_expires(response):
     return parse_http_date_safe(response.headers.get("Expires", "")) or 0
 
 
+def retry_delay(n: int) -> float:
+    """
+    Returns the delay in seconds before the retry `n`. The delays grow
+    exponentially from EXERCISE_HTTP_RETRY_DELAY up to the delays in
+    EXERCISE_HTTP_RETRIES and are jittered, so that the processes, which
+    failed at the same time, do not retry at the same time.
+    """
+    delay = min(
+        settings.EXERCISE_HTTP_RETRY_DELAY * 2 ** n,
+        settings.EXERCISE_HTTP_RETRIES[n],
+    )
+    return random.uniform(delay / 2, delay)
+
+
 def request_for_response(url, # pylint: disable=too-many-arguments
         post=False,
         data=None,
@@ -56,35 +162,48 @@ def request_for_response(url, # pylint: disable=too-many-arguments
         else:
             permissions.instances.add(Permission.READ, id=instance_id)
 
+    session = get_session()
+    timeout = (
+        settings.EXERCISE_HTTP_CONNECT_TIMEOUT or settings.EXERCISE_HTTP_TIMEOUT,
+        settings.EXERCISE_HTTP_TIMEOUT,
+    )
+    breaker = CircuitBreaker.for_url(url)
     try:
         last_retry = len(settings.EXERCISE_HTTP_RETRIES) - 1
         n = 0
         while n <= last_retry:
+            if not breaker.allow_request():
+                logger.warning("Circuit of %s is open, not requesting %s", breaker.host, url)
+                raise RemotePageUnavailable()
             try:
                 request_time = time.time()
                 if post:
                     logger.info("POST %s", url)
-                    response = aplus_post(
+                    response = session.post(
                         url,
                         permissions=permissions,
                         data=data,
                         files=files,
-                        timeout=settings.EXERCISE_HTTP_TIMEOUT
+                        timeout=timeout,
                     )
                 else:
                     logger.info("GET %s", url)
                     headers = {}
                     if stamp:
                         headers['If-Modified-Since'] = stamp
-                    response = aplus_get(
+                    response = session.get(
                         url,
                         permissions=permissions,
-                        timeout=settings.EXERCISE_HTTP_TIMEOUT,
+                        timeout=timeout,
                         headers=headers
                     )
                 request_time = time.time() - request_time
                 logger.info("Response %d (%d sec) %s",
                     response.status_code, request_time, url)
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
                 if response.status_code == 200:
                     return response
                 if response.status_code == 304:
@@ -93,11 +212,15 @@ def request_for_response(url, # pylint: disable=too-many-arguments
                     response.raise_for_status()
             except requests.exceptions.ConnectionError as e:
                 logger.warning("ConnectionError %s", url);
+                breaker.record_failure()
                 if n >= last_retry:
                     raise e
-            logger.info("Sleep %d sec before retry",
-                settings.EXERCISE_HTTP_RETRIES[n])
-            time.sleep(settings.EXERCISE_HTTP_RETRIES[n])
+            except requests.exceptions.Timeout:
+                breaker.record_failure()
+                raise
+            delay = retry_delay(n)
+            logger.info("Sleep %.1f sec before retry", delay)
+            time.sleep(delay)
             n += 1
         logger.error("HTTP request loop ended in unexpected state")
         raise RuntimeError("HTTP request loop ended in unexpected state")
@@ -110,6 +233,16 @@ def request_for_response(url, # pylint: disable=too-many-arguments
         )) from e
 
 
+def _has_attr_value(element: Tag, name: str, value: str) -> bool:
+    """
+    Matches the attribute value like `Tag.find` does.
+    """
+    actual = element.get(name)
+    if isinstance(actual, list):
+        return value in actual or ' '.join(actual) == value
+    return actual == value
+
+
 class RemotePage:
     """
     Represents a page that can be loaded over HTTP for further processing.
@@ -126,6 +259,7 @@ class RemotePage:
         self.response = request_for_response(url, post, data, files, stamp, instance_id)
         self.response.encoding = "utf-8"
         self.soup = BeautifulSoup(self.response.text, 'html5lib')
+        self._meta_elements: Optional[Dict[str, Tag]] = None
 
     def base_address(self):
         path = posixpath.dirname(self.url.path).rstrip('/') + '/'
@@ -138,7 +272,14 @@ class RemotePage:
 
     def meta(self, name):
         if self.soup:
-            element = self.soup.find("meta", {"name": name})
+            if self._meta_elements is None:
+                # Many of the meta elements are usually missing. Search all
+                # of them at once, instead of searching the page for each.
+                self._meta_elements = {}
+                for element in self.soup.find_all("meta"):
+                    if element.has_attr("name"):
+                        self._meta_elements.setdefault(element["name"], element)
+            element = self._meta_elements.get(name)
             if element:
                 return element.get("value",
                     default=element.get("content", default=None))
@@ -169,10 +310,21 @@ class RemotePage:
             search_attributes: Sequence[Mapping[str, str]],
             ) -> Optional[Tag]:
         if self.soup:
-            for attr in search_attributes:
-                element = self.soup.find(**attr)
-                if element:
-                    return element
+            # Search for all the attributes in a single walk over the page.
+            # The first element matching the first possible attributes wins.
+            selected = None
+            best = len(search_attributes)
+            for element in self.soup.descendants:
+                if not isinstance(element, Tag):
+                    continue
+                for i, attrs in enumerate(search_attributes[:best]):
+                    if all(_has_attr_value(element, k, v) for k, v in attrs.items()):
+                        selected, best = element, i
+                        break
+                if best == 0:
+                    break
+            if selected is not None:
+                return selected
             return self.soup.body
         return None
 
@@ -186,11 +338,17 @@ class RemotePage:
         if element:
             self._remove_id_attr(element, id_attrs_to_remove)
             result = str(element)
-            clean_result = self._clean_element(element)
+            clean_result = self._clean_element(element, result)
         return result, clean_result
 
-    def _clean_element(self, element: Tag) -> str:
-        for once in element.find_all(True, {'data-aplus-once':True}):
+    def _clean_element(self, element: Tag, result: str) -> str:
+        once_elements = [
+            once for once in element.descendants
+            if isinstance(once, Tag) and once.has_attr('data-aplus-once')
+        ]
+        if not once_elements:
+            return result
+        for once in once_elements:
             once.decompose()
         return str(element)
 
@@ -210,33 +368,38 @@ class RemotePage:
     def body(self) -> Optional[Tag]:
         return self.soup.body if self.soup else None
 
-    def fix_relative_urls(self):
-        url = self.base_address()
-        for tag,attr in [
-            ("img","src"),
-            ("script","src"),
-            ("iframe","src"),
-            ("link","href"),
-            ("a","href"),
-            ("video","poster"),
-            ("source","src"),
-        ]:
-            self._fix_relative_urls(url, tag, attr)
-
-    def _fix_relative_urls(self, url, tag_name, attr_name): # pylint: disable=too-many-locals too-many-branches
-        # Starts with "#", "//" or "https:".
-        test = re.compile('^(#|\/\/|\w+:)', re.IGNORECASE) # noqa: W605
-        # Ends with filename extension ".html" and possibly "#anchor".
-        chapter = re.compile('.*\.html(#.+)?$', re.IGNORECASE) # noqa: W605
-        # Starts with at least one "../".
-        start_dotdot_path = re.compile(r"^(../)+")
-        # May end with the language suffix _en or _en/#anchor or _en#anchor.
-        lang_suffix = re.compile(r'(?P<lang>_[a-z]{2})?(?P<slash>/)?(?P<anchor>#.+)?$')
-        # Detect certain A+ exercise info URLs so that they are not broken by
-        # the transformations: "../../module1/chapter/module1_chapter_exercise/info/model/".
-        # URLs /plain, /info, /info/model, /info/template.
-        exercise_info = re.compile(r'/((plain)|(info(/model|/template)?))/?(#.+)?$')
+    def process_elements(
+            self,
+            attr_name: str,
+            list_of_attributes: Sequence[Mapping[str, str]],
+            ) -> None:
+        """
+        Fixes the relative URLs of the elements and sets the attributes of the
+        elements, which have the attribute `attr_name`, in a single walk over
+        the elements. The attributes in `list_of_attributes` are set to the
+        elements in order. A name starting with "?" is set only if the element
+        contains it.
+        """
+        links = []
+        replaced = []
+        for element in self.soup.descendants:
+            if not isinstance(element, Tag):
+                continue
+            link_attr_name = LINK_ATTRIBUTES.get(element.name)
+            if link_attr_name and element.has_attr(link_attr_name):
+                links.append((element, link_attr_name))
+            if len(replaced) < len(list_of_attributes) and element.has_attr(attr_name):
+                replaced.append(element)
+        self._fix_relative_urls(self.base_address(), links)
+        for element, attributes in zip(replaced, list_of_attributes):
+            for name,value in attributes.items():
+                if name.startswith('?'):
+                    if name[1:] in element:
+                        element[name[1:]] = value
+                else:
+                    element[name] = value
 
+    def _fix_relative_urls(self, url, links): # pylint: disable=too-many-branches
         # If Gitmanager is in use, fix relative static URLs to that host
         if settings.GITMANAGER_URL:
             gmurl = urlparse(settings.GITMANAGER_URL)
@@ -247,14 +410,14 @@ class RemotePage:
         else:
             staticurl = url
 
-        for element in self.soup.find_all(tag_name, {attr_name:True}):
+        for element, attr_name in links:
             value = element[attr_name]
             if not value:
                 continue
 
             # Custom transform for RST chapter to chapter links.
             if element.has_attr('data-aplus-chapter'):
-                m = chapter.match(value)
+                m = CHAPTER_URL.match(value)
                 if m:
                     i = m.start(1)
                     if i > 0:
@@ -278,10 +441,10 @@ class RemotePage:
                 # page URL: /course/course_instance/module/chapter/
                 # (A+ URLs do not have the same "subdirectories" as
                 # the real subdirectories in the course git repo.)
-                new_val = '../../' + start_dotdot_path.sub("", without_html_suffix)
+                new_val = '../../' + START_DOTDOT_PATH.sub("", without_html_suffix)
 
                 split_path = new_val.split('/')
-                if len(split_path) > 4 and not exercise_info.search(new_val):
+                if len(split_path) > 4 and not EXERCISE_INFO_URL.search(new_val):
                     # If the module directory has subdirectories in the course
                     # git repo, the subdirectory must be modified in the A+ URL.
                     # The subdirectory slash / is converted to underscore _.
@@ -293,7 +456,7 @@ class RemotePage:
 
                 # Remove lang suffix in chapter2_en#anchor without modifying the #anchor.
                 # Add slash / to the end before the #anchor.
-                m = lang_suffix.search(new_val)
+                m = LANG_SUFFIX.search(new_val)
                 if m:
                     anchor = m.group('anchor')
                     if anchor is None:
@@ -302,7 +465,7 @@ class RemotePage:
 
                 element[attr_name] = new_val
 
-            elif value and not test.match(value):
+            elif value and not ABSOLUTE_URL.match(value):
 
                 # Custom transform for RST generated exercises.
                 if element.has_attr('data-aplus-path'):
@@ -317,7 +480,7 @@ class RemotePage:
                         '{course}',
                         url.path.split('/', 2)[1]
                     )
-                    fix_value = start_dotdot_path.sub("/", value)
+                    fix_value = START_DOTDOT_PATH.sub("/", value)
                     value = fix_path + fix_value
 
                 # url points to the exercise service, e.g., MOOC-Grader.
@@ -332,19 +495,3 @@ class RemotePage:
                 # E.g., urljoin('http://localhost:8080/static/default/module1/chapter.html', "../_images/image.png")
                 # -> 'http://localhost:8080/static/default/_images/image.png'
                 element[attr_name] = urljoin(staticurl.geturl(), value)
-
-    def find_and_replace(self, attr_name, list_of_attributes):
-        l = len(list_of_attributes) # noqa: E741
-        if l == 0: # noqa: E741
-            return
-        i = 0
-        for element in self.soup.find_all(True, {attr_name:True}):
-            for name,value in list_of_attributes[i].items():
-                if name.startswith('?'):
-                    if name[1:] in element:
-                        element[name[1:]] = value
-                else:
-                    element[name] = value
-            i += 1
-            if i >= l:
-                return
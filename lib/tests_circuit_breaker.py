@@ -0,0 +1,89 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+import requests
+
+from lib.circuit_breaker import CircuitBreaker
+from lib.remote_page import RemotePageUnavailable, request_for_response
+
+
+@override_settings(
+    GRADER_CIRCUIT_WINDOW=60,
+    GRADER_CIRCUIT_MIN_REQUESTS=4,
+    GRADER_CIRCUIT_ERROR_RATE=0.5,
+    GRADER_CIRCUIT_OPEN_TIME=10,
+    GRADER_CIRCUIT_MAX_OPEN_TIME=40,
+    EXERCISE_HTTP_RETRIES=(0, 0, 0),
+)
+class CircuitBreakerTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('grader.localhost')
+        self.now = 1000000.0
+        for patcher in (
+                patch('lib.circuit_breaker.time', lambda: self.now),
+                # No jitter
+                patch('lib.circuit_breaker.random.uniform', lambda a, b: b)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_opens_on_error_rate(self):
+        self.breaker.record_success()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CircuitBreaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(CircuitBreaker.unavailable_hosts(), {'grader.localhost': CircuitBreaker.OPEN})
+        self.assertEqual(CircuitBreaker('other.localhost').state(), CircuitBreaker.CLOSED)
+
+    def test_old_failures_are_forgotten(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 120
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CircuitBreaker.CLOSED)
+
+    def test_half_open_probe(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+        self.now += 10
+        self.assertEqual(self.breaker.state(), CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        # Only one probe at a time
+        self.assertFalse(self.breaker.allow_request())
+
+        # A failed probe opens the circuit for longer
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CircuitBreaker.OPEN)
+        self.now += 10
+        self.assertEqual(self.breaker.state(), CircuitBreaker.OPEN)
+        self.now += 10
+        self.assertEqual(self.breaker.state(), CircuitBreaker.HALF_OPEN)
+
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.recovered())
+        self.assertFalse(self.breaker.recovered())
+        self.assertEqual(CircuitBreaker.unavailable_hosts(), {})
+        # The failures before the recovery do not count
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CircuitBreaker.CLOSED)
+
+    def test_request_fails_fast(self):
+        url = 'http://grader.localhost/exercise'
+        with patch('lib.remote_page.get_session') as get_session:
+            get_session.return_value.get.side_effect = requests.exceptions.ConnectionError()
+            with self.assertRaises(Exception):
+                request_for_response(url)
+            with self.assertRaises(Exception):
+                request_for_response(url)
+            self.assertEqual(get_session.return_value.get.call_count, 4)
+            self.assertEqual(self.breaker.state(), CircuitBreaker.OPEN)
+            with self.assertRaises(RemotePageUnavailable):
+                request_for_response(url)
+            self.assertEqual(get_session.return_value.get.call_count, 4)
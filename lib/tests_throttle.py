@@ -0,0 +1,69 @@
+import threading
+from time import monotonic, sleep
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from lib.throttle import TokenBucket, grader_request_limits, map_per_host
+
+
+@override_settings(GRADER_REQUEST_LIMITS={
+    'fast.localhost': {'concurrency': 4, 'rate': None},
+    'default': {'concurrency': 1, 'rate': 100},
+})
+class ThrottleTest(SimpleTestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, 2)
+        start = monotonic()
+        for _ in range(12):
+            bucket.acquire()
+        # Two tokens at start, then ten refilled at 100 per second
+        self.assertGreaterEqual(monotonic() - start, 0.09)
+
+    def test_limits(self):
+        self.assertEqual(grader_request_limits('fast.localhost'), (4, None))
+        self.assertEqual(grader_request_limits('grader.localhost'), (1, 100))
+
+    def test_map_per_host(self):
+        lock = threading.Lock()
+        running = {'fast.localhost': 0, 'slow.localhost': 0}
+        most = dict(running)
+
+        def func(item):
+            host, n = item
+            with lock:
+                running[host] += 1
+                most[host] = max(most[host], running[host])
+            sleep(0.01)
+            with lock:
+                running[host] -= 1
+            return n * 2
+
+        items = [
+            (host, (host, n))
+            for n in range(10)
+            for host in ('fast.localhost', 'slow.localhost')
+        ]
+        results = list(map_per_host(func, items))
+        self.assertEqual(
+            sorted(result for _item, result in results),
+            sorted(n * 2 for _host, (_host, n) in items),
+        )
+        self.assertEqual(most['slow.localhost'], 1)
+        self.assertGreater(most['fast.localhost'], 1)
+        self.assertLessEqual(most['fast.localhost'], 4)
+
+    def test_map_per_host_raises(self):
+        def func(item):
+            raise ValueError(item)
+
+        with self.assertRaises(ValueError):
+            list(map_per_host(func, [('fast.localhost', 1)]))
+
+    def test_map_per_host_closes_connections(self):
+        with patch('lib.throttle.connections') as connections:
+            results = list(map_per_host(lambda n: n, [('fast.localhost', n) for n in range(20)]))
+        self.assertEqual(len(results), 20)
+        # Each of the four threads closes its database connections once.
+        self.assertEqual(connections.close_all.call_count, 4)
@@ -0,0 +1,129 @@
+from concurrent.futures import Future, as_completed
+from queue import SimpleQueue
+import threading
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from django.conf import settings
+from django.db import connections
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average and bursts of at most
+    `capacity` events. `acquire` blocks the calling thread until the event is
+    allowed. A rate of `None` allows everything.
+    """
+    def __init__(self, rate: Optional[float], capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._time = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.rate:
+            return
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._time) * self.rate)
+            self._time = now
+            # The token is reserved even if it has not been refilled yet, so
+            # that the waiting threads go in order.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+
+
+def grader_request_limits(host: str) -> Tuple[int, Optional[float]]:
+    """
+    Returns the number of concurrent requests and the rate of the requests
+    per second, which the background tasks may send to the exercise service
+    host. See GRADER_REQUEST_LIMITS.
+    """
+    limits = settings.GRADER_REQUEST_LIMITS
+    limit = limits.get(host) or limits.get('default') or {}
+    return max(1, limit.get('concurrency', 1)), limit.get('rate')
+
+
+def map_per_host(
+        func: Callable[[T], R],
+        items: Iterable[Tuple[str, T]],
+        ) -> Iterator[Tuple[T, R]]:
+    """
+    Calls `func` for the items in threads and yields the items and the results
+    in the order of completion. Each item is given with the exercise service
+    host it is sent to, and the requests are limited per host by
+    `grader_request_limits`. An exception raised by `func` is raised again
+    when its result is yielded.
+    """
+    workers: Dict[str, _HostWorkers] = {}
+    futures: Dict[Future, T] = {}
+    try:
+        for host, item in items:
+            if host not in workers:
+                workers[host] = _HostWorkers(host, func)
+            futures[workers[host].submit(item)] = item
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        for host_workers in workers.values():
+            host_workers.shutdown()
+
+
+class _HostWorkers:
+    """
+    The threads, which call the function for the items of one host in
+    `map_per_host`. Each thread closes its database connections once, when
+    it has no more items.
+    """
+    def __init__(self, host: str, func: Callable[[T], R]) -> None:
+        self.host = host
+        self.func = func
+        self.concurrency, rate = grader_request_limits(host)
+        self.bucket = TokenBucket(rate, self.concurrency)
+        self.tasks: 'SimpleQueue[Optional[Tuple[Future, T]]]' = SimpleQueue()
+        self.threads: List[threading.Thread] = []
+
+    def submit(self, item: T) -> Future:
+        future: Future = Future()
+        self.tasks.put((future, item))
+        if len(self.threads) < self.concurrency:
+            thread = threading.Thread(
+                target=self._work,
+                name='grader-{}-{:d}'.format(self.host, len(self.threads)),
+            )
+            thread.start()
+            self.threads.append(thread)
+        return future
+
+    def shutdown(self) -> None:
+        for _thread in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self) -> None:
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    return
+                future, item = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.bucket.acquire()
+                try:
+                    future.set_result(self.func(item))
+                except BaseException as exc: # pylint: disable=broad-except
+                    future.set_exception(exc)
+        finally:
+            # Each thread has its own database connection.
+            connections.close_all()
@@ -1,7 +1,7 @@
 from django.db.models.signals import post_save, post_delete
 
 from lib.cache import CachedAbstract
-from .models import Notification
+from .models import Notification, is_changing_in_bulk, notifications_changed
 
 
 class CachedNotifications(CachedAbstract):
@@ -57,9 +57,17 @@ class CachedNotifications(CachedAbstract):
 
 
 def invalidate_notifications(sender, instance, **kwargs): # pylint: disable=unused-argument
+    if is_changing_in_bulk():
+        return
     CachedNotifications.invalidate(instance.recipient.user)
 
 
+def invalidate_notifications_many(sender, notifications, **kwargs): # pylint: disable=unused-argument
+    for user in {n.recipient.user for n in notifications}:
+        CachedNotifications.invalidate(user)
+
+
 # Automatically invalidate cache when notifications change.
 post_save.connect(invalidate_notifications, sender=Notification)
 post_delete.connect(invalidate_notifications, sender=Notification)
+notifications_changed.connect(invalidate_notifications_many, sender=Notification)
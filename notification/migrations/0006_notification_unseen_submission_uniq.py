@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_notifications(apps, schema_editor):
+    # Keep the first unseen notification of each submission and recipient.
+    Notification = apps.get_model('notification', 'Notification')
+    duplicates = (
+        Notification.objects
+        .filter(seen=False, submission__isnull=False)
+        .values('submission', 'recipient')
+        .order_by()
+        .annotate(min_id=models.Min('id'), count_id=models.Count('id'))
+        .filter(count_id__gt=1)
+    )
+    for duplicate in duplicates:
+        Notification.objects.filter(
+            submission=duplicate['submission'],
+            recipient=duplicate['recipient'],
+            seen=False,
+        ).exclude(id=duplicate['min_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0005_auto_20210812_1536'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_notifications, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('seen', False)),
+                fields=('submission', 'recipient'),
+                name='notification_unseen_submission_uniq',
+            ),
+        ),
+    ]
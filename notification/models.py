@@ -1,4 +1,10 @@
+from contextlib import contextmanager
+import threading
+from typing import Iterable, Iterator, Optional
+
 from django.db import models
+from django.db.models import prefetch_related_objects
+from django.dispatch import Signal
 from django.utils.translation import gettext_lazy as _
 
 from course.models import CourseInstance
@@ -7,6 +13,32 @@ from lib.models import UrlMixin
 from userprofile.models import UserProfile
 
 
+# Sent with the list of `notifications` after they are created or deleted in
+# bulk. The receivers invalidate the caches once per recipient instead of
+# once per notification.
+notifications_changed = Signal()
+
+_bulk_change = threading.local()
+
+
+@contextmanager
+def _changing_in_bulk() -> Iterator[None]:
+    _bulk_change.active = True
+    try:
+        yield
+    finally:
+        _bulk_change.active = False
+
+
+def is_changing_in_bulk() -> bool:
+    """
+    Tells the post_save and post_delete receivers of notifications to skip
+    the notifications, which are changed in bulk. The caches are invalidated
+    by the receivers of `notifications_changed` instead.
+    """
+    return getattr(_bulk_change, 'active', False)
+
+
 class Notification(UrlMixin, models.Model):
     """
     A user notification of some event, for example manual assessment.
@@ -54,6 +86,14 @@ class Notification(UrlMixin, models.Model):
         verbose_name = _('MODEL_NAME_NOTIFICATION')
         verbose_name_plural = _('MODEL_NAME_NOTIFICATION_PLURAL')
         ordering = ['-timestamp']
+        constraints = [
+            # A submission is notified to its submitter only once, until seen.
+            models.UniqueConstraint(
+                fields=['submission', 'recipient'],
+                condition=models.Q(seen=False),
+                name='notification_unseen_submission_uniq',
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -62,28 +102,71 @@ class Notification(UrlMixin, models.Model):
         )
 
     @classmethod
-    def send(cls, sender: UserProfile, submission: Submission) -> None:
-        for recipient in submission.submitters.all():
-            if not Notification.objects.filter(
-                submission=submission,
+    def send(cls, sender: Optional[UserProfile], submission: Submission) -> None:
+        cls.send_many([submission], sender)
+
+    @classmethod
+    def send_many(
+            cls,
+            submissions: Iterable[Submission],
+            sender: Optional[UserProfile] = None,
+            ) -> None:
+        """
+        Notifies the submitters of the submissions, who do not have an unseen
+        notification of the submission yet.
+        """
+        submissions = list(submissions)
+        if not submissions:
+            return
+        prefetch_related_objects(
+            submissions,
+            'exercise__course_module__course_instance',
+            'submitters__user',
+        )
+        notified = set(
+            Notification.objects
+            .filter(submission__in=submissions, seen=False)
+            .values_list('submission_id', 'recipient_id')
+        )
+        notifications = [
+            Notification(
+                sender=sender,
                 recipient=recipient,
-                seen=False,
-            ).exists():
-                notification = Notification(
-                    sender=sender,
-                    recipient=recipient,
-                    course_instance=submission.exercise.course_instance,
-                    submission=submission,
-                )
-                notification.save()
+                course_instance=submission.exercise.course_instance,
+                submission=submission,
+            )
+            for submission in submissions
+            for recipient in submission.submitters.all()
+            if (submission.id, recipient.id) not in notified
+        ]
+        if notifications:
+            # A concurrent request may have notified some of the submitters.
+            Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+            notifications_changed.send(sender=cls, notifications=notifications)
+
+    @classmethod
+    def remove(cls, submission: Submission) -> None:
+        cls.remove_many([submission])
 
     @classmethod
-    def remove(cls, submission):
-        Notification.objects.filter(
-            submission=submission,
-            recipient__in=submission.submitters.all(),
-            seen=False,
-        ).delete()
+    def remove_many(cls, submissions: Iterable[Submission]) -> None:
+        """
+        Removes the unseen notifications of the submissions from their
+        submitters.
+        """
+        notifications = list(
+            Notification.objects
+            .filter(
+                submission__in=list(submissions),
+                recipient__submissions=models.F('submission'),
+                seen=False,
+            )
+            .select_related('recipient__user', 'course_instance', 'submission')
+        )
+        if notifications:
+            with _changing_in_bulk():
+                Notification.objects.filter(id__in=[n.id for n in notifications]).delete()
+            notifications_changed.send(sender=cls, notifications=notifications)
 
     ABSOLUTE_URL_NAME = "notify"
 
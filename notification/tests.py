@@ -37,3 +37,20 @@ class NotificationTest(CourseTestCase):
         Notification.remove(self.submission3)
         cn = CachedNotifications(self.student)
         self.assertEqual(cn.count(), 0)
+
+    def test_send_and_remove_many(self):
+        submissions = [self.submission, self.submission2, self.submission3]
+        Notification.send(None, self.submission)
+        Notification.send_many(submissions, self.teacher.userprofile)
+        self.assertEqual(Notification.objects.filter(recipient=self.student.userprofile).count(), 3)
+        self.assertEqual(Notification.objects.filter(recipient=self.user.userprofile).count(), 1)
+        self.assertEqual(CachedNotifications(self.student).count(), 3)
+        self.assertEqual(CachedNotifications(self.user).count(), 1)
+
+        # The submitters are notified only once until they see the notification.
+        Notification.send_many(submissions)
+        self.assertEqual(Notification.objects.count(), 4)
+
+        Notification.remove_many([self.submission, self.submission3])
+        self.assertEqual(CachedNotifications(self.student).count(), 1)
+        self.assertEqual(CachedNotifications(self.user).count(), 0)